@@ -0,0 +1,34 @@
+"""
+helpers shared by the benchmarks: the src dir on the path and a generated vault
+"""
+
+import sys
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+sys.path.insert(0, str(SRC_DIR))
+
+from notes.note import NoteType, NoteVariant  # noqa: E402
+
+# the basic regex of examples/vault/.obsankipy/config.yaml
+BASIC_REGEX = r"(?<=#spaced)\s*\n([\s\S]*?)\n([\s\S]*?(?=\+\+\+|---|<!--|$(?![\r\n])))"
+NOTE_TYPES = [NoteType(regexes=[BASIC_REGEX], note_variant=NoteVariant.BASIC)]
+
+
+def generate_vault(path: Path, files: int, notes_per_file: int, filler_lines: int) -> Path:
+    """
+    writes a vault of files with notes that have links, math and embedded images,
+    followed by filler text that is never part of a note. An existing vault is reused
+    """
+    if path.exists():
+        return path
+    path.mkdir(parents=True)
+    for i in range(files):
+        notes = "".join(
+            f"#spaced\nQuestion {i}-{j} with [[link {j}]] and $x^{j}$ ![[img{j}.png]]\n\n"
+            f"Answer {j} {'lorem ipsum ' * 20}\n+++\n\n"
+            for j in range(notes_per_file)
+        )
+        text = f"---\ntags: bench\n---\n{notes}" + "filler text\n" * filler_lines
+        (path / f"file{i}.md").write_text(text, encoding="utf-8")
+    return path
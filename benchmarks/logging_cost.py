@@ -0,0 +1,113 @@
+"""
+cpu time and peak memory of the paths that log: a media upload sent to AnkiConnect,
+get_ids on a large collection and a scan of a generated vault. AnkiConnect is stubbed,
+the log records go to /dev/null.
+
+    python benchmarks/logging_cost.py
+    python benchmarks/logging_cost.py --debug   # the same with --debug, every record is built
+
+without --debug the debug records are dropped before their message is built, so the
+upload only costs building its payload and get_ids does not format the IDs
+"""
+
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from common import NOTE_TYPES, generate_vault
+
+from anki.manager import AnkiManager
+from anki.requests import AnkiMultiRequest, AnkiStoreMediaFileRequest
+from sync.plan import PlannedMedia
+from utils.helpers import setup_root_logger
+from vault import VaultManager
+
+
+class StubResponse:
+    def __init__(self, result):
+        self.content = json.dumps({"result": result, "error": None}).encode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def measure(label: str, repeat: int, function) -> None:
+    """prints the best cpu time of repeat calls and the peak memory of one more"""
+    cpu = []
+    for _ in range(repeat):
+        start = time.process_time()
+        function()
+        cpu.append(time.process_time() - start)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{label:<40} cpu {min(cpu):7.3f}s  peak {peak / 1e6:7.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--debug", action="store_true", help="configure the logger as with --debug")
+    parser.add_argument("--medias", type=int, default=20)
+    parser.add_argument("--media-mb", type=int, default=3)
+    parser.add_argument("--ids", type=int, default=300_000)
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="obsankipy-bench-") as tmp:
+        cwd = os.getcwd()
+        # with --debug the log file is written to the working directory
+        os.chdir(tmp)
+        try:
+            run(Path(tmp), args)
+        finally:
+            os.chdir(cwd)
+
+
+def run(workdir: Path, args: argparse.Namespace) -> None:
+    setup_root_logger(args.debug)
+    for handler in logging.getLogger("").handlers:
+        if isinstance(handler, logging.StreamHandler) and not isinstance(handler, logging.FileHandler):
+            handler.setStream(open(os.devnull, "w"))
+
+    media = workdir / "media.bin"
+    media.write_bytes(os.urandom(args.media_mb * 1024 * 1024))
+    medias = []
+    for i in range(args.medias):
+        planned = PlannedMedia(filename=f"media{i}.png", vault="bench", path=f"media{i}.png", size=media.stat().st_size)
+        planned.absolute_path = str(media)
+        medias.append(planned)
+    upload = AnkiMultiRequest([AnkiStoreMediaFileRequest(m) for m in medias])
+
+    ids = list(range(10**12, 10**12 + args.ids))
+    manager = AnkiManager("http://127.0.0.1:8765")
+
+    manager._post = lambda payload: StubResponse([{"result": "stored", "error": None}] * args.medias)
+    measure(f"upload {args.medias} x {args.media_mb} MB", args.repeat, lambda: manager._invoke_request(upload))
+    measure(
+        "  building the payload alone",
+        args.repeat,
+        lambda: json.dumps(upload.to_anki_dict()).encode("utf-8"),
+    )
+
+    manager._post = lambda payload: StubResponse(ids)
+    measure(f"get_ids with {args.ids} ids", args.repeat, manager.get_ids)
+
+    vault = generate_vault(workdir / "vault", args.files, notes_per_file=25, filler_lines=300)
+
+    def scan():
+        vault_manager = VaultManager(vault, note_types=NOTE_TYPES)
+        vault_manager.set_new_files([])
+        vault_manager.get_notes_from_new_files()
+
+    measure(f"scan of {args.files} files", args.repeat, scan)
+
+
+if __name__ == "__main__":
+    main()
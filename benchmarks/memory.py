@@ -0,0 +1,72 @@
+"""
+memory retained by a scan of a generated vault: the Note, Field and Media objects use
+__slots__, and the files release their text once they are unchanged or scanned.
+
+    python benchmarks/memory.py
+    python benchmarks/memory.py --keep-content   # the files keep their text, as before the release
+
+prints the memory retained after the scan, the peak during it, and the files
+that allocated most of the retained memory
+"""
+
+import argparse
+import gc
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from common import NOTE_TYPES, SRC_DIR, generate_vault
+
+from files import File
+from vault import VaultManager
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=400)
+    parser.add_argument("--changed", type=int, default=200, help="files scanned for notes, the others are unchanged")
+    parser.add_argument("--notes-per-file", type=int, default=25)
+    parser.add_argument("--filler-lines", type=int, default=300)
+    parser.add_argument("--vault", type=Path, help="where the vault is generated, reused if it exists")
+    parser.add_argument("--keep-content", action="store_true", help="never release the text of the files")
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    vault = args.vault or Path(tempfile.gettempdir()) / (
+        f"obsankipy-bench-{args.files}-{args.notes_per_file}-{args.filler_lines}"
+    )
+    generate_vault(vault, args.files, args.notes_per_file, args.filler_lines)
+    if args.keep_content:
+        File.release_content = lambda self: None
+    # markdown and frontmatter are imported by the first scan, they are not counted
+    warm_up = VaultManager(vault, note_types=NOTE_TYPES, file_paths=[next(vault.glob("*.md"))])
+    warm_up.set_new_files([])
+    warm_up.get_notes_from_new_files()
+    del warm_up
+
+    tracemalloc.start()
+    start = time.process_time()
+    manager = VaultManager(vault, note_types=NOTE_TYPES)
+    manager.set_new_files([file.original_hash for file in manager.files[args.changed:]])
+    notes = manager.get_notes_from_new_files()
+    cpu = time.process_time() - start
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    print(
+        f"{len(manager.files)} files, {len(manager.new_files)} scanned, {len(notes.notes)} notes"
+        f"{' (content kept)' if args.keep_content else ''}"
+    )
+    print(f"retained {retained / 1e6:.1f} MB, peak {peak / 1e6:.1f} MB, cpu {cpu:.2f}s")
+    for stat in snapshot.statistics("filename")[: args.top]:
+        filename = Path(stat.traceback[0].filename)
+        if filename.is_relative_to(SRC_DIR):
+            filename = filename.relative_to(SRC_DIR)
+        print(f"  {stat.size / 1e6:6.1f} MB  {filename}")
+
+
+if __name__ == "__main__":
+    main()
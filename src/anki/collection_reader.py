@@ -0,0 +1,218 @@
+import json
+import logging
+import shutil
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# anki stores the deck names with this separator instead of ::
+DECK_NAME_SEPARATOR = "\x1f"
+
+
+class AnkiCollectionReader:
+    """
+    reads the state of a local anki collection straight from its sqlite file, the writes still go
+    through AnkiConnect. Only the queries obsankipy makes are answered, the methods return None for
+    the others so the caller asks AnkiConnect instead.
+    The file is opened read-only. A running anki keeps an exclusive lock on it, the reader then works
+    on a copy that is taken again whenever the collection file changes
+    """
+
+    path: Path
+    media_dir: Path
+    _connection: Optional[sqlite3.Connection]
+    _snapshot_dir: Optional[tempfile.TemporaryDirectory]
+    _snapshot_signature: Optional[Tuple]
+
+    def __init__(self, path: Path, media_dir: Optional[Path] = None):
+        self.path = Path(path)
+        # collection.anki2 keeps its medias in collection.media
+        self.media_dir = media_dir if media_dir is not None else self.path.with_suffix(".media")
+        self._connection = None
+        self._snapshot_dir = None
+        self._snapshot_signature = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._connection is not None and self._snapshot_dir is not None:
+            if self._snapshot_signature != self._signature():
+                self._connection.close()
+                self._connection = self._open_snapshot()
+        if self._connection is None:
+            try:
+                self._connection = self._open_read_only()
+            except sqlite3.OperationalError as e:
+                logger.debug("cannot open %s directly (%s), reading a copy", self.path, e)
+                self._connection = self._open_snapshot()
+        return self._connection
+
+    def _open_read_only(self) -> sqlite3.Connection:
+        if not self.path.is_file():
+            raise FileNotFoundError(f"no such file: {self.path}")
+        connection = sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True)
+        try:
+            # fails right away when anki holds the lock, not on the first real query
+            connection.execute("SELECT count() FROM sqlite_master").fetchone()
+        except sqlite3.OperationalError:
+            connection.close()
+            raise
+        return connection
+
+    def _signature(self) -> Tuple:
+        signature = []
+        for path in (self.path, Path(f"{self.path}-wal")):
+            try:
+                stat = path.stat()
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _open_snapshot(self) -> sqlite3.Connection:
+        if self._snapshot_dir is None:
+            self._snapshot_dir = tempfile.TemporaryDirectory(prefix="obsankipy_collection_")
+        start = time.perf_counter()
+        self._snapshot_signature = self._signature()
+        snapshot = Path(self._snapshot_dir.name) / self.path.name
+        shutil.copyfile(self.path, snapshot)
+        wal = Path(f"{self.path}-wal")
+        snapshot_wal = Path(f"{snapshot}-wal")
+        if wal.exists():
+            shutil.copyfile(wal, snapshot_wal)
+        elif snapshot_wal.exists():
+            snapshot_wal.unlink()
+        logger.debug("copied %s in %.3fs", self.path, time.perf_counter() - start)
+        return sqlite3.connect(snapshot)
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        if self._snapshot_dir is not None:
+            self._snapshot_dir.cleanup()
+            self._snapshot_dir = None
+
+    def find_notes(self, query: str) -> Optional[Set[int]]:
+        """
+        the IDs of the notes matching one of the queries obsankipy sends to findNotes:
+        every note, tag:X or added:N
+        """
+        where = _where_clause(query, id_column="id", tags_column="tags")
+        if where is None:
+            return None
+        sql, params = where
+        return {row[0] for row in self._db().execute(f"SELECT id FROM notes{sql}", params)}
+
+    def find_cards(self, query: str) -> Optional[Set[int]]:
+        """
+        the IDs of the cards matching one of the queries obsankipy sends to findCards:
+        every card, nid:X or added:N
+        """
+        if query.startswith("nid:"):
+            try:
+                note_ids = [int(note_id) for note_id in query[len("nid:") :].split(",")]
+            except ValueError:
+                return None
+            placeholders = ",".join("?" * len(note_ids))
+            rows = self._db().execute(
+                f"SELECT id FROM cards WHERE nid IN ({placeholders})", note_ids
+            )
+            return {row[0] for row in rows}
+        where = _where_clause(query, id_column="id", tags_column=None)
+        if where is None:
+            return None
+        sql, params = where
+        return {row[0] for row in self._db().execute(f"SELECT id FROM cards{sql}", params)}
+
+    def cards_of_notes(self, note_ids: Iterable[int]) -> Dict[int, List[int]]:
+        """
+        the card IDs of each note in a single query, the notes without cards map to an empty list
+        """
+        note_ids = list(note_ids)
+        cards = {note_id: [] for note_id in note_ids}
+        # sqlite limits the number of parameters of a query
+        for start in range(0, len(note_ids), 900):
+            chunk = note_ids[start : start + 900]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._db().execute(
+                f"SELECT nid, id FROM cards WHERE nid IN ({placeholders}) ORDER BY id", chunk
+            )
+            for note_id, card_id in rows:
+                cards[note_id].append(card_id)
+        return cards
+
+    def note_ids_by_guid(self, guids: Iterable[str]) -> Dict[str, int]:
+        guids = list(guids)
+        note_ids = {}
+        for start in range(0, len(guids), 900):
+            chunk = guids[start : start + 900]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._db().execute(
+                f"SELECT guid, id FROM notes WHERE guid IN ({placeholders})", chunk
+            )
+            note_ids.update(rows)
+        return note_ids
+
+    def deck_names(self) -> List[str]:
+        return [name for _, name in self._decks()]
+
+    def count_cards(self, decks: Iterable[str]) -> int:
+        decks = set(decks)
+        deck_ids = [deck_id for deck_id, name in self._decks() if name in decks]
+        if not deck_ids:
+            return 0
+        placeholders = ",".join("?" * len(deck_ids))
+        return self._db().execute(
+            f"SELECT count() FROM cards WHERE did IN ({placeholders})", deck_ids
+        ).fetchone()[0]
+
+    def media_names(self) -> Optional[List[str]]:
+        if not self.media_dir.is_dir():
+            return None
+        return [path.name for path in self.media_dir.iterdir() if path.is_file()]
+
+    def _decks(self) -> List[Tuple[int, str]]:
+        db = self._db()
+        has_decks_table = db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'decks'"
+        ).fetchone()
+        if has_decks_table:
+            return [
+                (deck_id, name.replace(DECK_NAME_SEPARATOR, "::"))
+                for deck_id, name in db.execute("SELECT id, name FROM decks")
+            ]
+        # collections older than anki 2.1.28 keep the decks as JSON in the col table
+        decks = json.loads(db.execute("SELECT decks FROM col").fetchone()[0])
+        return [(int(deck["id"]), deck["name"]) for deck in decks.values()]
+
+
+def _where_clause(
+    query: str, id_column: str, tags_column: Optional[str]
+) -> Optional[Tuple[str, list]]:
+    """
+    translates the few anki searches obsankipy makes, None for anything else
+    """
+    if query == "":
+        return "", []
+    if query.startswith("added:"):
+        try:
+            days = int(query[len("added:") :])
+        except ValueError:
+            return None
+        # IDs are creation timestamps in milliseconds. anki counts the days from its own day
+        # rollover, starting a whole day earlier returns a few more IDs that the callers filter
+        since_ms = int((time.time() - (days + 1) * 86400) * 1000)
+        return f" WHERE {id_column} >= ?", [since_ms]
+    if query.startswith("tag:") and tags_column is not None:
+        tag = query[len("tag:") :].lower()
+        if not tag or any(char in tag for char in "*_%\" "):
+            return None
+        # the tags are stored as " tag1 tag2 ", a tag search also matches the children tags
+        return (
+            f" WHERE lower({tags_column}) LIKE ? OR lower({tags_column}) LIKE ?",
+            [f"% {tag} %", f"% {tag}::%"],
+        )
+    return None
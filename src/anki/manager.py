@@ -1,9 +1,10 @@
+import base64
 import json
 import logging
+import sqlite3
+import time
 from collections import defaultdict
-from typing import Dict, List, Set, Tuple, Any, Optional, Union
-
-import requests
+from typing import Dict, Iterable, List, Set, Tuple, Any, Optional, Union
 
 from anki.requests import (
     AnkiGetMediaFilesNamesRequest,
@@ -15,63 +16,217 @@ from anki.requests import (
     AnkiFindNotesRequest,
     AnkiChangeDeckRequest,
     AnkiDeleteNotesRequest,
+    AnkiDeleteMediaFileRequest,
+    AnkiAddTagsRequest,
+    AnkiRemoveTagsRequest,
     AnkiCreateDeckRequest,
     AnkiFindCardsRequest,
+    AnkiDeckNamesRequest,
+    AnkiGetDeckStatsRequest,
+    AnkiFindModelsByNameRequest,
+    AnkiNotesInfoRequest,
+    AnkiUpdateNoteFieldsRequest,
+)
+from anki.collection_reader import AnkiCollectionReader
+from anki.media_digests import AnkiMediaDigests
+from anki.utils import (
+    AnkiMultiRequestError,
+    T,
+    _create_multi_request,
+    _parse,
+    summarize_payload,
 )
-from anki.utils import _create_multi_request, _parse, T
-from media import Media
-from notes.note import Note
+from sync.plan import PlannedMedia, PlannedNote
 from utils.constants import SUPPORTED_IMAGE_EXTS, SUPPORTED_AUDIO_EXTS
+from utils.helpers import compute_hash
+from utils.metrics import Metrics
 
 logger = logging.getLogger(__name__)
 
 
 class AnkiManager:
     """
-    This class will handle all the requests to anki
+    This class will handle all the requests to anki.
+    With a collection_reader the state queries are answered from the collection file
+    and only the changes are sent to AnkiConnect
     """
 
-    def __init__(self, url: str) -> None:
+    def __init__(
+        self,
+        url: str,
+        metrics: Optional[Metrics] = None,
+        collection_reader: Optional[AnkiCollectionReader] = None,
+    ) -> None:
         self.url = url
-        logger.debug(f"Initializing AnkiManager with URL: {url}")
+        self.metrics = metrics
+        self.collection_reader = collection_reader
+        self._session = None
+        logger.debug("Initializing AnkiManager with URL: %s", url)
+
+    def _read(self, method: str, *args) -> Any:
+        """
+        asks the collection reader, None means AnkiConnect has to answer: there is no reader,
+        it does not support the query, or the collection cannot be read (the reader is then
+        dropped for the rest of the run)
+        """
+        if self.collection_reader is None:
+            return None
+        start = time.perf_counter()
+        try:
+            result = getattr(self.collection_reader, method)(*args)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(
+                "⚠️ Cannot read the Anki collection %s (%s), asking AnkiConnect instead",
+                self.collection_reader.path,
+                e,
+            )
+            self.collection_reader.close()
+            self.collection_reader = None
+            return None
+        if result is not None:
+            logger.debug(
+                "%s answered from the collection in %.3fs", method, time.perf_counter() - start
+            )
+        return result
+
+    def _post(self, payload: bytes):
+        """
+        requests is imported on the first call, so runs where nothing changed never load it,
+        the session keeps the connection to AnkiConnect alive between the calls of a run
+        """
+        if self._session is None:
+            import requests
+
+            self._session = requests.Session()
+        return self._session.post(self.url, data=payload)
 
     def _invoke_request(self, request: T) -> Any:
         """Do the action with the specified parameters."""
         payload = json.dumps(request.to_anki_dict()).encode("utf-8")
-        response = requests.post(self.url, data=payload)
-        logger.debug(
-            f"sending a request to anki with the following payload: {payload} to the following url: {self.url}"
-        )
-        # multi response will return a result list containing multiple results, we should parse them all
+        start = time.perf_counter()
+        response = self._post(payload)
+        if self.metrics is not None:
+            self.metrics.record_anki_request(
+                _action_label(request),
+                bytes_sent=len(payload),
+                bytes_received=len(response.content),
+                wall_seconds=time.perf_counter() - start,
+            )
+        if logger.isEnabledFor(logging.DEBUG):
+            # a media upload can weigh hundreds of MB, only a summary is logged
+            logger.debug("sent %s to %s", summarize_payload(request, payload), self.url)
+        # multi response will return a result list containing multiple results, we should parse them all.
+        # anki applies each action on its own, a failed one does not undo the others
         if isinstance(request, AnkiMultiRequest):
-            return [_parse(r) for r in _parse(response)]
+            results = []
+            errors = {}
+            for index, item in enumerate(_parse(response)):
+                try:
+                    results.append(_parse(item))
+                except Exception as e:
+                    results.append(None)
+                    errors[index] = str(e)
+            if errors:
+                raise AnkiMultiRequestError(results, errors)
+            return results
         return _parse(response)
 
-    def get_ids(self) -> Set[int]:
-        """Get a set of the currently used card IDs."""
+    def get_ids(self, query: str = "") -> Set[int]:
+        """Get a set of the currently used card IDs, an empty query matches every note."""
         logger.debug("Get a set of the currently used card IDs.")
-        requestJson = AnkiFindNotesRequest()
-        response = self._invoke_request(requestJson)
-        response = set(response)
-        logger.debug(f"found the following ids in anki: {response}")
+        response = self._read("find_notes", query)
+        if response is None:
+            requestJson = AnkiFindNotesRequest(query)
+            response = self._invoke_request(requestJson)
+            response = set(response)
+        logger.debug("found %s ids in anki", len(response))
         return response
 
+    def get_note_ids_by_guid(self, guids: List[str]) -> Optional[Dict[str, int]]:
+        """
+        AnkiConnect cannot search by GUID, None when there is no collection reader
+        """
+        return self._read("note_ids_by_guid", guids)
+
+    def get_card_ids(self, query: str) -> Set[int]:
+        card_ids = self._read("find_cards", query)
+        if card_ids is not None:
+            return card_ids
+        return set(self._invoke_request(AnkiFindCardsRequest(query)))
+
+    def get_deck_names(self) -> List[str]:
+        deck_names = self._read("deck_names")
+        if deck_names is not None:
+            return deck_names
+        return self._invoke_request(AnkiDeckNamesRequest())
+
+    def count_cards(self, decks: Iterable[str]) -> int:
+        decks = sorted(decks)
+        if not decks:
+            return 0
+        card_count = self._read("count_cards", decks)
+        if card_count is not None:
+            return card_count
+        stats = self._invoke_request(AnkiGetDeckStatsRequest(decks))
+        return sum(deck_stats["total_in_deck"] for deck_stats in stats.values())
+
+    def get_models(self, model_names: Iterable[str]) -> List[dict]:
+        model_names = sorted(model_names)
+        if not model_names:
+            return []
+        return self._invoke_request(AnkiFindModelsByNameRequest(model_names))
+
+    def get_media_names(self) -> List[str]:
+        media_names = self._read("media_names")
+        if media_names is not None:
+            return media_names
+        return self._invoke_request(AnkiGetMediaFilesNamesRequest())
+
     def get_medias(
-        self, fine_grained_search=False
-    ) -> Union[Dict[str, Dict[str, str]], Dict[str, Dict[str, Set[str]]]]:
-        """get a dictionary of the media files and their data stored in anki"""
-        media_file_names = self._invoke_request(AnkiGetMediaFilesNamesRequest())
-        if fine_grained_search:
-            media_file_multi_request = _create_multi_request(
-                media_file_names, AnkiRetrieveMediaFileRequest
-            )
-            result = self._invoke_request(media_file_multi_request)
+        self,
+        media_digests: Optional[AnkiMediaDigests] = None,
+        batch_size: int = 50,
+        media_file_names: Optional[Iterable[str]] = None,
+    ) -> Union[Dict[str, Dict[str, str]], Dict[str, Set[str]]]:
+        """
+        the names of the media files stored in anki, grouped in images and audios.
+        With media_digests the names are mapped to the sha256 of their content, only the files
+        missing from the digests are downloaded, batch_size files per request.
+        The names are asked to anki unless media_file_names (e.g. from the AnkiStateMirror) is given
+        """
+        if media_file_names is None:
+            media_file_names = self.get_media_names()
+        if media_digests is not None:
+            media_digests.forget_all_but(media_file_names)
+            missing = media_digests.missing(media_file_names)
+            if missing:
+                logger.info(
+                    "Fetching %s media files from anki that were never hashed...",
+                    len(missing),
+                )
+            for start in range(0, len(missing), batch_size):
+                names = missing[start : start + batch_size]
+                media_file_multi_request = _create_multi_request(
+                    names, AnkiRetrieveMediaFileRequest
+                )
+                result = self._invoke_request(media_file_multi_request)
+                for filename, data in zip(names, result):
+                    if data is False:  # deleted since it was listed
+                        continue
+                    media_digests.record(
+                        filename, compute_hash(base64.b64decode(data))
+                    )
+            media_digests.save()
+
             result_dict = defaultdict(dict)
-            for filename, data in zip(media_file_names, result):
+            for filename in media_file_names:
+                digest = media_digests.get(filename)
+                if digest is None:
+                    continue
                 if filename.endswith(tuple(SUPPORTED_IMAGE_EXTS)):
-                    result_dict["images"][filename] = data
+                    result_dict["images"][filename] = digest
                 elif filename.endswith(tuple(SUPPORTED_AUDIO_EXTS)):
-                    result_dict["audios"][filename] = data
+                    result_dict["audios"][filename] = digest
             return result_dict
         else:
             result_dict = defaultdict(set)
@@ -82,21 +237,23 @@ class AnkiManager:
                     result_dict["audios"].add(filename)
             return result_dict
 
-    def store_media_files(self, pictures: List[Media]) -> None:
-        logger.info(f"Uploading {len(pictures)} media files...")
+    def store_media_files(self, pictures: List[PlannedMedia]) -> None:
+        logger.info("Uploading %s media files...", len(pictures))
         if not pictures:
             return
         requests = [AnkiStoreMediaFileRequest(pic) for pic in pictures]
         multi_request = AnkiMultiRequest(requests)
         response = self._invoke_request(multi_request)
-        logger.debug(f"stored the following media files in anki: {response}")
+        logger.debug("stored %s media files in anki", len(response))
 
-    def adds_new_notes(self, notes: List[Note]) -> Optional[List[Tuple[Note, int]]]:
+    def adds_new_notes(
+        self, notes: List[PlannedNote]
+    ) -> Optional[List[Tuple[PlannedNote, int]]]:
         """
         here we don't need to use multi, there is already a route to add multiple notes
         we need to return a list of ids of the notes that were added in the form of IDsFileLocation
         """
-        logger.info(f"Adding {len(notes)} new notes to Anki...")
+        logger.info("Adding %s new notes to Anki...", len(notes))
         if not notes:
             logger.info("No notes to add")
             return
@@ -117,36 +274,97 @@ class AnkiManager:
                     else:
                         duplicates_count += 1
                         note = response[0]
-                        front = note.fields[0]
                         logger.warning(
-                            f"Duplicate note detected - Front: '{front.get_field_value()[:50]}...' "
-                            f"from file '{note.source_file.file_name}' was not added. "
-                            f"Note may already exist in Anki or Note ID in Obsidian may be incorrect."
+                            "Duplicate note detected - Front: '%s...' from file '%s' was not added. "
+                            "Note may already exist in Anki or Note ID in Obsidian may be incorrect.",
+                            note.front[:50],
+                            note.path,
                         )
 
             if add_response_no_duplicates:
                 add_response = add_response_no_duplicates
-                logger.info(f"Successfully added {len(add_response)} notes to Anki")
+                logger.info("Successfully added %s notes to Anki", len(add_response))
                 if duplicates_count > 0:
-                    logger.warning(f"Skipped {duplicates_count} duplicate notes")
+                    logger.warning("Skipped %s duplicate notes", duplicates_count)
             else:
                 logger.warning("No notes were added - all were duplicates")
 
             return add_response
         except Exception as e:
-            logger.error(f"Failed to add notes to Anki: {e}")
+            logger.error("Failed to add notes to Anki: %s", e)
             raise
 
-    def updates_existing_notes(self, notes: List[Note]) -> None:
-        logger.info(f"Updating {len(notes)} existing notes...")
+    def find_added_notes(
+        self, notes: List[PlannedNote], since_ms: int
+    ) -> List[Optional[int]]:
+        """
+        the IDs of the given notes that anki already has, in their order and None for the others.
+        The note IDs are the creation time in ms, so only the notes created since since_ms are looked at,
+        a note matches when it has the same model and front
+        """
+        elapsed_days = (time.time() * 1000 - since_ms) / 86_400_000
+        # added:N counts the days from the day rollover of anki, one more day covers it
+        candidates = sorted(
+            note_id
+            for note_id in self.get_ids(f"added:{int(elapsed_days) + 2}")
+            if note_id >= since_ms
+        )
+        if not candidates:
+            return [None] * len(notes)
+        notes_info = self._invoke_request(AnkiNotesInfoRequest(candidates))
+        found = defaultdict(list)
+        for note_info in notes_info:
+            if not note_info:
+                continue
+            fields = sorted(note_info["fields"].values(), key=lambda field: field["order"])
+            front = fields[0]["value"] if fields else ""
+            found[(note_info["modelName"], front)].append(note_info["noteId"])
+
+        note_ids = []
+        for note in notes:
+            matches = found.get((note.model_name, note.front))
+            note_ids.append(matches.pop(0) if matches else None)
+        logger.debug(
+            "found %s of %s notes already added to anki",
+            sum(note_id is not None for note_id in note_ids),
+            len(notes),
+        )
+        return note_ids
+
+    def updates_existing_notes(self, notes: List[PlannedNote]) -> None:
+        logger.info("Updating %s existing notes...", len(notes))
         if not notes:
             return
         multi_request = _create_multi_request(notes, AnkiUpdateNoteRequest)
         self._invoke_request(multi_request)
 
+    def get_notes_fields(self, note_ids: List[int]) -> Dict[int, Dict[str, str]]:
+        """
+        the current fields of the notes, the notes missing from anki are left out
+        """
+        if not note_ids:
+            return {}
+        notes_info = self._invoke_request(AnkiNotesInfoRequest(note_ids))
+        return {
+            note_info["noteId"]: {
+                name: field["value"] for name, field in note_info["fields"].items()
+            }
+            for note_info in notes_info
+            if note_info
+        }
+
+    def update_notes_fields(self, notes_fields: Dict[int, Dict[str, str]]) -> None:
+        if not notes_fields:
+            return
+        requests = [
+            AnkiUpdateNoteFieldsRequest(note_id, fields)
+            for note_id, fields in notes_fields.items()
+        ]
+        self._invoke_request(AnkiMultiRequest(requests))
+
     def get_cards_ids_from_note(
-        self, notes: List[Note]
-    ) -> tuple[Note, list[int]] | None:
+        self, notes: List[PlannedNote]
+    ) -> tuple[PlannedNote, list[int]] | None:
         """
         We need to get the cards ids because when changing the decks of particular notes
         the ChangeDeck request works on the card id level, not note id level.
@@ -154,28 +372,77 @@ class AnkiManager:
 
         if not notes:
             return
-        multi_request = _create_multi_request(notes, AnkiFindCardsRequest)
+        cards = self._read("cards_of_notes", [note.note_id for note in notes])
+        if cards is not None:
+            return zip(notes, [cards[note.note_id] for note in notes])
+        multi_request = _create_multi_request(
+            [f"nid:{note.note_id}" for note in notes], AnkiFindCardsRequest
+        )
         response = self._invoke_request(multi_request)
         zipped_note_cards = zip(notes, response)
         return zipped_note_cards
 
-    def ensure_correct_deck(self, notes: List[Note]) -> None:
+    def ensure_correct_deck(self, notes: List[PlannedNote]) -> None:
         logger.info("Ensuring correct deck for notes in anki")
         if not notes:
             return
         multi_request = _create_multi_request(notes, AnkiChangeDeckRequest)
         self._invoke_request(multi_request)
 
-    def delete_notes(self, notes: List[Note]) -> None:
+    def delete_notes(self, notes: List[PlannedNote]) -> None:
         logger.info("deleting notes in anki")
         if not notes:
             return
-        self._invoke_request(AnkiDeleteNotesRequest(notes))
+        self._invoke_request(AnkiDeleteNotesRequest([note.note_id for note in notes]))
+
+    def delete_notes_by_ids(self, note_ids: List[int]) -> None:
+        if not note_ids:
+            return
+        self._invoke_request(AnkiDeleteNotesRequest(note_ids))
+
+    def add_tags(self, note_ids: List[int], tags: List[str]) -> None:
+        if not note_ids:
+            return
+        # anki takes the tags as a single space separated string
+        self._invoke_request(AnkiAddTagsRequest(note_ids, " ".join(tags)))
+
+    def update_tags(
+        self, tags_to_add: Dict[str, List[int]], tags_to_remove: Dict[str, List[int]]
+    ) -> None:
+        """
+        the tag changes of many notes in a single multi request, with a removeTags or an addTags
+        per tag for all the notes it changes on
+        """
+        requests = [
+            AnkiRemoveTagsRequest(note_ids, tag) for tag, note_ids in tags_to_remove.items()
+        ]
+        requests += [AnkiAddTagsRequest(note_ids, tag) for tag, note_ids in tags_to_add.items()]
+        if not requests:
+            return
+        self._invoke_request(AnkiMultiRequest(requests))
+
+    def delete_media_files(self, filenames: List[str]) -> None:
+        if not filenames:
+            return
+        multi_request = _create_multi_request(filenames, AnkiDeleteMediaFileRequest)
+        self._invoke_request(multi_request)
 
     def create_decks(self, decks: List[str]) -> None:
         if not decks:
             return
-        logger.info(f"Making sure that these Decks exist: {list(decks)}")
+        logger.info("Making sure that these Decks exist: %s", list(decks))
         requests = [AnkiCreateDeckRequest(deck) for deck in decks]
         multi_request = AnkiMultiRequest(requests)
         self._invoke_request(multi_request)
+
+
+def _action_label(request: T) -> str:
+    """
+    name used to group the requests in the metrics, a multi request made of a single
+    kind of action is reported as multi:{action} so the batches can be told apart
+    """
+    if isinstance(request, AnkiMultiRequest):
+        actions = {sub_request.action for sub_request in request.requests}
+        if len(actions) == 1:
+            return f"multi:{actions.pop()}"
+    return request.action
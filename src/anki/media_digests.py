@@ -0,0 +1,71 @@
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MEDIA_DIGESTS_FILE_NAME = ".obsankipy_anki_media_digests.json"
+
+
+class AnkiMediaDigests:
+    """
+    sha256 of the media files stored in anki, keyed by filename together with the time the
+    digest was taken (when obsankipy uploaded the file, or when it was first fetched from anki).
+    With it the fine grained media comparison only downloads the files it has never seen,
+    instead of the base64 content of every media of the collection on every run
+    """
+
+    path: Optional[Path]
+    # filename -> (sha256 of the content, time it was uploaded or fetched)
+    digests: Dict[str, Tuple[str, float]]
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path
+        self.digests = {}
+        self.load()
+
+    def load(self) -> None:
+        if self.path is None:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.loads(f.read())
+        except FileNotFoundError:
+            return
+        except json.JSONDecodeError as e:
+            logger.warning(f"Invalid JSON in {self.path}: {e}, the anki medias will be fetched again")
+            return
+        self.digests = {
+            filename: (digest, stored_at) for filename, (digest, stored_at) in saved.items()
+        }
+        logger.debug(f"Loaded the digests of {len(self.digests)} anki media files")
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(self.digests))
+
+    def get(self, filename: str) -> Optional[str]:
+        entry = self.digests.get(filename)
+        return entry[0] if entry is not None else None
+
+    def record(self, filename: str, digest: str, stored_at: Optional[float] = None) -> None:
+        self.digests[filename] = (digest, stored_at if stored_at is not None else time.time())
+
+    def missing(self, filenames: Iterable[str]) -> list[str]:
+        return [filename for filename in filenames if filename not in self.digests]
+
+    def forget_all_but(self, filenames: Iterable[str]) -> None:
+        """
+        drops the files that are no longer in anki, a file added again later is fetched again
+        """
+        filenames = set(filenames)
+        self.digests = {
+            filename: entry
+            for filename, entry in self.digests.items()
+            if filename in filenames
+        }
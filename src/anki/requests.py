@@ -5,10 +5,9 @@
 # It should also have a __init__ method that accepts an object of the type that will be converted to the dictionary
 
 
-from typing import Any, List, Protocol
+from typing import Any, Dict, List, Protocol
 
-from media import Media
-from notes.note import Note
+from sync.plan import PlannedMedia, PlannedNote
 
 
 class ToAnkiJson(Protocol):
@@ -65,7 +64,7 @@ class AnkiAddNotesRequest:
     becareful when setting the target deck, because if it does not exist, the adding procedure will fail because of ankiconnect.
     """
 
-    def __init__(self, notes: List[Note]):
+    def __init__(self, notes: List[PlannedNote]):
         self.action = "addNotes"
         self.version = 6
         self.params = {"notes": [note.to_anki_dict() for note in notes]}
@@ -169,7 +168,7 @@ class AnkiStoreMediaFileRequest:
     }
     """
 
-    def __init__(self, picture: Media):
+    def __init__(self, picture: PlannedMedia):
         self.action = "storeMediaFile"
         self.version = 6
         self.params = {"filename": picture.filename, "data": picture.data}
@@ -198,7 +197,7 @@ class AnkiUpdateNoteRequest:
     }
     """
 
-    def __init__(self, note: Note):
+    def __init__(self, note: PlannedNote):
         self.action = "updateNote"
         self.version = 6
         self.params = {"note": note.to_anki_dict()}
@@ -244,10 +243,49 @@ class AnkiFindCardsRequest:
     and an empty string returns all cards
     """
 
-    def __init__(self, note: Note):
+    def __init__(self, query: str):
         self.action = "findCards"
         self.version = 6
-        self.params = {"query": f"nid:{note.note_id}"}
+        self.params = {"query": query}
+
+    def to_anki_dict(self):
+        return self.__dict__
+
+
+class AnkiDeckNamesRequest:
+    """
+        ex:
+        {
+        "action": "deckNames",
+        "version": 6
+    }
+    """
+
+    def __init__(self):
+        self.action = "deckNames"
+        self.version = 6
+
+    def to_anki_dict(self):
+        return self.__dict__
+
+
+class AnkiGetDeckStatsRequest:
+    """
+        ex:
+        {
+        "action": "getDeckStats",
+        "version": 6,
+        "params": {
+            "decks": ["Japanese::JLPT N5", "Easy Spanish"]
+        }
+    }
+    the result is keyed by deck id, with the number of cards of each deck in total_in_deck
+    """
+
+    def __init__(self, decks: List[str]):
+        self.action = "getDeckStats"
+        self.version = 6
+        self.params = {"decks": decks}
 
     def to_anki_dict(self):
         return self.__dict__
@@ -266,7 +304,7 @@ class AnkiChangeDeckRequest:
     }
     """
 
-    def __init__(self, note: Note):
+    def __init__(self, note: PlannedNote):
         self.action = "changeDeck"
         self.version = 6
         self.params = {"cards": note.cards_ids, "deck": note.target_deck}
@@ -287,10 +325,75 @@ class AnkiDeleteNotesRequest:
     }
     """
 
-    def __init__(self, notes: List[Note]):
+    def __init__(self, note_ids: List[int]):
         self.action = "deleteNotes"
         self.version = 6
-        self.params = {"notes": [note.note_id for note in notes]}
+        self.params = {"notes": note_ids}
+
+    def to_anki_dict(self):
+        return self.__dict__
+
+
+class AnkiAddTagsRequest:
+    """
+        ex:
+        {
+        "action": "addTags",
+        "version": 6,
+        "params": {
+            "notes": [1483959289817, 1483959291695],
+            "tags": "european-languages"
+        }
+    }
+    """
+
+    def __init__(self, note_ids: List[int], tags: str):
+        self.action = "addTags"
+        self.version = 6
+        self.params = {"notes": note_ids, "tags": tags}
+
+    def to_anki_dict(self):
+        return self.__dict__
+
+
+class AnkiRemoveTagsRequest:
+    """
+        ex:
+        {
+        "action": "removeTags",
+        "version": 6,
+        "params": {
+            "notes": [1483959289817, 1483959291695],
+            "tags": "european-languages"
+        }
+    }
+    """
+
+    def __init__(self, note_ids: List[int], tags: str):
+        self.action = "removeTags"
+        self.version = 6
+        self.params = {"notes": note_ids, "tags": tags}
+
+    def to_anki_dict(self):
+        return self.__dict__
+
+
+class AnkiDeleteMediaFileRequest:
+    """
+        ex:
+        {
+        "action": "deleteMediaFile",
+        "version": 6,
+        "params": {
+            "filename": "_hello.txt"
+        }
+    }
+    """
+
+    def __init__(self, filename: str):
+        self.action = "deleteMediaFile"
+        self.version = 6
+        self.params = {"filename": filename}
 
     def to_anki_dict(self):
         return self.__dict__
@@ -316,3 +419,75 @@ class AnkiCreateDeckRequest:
 
     def to_anki_dict(self):
         return self.__dict__
+
+
+class AnkiFindModelsByNameRequest:
+    """
+        ex:
+        {
+        "action": "findModelsByName",
+        "version": 6,
+        "params": {
+            "modelNames": ["Basic", "Basic (and reversed card)"]
+        }
+    }
+    the result has the whole definition of each model: its id, type, fields, templates and css
+    """
+
+    def __init__(self, model_names: List[str]):
+        self.action = "findModelsByName"
+        self.version = 6
+        self.params = {"modelNames": model_names}
+
+    def to_anki_dict(self):
+        return self.__dict__
+
+
+class AnkiNotesInfoRequest:
+    """
+        ex:
+        {
+        "action": "notesInfo",
+        "version": 6,
+        "params": {
+            "notes": [1502298033753]
+        }
+    }
+    the result has the fields of each note as {"Front": {"value": "...", "order": 0}, ...},
+    and an empty object for the notes that do not exist
+    """
+
+    def __init__(self, note_ids: List[int]):
+        self.action = "notesInfo"
+        self.version = 6
+        self.params = {"notes": note_ids}
+
+    def to_anki_dict(self):
+        return self.__dict__
+
+
+class AnkiUpdateNoteFieldsRequest:
+    """
+        ex:
+        {
+        "action": "updateNoteFields",
+        "version": 6,
+        "params": {
+            "note": {
+                "id": 1514547547030,
+                "fields": {
+                    "Front": "new front content"
+                }
+            }
+        }
+    }
+    only the given fields are changed, the tags are left alone
+    """
+
+    def __init__(self, note_id: int, fields: Dict[str, str]):
+        self.action = "updateNoteFields"
+        self.version = 6
+        self.params = {"note": {"id": note_id, "fields": fields}}
+
+    def to_anki_dict(self):
+        return self.__dict__
@@ -0,0 +1,167 @@
+import json
+import logging
+import math
+import time
+from pathlib import Path
+from typing import Iterable, Optional, Set
+
+from anki.manager import AnkiManager
+
+logger = logging.getLogger(__name__)
+
+ANKI_STATE_FILE_NAME = ".obsankipy_anki_state.json"
+ANKI_STATE_VERSION = 1
+# anki searches added:N by days, past that it is cheaper to download everything again
+MAX_INCREMENTAL_DAYS = 30
+
+
+class AnkiStateMirror:
+    """
+    a local copy of the anki state a run needs: the note IDs, the deck names and the media names.
+    Instead of downloading the note IDs of the whole collection, a run asks anki for the notes and
+    cards added since the mirror was last checked (their IDs are creation timestamps) and for the
+    number of cards of each deck. If the cards of the mirror plus the new ones do not add up to the
+    cards anki has, something was deleted and the mirror is downloaded again. The media names are
+    asked on every run, a single request, so the media files removed by Check Media are seen too.
+    The executor updates the mirror with what it sends, and it is checked again at the end of the run
+    """
+
+    path: Optional[Path]
+    note_ids: Set[int]
+    decks: Set[str]
+    medias: Set[str]
+    card_count: Optional[int]  # cards of all the decks when the mirror was last checked
+    checked_at: float  # time of the last check, anki IDs are timestamps in milliseconds
+    # a createDeck failed during the run, the deck names are asked to anki again by check
+    decks_stale: bool
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path
+        self.note_ids = set()
+        self.decks = set()
+        self.medias = set()
+        self.card_count = None
+        self.checked_at = 0.0
+        self.decks_stale = False
+        self.load()
+
+    def load(self) -> None:
+        if self.path is None:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.loads(f.read())
+        except FileNotFoundError:
+            return
+        except json.JSONDecodeError as e:
+            logger.warning("Invalid JSON in %s: %s, the anki state will be downloaded again", self.path, e)
+            return
+        if saved.get("version") != ANKI_STATE_VERSION:
+            return
+        self.note_ids = set(saved["note_ids"])
+        self.decks = set(saved["decks"])
+        self.medias = set(saved["medias"])
+        self.card_count = saved["card_count"]
+        self.checked_at = saved["checked_at"]
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(
+                json.dumps(
+                    {
+                        "version": ANKI_STATE_VERSION,
+                        "note_ids": sorted(self.note_ids),
+                        "decks": sorted(self.decks),
+                        "medias": sorted(self.medias),
+                        "card_count": self.card_count,
+                        "checked_at": self.checked_at,
+                    }
+                )
+            )
+
+    def refresh(self, anki: AnkiManager, force_download: bool = False) -> None:
+        """
+        brings the mirror up to date with a constant number of requests,
+        or downloads it again when the cards do not add up
+        """
+        now = time.time()
+        days = math.ceil((now - self.checked_at) / 86400) + 1
+        if force_download or self.card_count is None or days > MAX_INCREMENTAL_DAYS:
+            self.download(anki)
+            return
+
+        self.decks = set(anki.get_deck_names())
+        # the media files are not counted by anything, their names are small enough to ask for all of them
+        self.medias = set(anki.get_media_names())
+        card_count = anki.count_cards(self.decks)
+        # a card created in the same millisecond as the check is counted twice at worst,
+        # which only triggers a download
+        since_ms = int(self.checked_at * 1000)
+        new_note_ids = {
+            note_id for note_id in anki.get_ids(f"added:{days}") if note_id >= since_ms
+        }
+        new_card_ids = [
+            card_id for card_id in anki.get_card_ids(f"added:{days}") if card_id >= since_ms
+        ]
+        if card_count != self.card_count + len(new_card_ids):
+            logger.info(
+                "🔄 Anki has %s cards instead of the %s expected, downloading its state again",
+                card_count,
+                self.card_count + len(new_card_ids),
+            )
+            self.download(anki)
+            return
+
+        self.note_ids |= new_note_ids
+        self.card_count = card_count
+        self.checked_at = now
+        logger.info("📥 Anki state is up to date: %s notes added since the last run", len(new_note_ids))
+        self.save()
+
+    def download(self, anki: AnkiManager) -> None:
+        logger.info("📥 Downloading the note IDs, decks and media names from Anki...")
+        now = time.time()
+        self.note_ids = anki.get_ids()
+        self.decks = set(anki.get_deck_names())
+        self.medias = set(anki.get_media_names())
+        self.card_count = anki.count_cards(self.decks)
+        self.checked_at = now
+        self.save()
+
+    def record_changes(
+        self,
+        added_note_ids: Iterable[int] = (),
+        deleted_note_ids: Iterable[int] = (),
+        decks: Iterable[str] = (),
+        medias: Iterable[str] = (),
+    ) -> None:
+        """
+        what a run sent to anki, so the next one does not have to ask for it
+        """
+        self.note_ids.update(added_note_ids)
+        self.note_ids.difference_update(deleted_note_ids)
+        self.decks.update(decks)
+        self.medias.update(medias)
+
+    def invalidate_decks(self) -> None:
+        self.decks_stale = True
+
+    def check(self, anki: AnkiManager) -> None:
+        """
+        takes the new number of cards once the run changed anki, the next run compares with it
+        """
+        if self.card_count is None:
+            return
+        now = time.time()
+        # the deck names were asked at the start of the run and the created decks were added
+        # since, they are only asked again when a deck could not be created: asking for the
+        # stats of a deck that does not exist would create it
+        if self.decks_stale:
+            self.decks = set(anki.get_deck_names())
+            self.decks_stale = False
+        self.card_count = anki.count_cards(self.decks)
+        self.checked_at = now
+        self.save()
@@ -1,11 +1,29 @@
+from collections import Counter
 from typing import List, Any, Union, Dict, TypeVar
 
-import requests
-
 from anki.requests import AnkiMultiRequest, ToAnkiJson
 
 T = TypeVar("T", bound=ToAnkiJson)  # Type T has to implement the method to_anki_dict
 
+# the debug log only shows the start of the payloads
+MAX_LOGGED_PAYLOAD_CHARS = 300
+
+
+class AnkiMultiRequestError(Exception):
+    """
+    some of the actions of a multi request failed, anki applied the others.
+    results has the result of every action, None for the failed ones, and errors
+    the error of each failed action by its index in the request
+    """
+
+    def __init__(self, results: List[Any], errors: Dict[int, str]):
+        self.results = results
+        self.errors = errors
+        first_error = next(iter(errors.values()))
+        super().__init__(
+            f"{len(errors)} of the {len(results)} actions failed, the first one with: {first_error}"
+        )
+
 
 def _create_multi_request(list_of: List[T], request_type: Any) -> AnkiMultiRequest:
     """
@@ -17,9 +35,9 @@ def _create_multi_request(list_of: List[T], request_type: Any) -> AnkiMultiReque
     return AnkiMultiRequest([request_type(object) for object in list_of])
 
 
-def _parse(response: Union[requests.Response, Dict]) -> Any:
+def _parse(response: Union["requests.Response", Dict]) -> Any:
     """Parse the received response by getting the object inside the result of a response."""
-    if isinstance(response, requests.Response):
+    if not isinstance(response, dict):  # a requests.Response
         response = response.json()
     if len(response) != 2:
         raise Exception("response has an unexpected number of fields")
@@ -30,3 +48,18 @@ def _parse(response: Union[requests.Response, Dict]) -> Any:
     if response["error"] is not None:
         raise Exception(response["error"])
     return response["result"]
+
+
+def summarize_payload(request: T, payload: bytes) -> str:
+    """
+    the actions of a request, the size of its payload and the start of it, for the debug log
+    """
+    if isinstance(request, AnkiMultiRequest):
+        actions = Counter(sub_request.action for sub_request in request.requests)
+        action = "multi[" + ", ".join(f"{n} {name}" for name, n in actions.items()) + "]"
+    else:
+        action = request.action
+    preview = payload[:MAX_LOGGED_PAYLOAD_CHARS].decode("utf-8", errors="replace")
+    if len(payload) > MAX_LOGGED_PAYLOAD_CHARS:
+        preview += "..."
+    return f"{action} ({len(payload)} bytes): {preview}"
@@ -1,6 +1,6 @@
 import logging
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 
 from notes.note import NoteType, NoteVariant
@@ -17,6 +17,16 @@ class AnkiConfig(BaseModel):
     deck_name: Optional[str] = "Default"
     tags: Optional[List[str]] = []
     fine_grained_image_search: Optional[bool] = False
+    # what happens to the anki note of a note removed from its file without #DELETE,
+    # touching it is opt-in
+    removed_notes: Literal["delete", "tag", "keep"] = "keep"
+    # collection.anki2 of the profile, when anki runs on this machine the state is read from it
+    # instead of being asked to AnkiConnect
+    collection_path: Optional[Path] = None
+
+    @field_validator("collection_path")
+    def expand_collection_path(cls, v: Optional[Path]) -> Optional[Path]:
+        return None if v is None else Path(v).expanduser()
 
 
 class VaultConfig(BaseModel):
@@ -25,6 +35,31 @@ class VaultConfig(BaseModel):
     exclude_dirs_from_scan: List[str] = Field(default_factory=list)
     exclude_dotted_dirs_from_scan: bool = True
     file_patterns_to_exclude: List[str] = Field(default_factory=list)
+    # when not set, the top level hashes_cache_dir is used, or vault/.obsankipy if that is not set either
+    hashes_cache_dir: Optional[Path] = None
+    # with git, the files that changed since the last synchronized commit are asked to git
+    # instead of hashing every file of the vault
+    change_detection: Literal["hash", "git"] = "hash"
+
+    @property
+    def name(self) -> str:
+        return self.dir_path.name
+
+    @property
+    def hashes_path(self) -> Path:
+        return self.hashes_cache_dir / f".{self.name}_file_hashes.json"
+
+    @property
+    def note_inventory_path(self) -> Path:
+        return self.hashes_cache_dir / f".{self.name}_note_inventory.json"
+
+    @property
+    def git_state_path(self) -> Path:
+        return self.hashes_cache_dir / f".{self.name}_git_state.json"
+
+    @property
+    def media_index_path(self) -> Path:
+        return self.hashes_cache_dir / f".{self.name}_media_index.json"
 
     @field_validator("dir_path", "medias_dir_path")
     def validate_and_resolve_path(cls, v: Path) -> Path:
@@ -78,36 +113,79 @@ class RegexConfig(BaseModel):
         return note_types
 
 
+class ScanConfig(BaseModel):
+    # time budget for running all the note regexes over a single file, when set the regexes
+    # run in a worker process that is killed if the budget is exceeded and the file is skipped
+    file_timeout_seconds: Optional[float] = Field(default=None, gt=0)
+    # re2 runs in linear time but does not support lookarounds, the patterns it
+    # cannot compile still run with re
+    regex_engine: Literal["re", "re2"] = "re"
+
+
 class GlobalConfig(BaseModel):
     anki: AnkiConfig
+    scan: ScanConfig = Field(default_factory=ScanConfig)
 
 
 class NewConfig(BaseModel):
     globals: "GlobalConfig"
-    vault: "VaultConfig"
+    vault: Optional["VaultConfig"] = None
+    # several vaults can be synchronized into the same anki profile in a single run
+    vaults: List["VaultConfig"] = Field(default_factory=list)
     regex: Optional["RegexConfig"] = None
     hashes_cache_dir: Annotated[
         Optional[Path],
         Field(
-            default=None, description="Path to cache dir, defaults to vault/.obsankipy"
+            default=None,
+            description="Path to cache dir, defaults to vault/.obsankipy (of the first vault)",
         ),
     ]
 
     def get_note_types(self):
         return self.regex.get_note_types()
 
+    def get_vaults(self) -> List[VaultConfig]:
+        return ([self.vault] if self.vault is not None else []) + self.vaults
+
     @model_validator(mode="after")
     def validate_paths(self) -> "NewConfig":
+        vaults = self.get_vaults()
+        if not vaults:
+            raise ValueError("⚠️ No vault configured, set either 'vault' or 'vaults'.")
+
+        if self.hashes_cache_dir is not None:
+            self.hashes_cache_dir = _resolve_existing_dir(self.hashes_cache_dir)
+
+        for vault in vaults:
+            if vault.hashes_cache_dir is not None:
+                vault.hashes_cache_dir = _resolve_existing_dir(vault.hashes_cache_dir)
+            elif self.hashes_cache_dir is not None:
+                vault.hashes_cache_dir = self.hashes_cache_dir
+            else:
+                vault.hashes_cache_dir = vault.dir_path / ".obsankipy"
+
+        # the vaults are referenced by name in the logs, the caches and the sync plans
+        names = [vault.name for vault in vaults]
+        if len(set(names)) != len(names):
+            raise ValueError(
+                "⚠️ Two vaults have the same folder name, rename the folder of one of them."
+            )
+
         if self.hashes_cache_dir is None:
-            self.hashes_cache_dir = self.vault.dir_path / ".obsankipy"
-        else:
-            resolved_path = Path(self.hashes_cache_dir).expanduser().resolve()
-            if not resolved_path.exists():
-                raise ValueError(
-                    f"⚠️ Path '{resolved_path}' does not exist. "
-                    "Check for typos or ensure you run the code from the correct directory."
-                )
-            self.hashes_cache_dir = resolved_path
+            self.hashes_cache_dir = vaults[0].hashes_cache_dir
 
-        logger.info(f"📁 The cache directory is: {self.hashes_cache_dir}")
+        for vault in vaults:
+            logger.info(
+                f"📁 The cache directory of vault {vault.name} is: {vault.hashes_cache_dir}"
+            )
         return self
+
+
+def _resolve_existing_dir(path: Path) -> Path:
+    resolved_path = Path(path).expanduser().resolve()
+    if not resolved_path.exists():
+        raise ValueError(
+            f"⚠️ Path '{resolved_path}' does not exist. "
+            "Check for typos or ensure you run the code from the correct directory."
+        )
+    return resolved_path
@@ -2,14 +2,15 @@ import hashlib
 import logging
 
 import os
-import re
-from typing import List
-
-import frontmatter
+import time
+from functools import cached_property
+from typing import List, Optional
 
 from notes.note import Note
-from utils.patterns import ID_REGEX_PATTERN
+from utils.patterns import ID_DELETE_REGEX, ID_REGEX_PATTERN
 from utils.helpers import string_insert, overwrite_file_safely, compute_hash
+from utils.profiling import get_profiler
+from utils.regex_guard import RegexScanner
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +20,8 @@ class IDFileLocation:
     This class will hold the location of the ID in the file
     """
 
+    __slots__ = ("position", "id")
+
     position: int
     id: int
 
@@ -31,6 +34,8 @@ class IDFileLocation:
 
 
 class FileNoteMetadata:
+    __slots__ = ("target_deck", "vault_name", "tags")
+
     target_deck: str
     vault_name: str
     tags: List[str]
@@ -54,16 +59,12 @@ class File:
 
     file_name: str
     path: str
-    file_note_metadata: FileNoteMetadata
-    curr_file_content: str
+    vault_name: str
+    curr_file_content: Optional[str]
     content_len: int
-    original_file_content: str
-    line_numbers: int
+    original_file_content: Optional[str]
     found_notes: List
     file_hash: str
-    tags: List[str]
-    target_deck: str
-    frontmatter: dict
     to_add_notes: List[Note]
     original_hash: str
     curr_hash: str
@@ -71,39 +72,62 @@ class File:
     def __init__(self, filepath, vault_name):
         self.path = filepath
         self.file_name = os.path.basename(filepath)
+        self.vault_name = vault_name
         self.read_file()
         self.original_hash = compute_hash(self.original_file_content.encode("utf-8"))
         self.curr_hash = self.original_hash
-        self.line_numbers = len(self.curr_file_content.split("\n"))
         self.found_notes = []
-        self.tags = self.get_tags()
-        self.target_deck = self.get_target_deck()
-        self.file_note_metadata = FileNoteMetadata(
-            target_deck=self.target_deck, vault_name=vault_name, tags=self.tags
-        )
         self.to_add_notes = []
 
     def read_file(self) -> None:
         """
         this method will read the file content and store it in self.curr_file_content
+        the frontmatter is only parsed when it is needed, most files of a run are unchanged
+        and never get scanned
         """
-        logger.debug(f"Reading file: {self.path}")
+        logger.debug("Reading file: %s", self.path)
         try:
             with open(self.path, "r", encoding="utf-8") as f:
                 self.original_file_content = f.read()
             self.curr_file_content = self.original_file_content
-
-            post = frontmatter.load(self.path)
             self.content_len = len(self.curr_file_content)
-            metadata = post.metadata
-            self.frontmatter = {k.lower(): v for k, v in metadata.items()}
 
-            logger.debug(
-                f"File read successfully: {self.content_len} characters, {len(metadata)} frontmatter fields"
+            logger.debug("File read successfully: %s characters", self.content_len)
+        except Exception as e:
+            logger.error("Failed to read file %s: %s", self.path, e)
+            raise
+
+    @cached_property
+    def frontmatter(self) -> dict:
+        # python-frontmatter pulls yaml handlers in, so it is only imported when a file is scanned
+        import frontmatter
+
+        if self.original_file_content is None:
+            raise ValueError(
+                f"the content of file {self.path} was released before its frontmatter was parsed, "
+                f"read_file has to be called again first"
             )
+        try:
+            metadata = frontmatter.loads(self.original_file_content).metadata
         except Exception as e:
-            logger.error(f"Failed to read file {self.path}: {e}")
+            logger.error("Failed to parse the frontmatter of file %s: %s", self.path, e)
             raise
+        logger.debug("%s frontmatter fields found in file %s", len(metadata), self.path)
+        return {k.lower(): v for k, v in metadata.items()}
+
+    @cached_property
+    def tags(self) -> List[str]:
+        return self.get_tags()
+
+    @cached_property
+    def target_deck(self) -> str:
+        return self.get_target_deck()
+
+    @cached_property
+    def file_note_metadata(self) -> FileNoteMetadata:
+        return FileNoteMetadata(
+            target_deck=self.target_deck, vault_name=self.vault_name, tags=self.tags
+        )
 
     def get_tags(self) -> List[str]:
         """
@@ -126,28 +150,64 @@ class File:
                 return self.frontmatter[variant]
         return "Default"
 
-    def scan_file(self, note_types: List["NoteType"]) -> List["Note"]:
+    def scan_file(
+        self, note_types: List["NoteType"], scanner: Optional[RegexScanner] = None
+    ) -> List["Note"]:
         """
         this method will scan the file content for notes
+        the scanner decides how the regexes are run, it raises a RegexTimeoutError
+        when the file does not fit in its time budget, in that case no note is created
         """
+        if scanner is None:
+            scanner = RegexScanner()
+        profiler = get_profiler()
+
+        regexes = [
+            (note_type, regex)
+            for note_type in note_types
+            for regex in note_type.regexes
+        ]
+        results = scanner.find_matches(
+            self.curr_file_content,
+            [regex + ID_REGEX_PATTERN for _, regex in regexes],
+            file_path=self.path,
+        )
 
-        for note_type in note_types:
-            for regex in note_type.regexes:
-                full_regex = regex + ID_REGEX_PATTERN
-                regex = re.compile(full_regex, re.MULTILINE)
+        for (note_type, regex), (matches, seconds) in zip(regexes, results):
+            if profiler is not None:
+                profiler.record_regex(
+                    note_type.name, regex, self.path, seconds, len(matches)
+                )
 
-                for match in regex.finditer(self.curr_file_content):
-                    note = Note(
-                        note_match=match,
-                        source_file=self,
-                        target_deck=self.target_deck,
-                        note_type=note_type,
-                        file_note_metadata=self.file_note_metadata,
+            for match in matches:
+                note_start = time.perf_counter()
+                note = Note(
+                    note_match=match,
+                    source_file=self,
+                    target_deck=self.target_deck,
+                    note_type=note_type,
+                    file_note_metadata=self.file_note_metadata,
+                )
+                if profiler is not None:
+                    profiler.record_note(
+                        self.path,
+                        match.group(0),
+                        time.perf_counter() - note_start,
                     )
-                    self.found_notes.append(note)
-        logger.debug(f"found {len(self.found_notes)} notes in file {self.path}")
+                self.found_notes.append(note)
+        logger.debug("found %s notes in file %s", len(self.found_notes), self.path)
         return self.found_notes
 
+    def release_content(self) -> None:
+        """
+        the notes keep their spans and fields, so once a file is hashed (and scanned if it changed)
+        its text is no longer needed, the executor reads the file again before writing the IDs.
+        The frontmatter is parsed when the first note of the file is found, the metadata of
+        a file released without notes can only be read after read_file
+        """
+        self.original_file_content = None
+        self.curr_file_content = None
+
     def append_to_add_notes(self, note: Note) -> None:
         """
         this method will append a note to the list of notes to add
@@ -169,6 +229,12 @@ class File:
             curr_text, [(id.position, id.get_id_string()) for id in ids]
         )
 
+    def erase_ids_marked_for_deletion(self) -> None:
+        """
+        removes the ID and DELETE marker of the notes deleted from anki, the note text stays
+        """
+        self.curr_file_content = ID_DELETE_REGEX.sub("", self.curr_file_content)
+
     def get_id_file_location_from_added_notes(self) -> List[IDFileLocation]:
         """
         we need to get the location of the last character of the answer, so we use group 2, which will be the answer
@@ -186,13 +252,13 @@ class File:
 
     def write_new_ids_to_file(self):
         logger.debug(
-            f"Writing {len(self.to_add_notes)} new note IDs to file: {self.file_name}"
+            "Writing %s new note IDs to file: %s", len(self.to_add_notes), self.file_name
         )
         id_locations = self.get_id_file_location_from_added_notes()
         self.overwrite_content_with_new_ids(id_locations)
         self.write_new_content()
         self.recompute_hash()
-        logger.debug(f"Successfully updated file {self.file_name} with new note IDs")
+        logger.debug("Successfully updated file %s with new note IDs", self.file_name)
 
     def recompute_hash(self):
         self.curr_hash = compute_hash(self.curr_file_content.encode("utf-8"))
@@ -0,0 +1,144 @@
+"""
+for the vaults kept in a git repository, the files that changed since the last synchronization
+are asked to git instead of hashing the whole vault. The commit the vault was last synchronized
+at is kept with the hash of each of its files, git lists the paths that differ from that commit
+(committed or not) and only those are read
+"""
+
+import json
+import logging
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+GIT_STATE_VERSION = 1
+
+
+class GitChanges:
+    """
+    the paths, relative to the vault, that differ between the last synchronized commit and the
+    working tree: the changed ones (untracked files included) and the deleted ones
+    """
+
+    __slots__ = ("changed", "deleted")
+
+    changed: Set[str]
+    deleted: Set[str]
+
+    def __init__(self, changed: Set[str], deleted: Set[str]):
+        self.changed = changed
+        self.deleted = deleted
+
+
+class GitState:
+    """
+    the commit a vault was last synchronized at, the hash of each of its files after that
+    synchronization, and the files the next run reads even if git does not list them: the ones
+    that differed from the commit (their changes may be reverted without git listing them again)
+    and the ones the run could not synchronize
+    """
+
+    path: Path
+    commit: Optional[str]
+    hashes: Dict[str, str]  # path relative to the vault -> hash
+    pending: List[str]
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.commit = None
+        self.hashes = {}
+        self.pending = []
+
+    @classmethod
+    def load(cls, path: Path) -> "GitState":
+        state = cls(path)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                saved = json.loads(f.read())
+        except FileNotFoundError:
+            return state
+        except json.JSONDecodeError as e:
+            logger.warning(f"Invalid JSON in {path}: {e}, the vault will be hashed again")
+            return state
+        if saved.get("version") != GIT_STATE_VERSION:
+            return state
+        state.commit = saved["commit"]
+        state.hashes = saved["hashes"]
+        state.pending = saved["pending"]
+        return state
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(
+                json.dumps(
+                    {
+                        "version": GIT_STATE_VERSION,
+                        "commit": self.commit,
+                        "hashes": self.hashes,
+                        "pending": self.pending,
+                    }
+                )
+            )
+
+
+def _git(vault_dir: Path, *args: str) -> bytes:
+    return subprocess.run(
+        ["git", "-C", str(vault_dir), *args], capture_output=True, check=True
+    ).stdout
+
+
+def get_head(vault_dir: Path) -> Optional[str]:
+    """
+    the commit checked out in the repository of the vault, None when it is not in a repository
+    """
+    try:
+        return _git(vault_dir, "rev-parse", "--verify", "HEAD").decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def find_git_changes(vault_dir: Path, since_commit: str, head: str) -> Optional[GitChanges]:
+    """
+    None when git cannot be trusted to list the changes since since_commit: it was dropped by a
+    rewrite of the history (rebase, force push) or git failed, the vault has to be hashed then
+    """
+    try:
+        _git(vault_dir, "merge-base", "--is-ancestor", since_commit, head)
+    except subprocess.CalledProcessError:
+        logger.info(
+            "📜 The last synchronized commit %s is no longer in the history, hashing the vault",
+            since_commit[:10],
+        )
+        return None
+    except OSError as e:
+        logger.warning("⚠️ Cannot run git (%s), hashing the vault", e)
+        return None
+
+    try:
+        # without a second commit the diff goes to the working tree, so the changes that are
+        # not committed are listed too. The renames are listed as a deletion and an addition
+        diff = _git(
+            vault_dir, "diff", "--name-status", "--no-renames", "-z", "--relative", since_commit, "--", "."
+        )
+        # the files git ignores are left out, they would list every file of an ignored cache or
+        # plugin folder on each run
+        untracked = _git(vault_dir, "ls-files", "--others", "--exclude-standard", "-z", "--", ".")
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.warning("⚠️ git could not list the changes of %s (%s), hashing the vault", vault_dir, e)
+        return None
+
+    changed = set()
+    deleted = set()
+    entries = diff.decode("utf-8", errors="surrogateescape").split("\0")
+    for status, path in zip(entries[0::2], entries[1::2]):
+        if status == "D":
+            deleted.add(path)
+        else:
+            changed.add(path)
+    changed.update(
+        path for path in untracked.decode("utf-8", errors="surrogateescape").split("\0") if path
+    )
+    return GitChanges(changed, deleted)
@@ -1,28 +1,44 @@
 import enum
+import json
+import os
 from pathlib import Path
+from typing import Dict, Optional
 
-from utils.helpers import file_encode
+from utils.constants import SUPPORTED_AUDIO_EXTS, SUPPORTED_IMAGE_EXTS
+from utils.helpers import compute_file_hash, file_encode
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+MEDIA_INDEX_VERSION = 1
+
 
 class MediaState(enum.Enum):
     STORED = enum.auto()
     UNKNOWN = enum.auto()
     NEW = enum.auto()
+    MISSING = enum.auto()  # no file of the media dir has its name
 
 
 class Media:
-    data: str | None
+    __slots__ = ("digest", "filename", "path", "state")
+
+    digest: str | None  # sha256 of the content, only set for the fine grained comparison
     filename: str
+    path: Path | None
     state: MediaState
 
     def __init__(self, filename: str):
         self.filename = filename
         self.state = MediaState.UNKNOWN
-        self.data = None
+        self.digest = None
+        self.path = None
+
+    @property
+    def data(self) -> str:
+        # only read when the media is sent
+        return file_encode(self.path)
 
     def to_anki_dict(self):
         return {"filename": self.filename, "data": self.data}
@@ -30,5 +46,146 @@ class Media:
     def set_state(self, state: MediaState):
         self.state = state
 
-    def load_data(self, dir_path: Path):
-        self.data = file_encode(dir_path / self.filename)
+    def load_data(self, media_index: "MediaIndex", with_digest: bool = False):
+        """
+        finds the file of the media in the index, the digest is only needed to compare
+        the media with the one stored in anki, the index keeps it between the runs
+        """
+        entry = media_index.resolve(self.filename)
+        if entry is None:
+            logger.warning(
+                "⚠️ The media %s was not found in %s, it will not be uploaded",
+                self.filename,
+                media_index.dir_path,
+            )
+            self.set_state(MediaState.MISSING)
+            return
+        self.path = media_index.dir_path / entry.path
+        if with_digest:
+            self.digest = media_index.get_hash(entry)
+
+
+class MediaIndexEntry:
+    """
+    a file of the media dir, the hash is only computed when it is asked for
+    """
+
+    __slots__ = ("path", "size", "mtime_ns", "hash")
+
+    path: str  # relative to the media dir
+    size: int
+    mtime_ns: int
+    hash: Optional[str]
+
+    def __init__(self, path: str, size: int, mtime_ns: int, hash: Optional[str] = None):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.hash = hash
+
+
+class MediaIndex:
+    """
+    the media files of a vault, found by walking its media dir (and its sub folders) once per run.
+    The embeds only have the name of the file, so it is resolved here in O(1). When two files
+    have the same name, the one closest to the media dir wins.
+    The index is saved next to the hash cache, the hashes of the files whose size and mtime did
+    not change since the previous run are kept, so only the new or modified files are read again
+    """
+
+    dir_path: Path
+    index_path: Optional[Path]
+    entries: Dict[str, MediaIndexEntry]  # relative path -> entry
+    by_name: Dict[str, MediaIndexEntry]
+
+    def __init__(self, dir_path: Path, index_path: Optional[Path] = None):
+        self.dir_path = Path(dir_path)
+        self.index_path = index_path
+        self.entries = {}
+        self.by_name = {}
+
+    @classmethod
+    def build(cls, dir_path: Path, index_path: Optional[Path] = None) -> "MediaIndex":
+        index = cls(dir_path, index_path)
+        previous = index.load_previous()
+        extensions = tuple(
+            f".{extension}" for extension in SUPPORTED_IMAGE_EXTS + SUPPORTED_AUDIO_EXTS
+        )
+        reused = 0
+        for root, dirs, files in os.walk(index.dir_path):
+            dirs.sort()
+            for file_name in sorted(files):
+                if not file_name.lower().endswith(extensions):
+                    continue
+                absolute_path = os.path.join(root, file_name)
+                stat = os.stat(absolute_path)
+                path = Path(os.path.relpath(absolute_path, index.dir_path)).as_posix()
+                entry = MediaIndexEntry(path, stat.st_size, stat.st_mtime_ns)
+                previous_entry = previous.get(path)
+                if (
+                    previous_entry is not None
+                    and previous_entry.size == entry.size
+                    and previous_entry.mtime_ns == entry.mtime_ns
+                ):
+                    entry.hash = previous_entry.hash
+                    reused += 1
+                index.add(entry)
+        logger.info(
+            "🗂️  Indexed %s media files in %s (%s unchanged since last run)",
+            len(index.entries),
+            index.dir_path,
+            reused,
+        )
+        return index
+
+    def add(self, entry: MediaIndexEntry) -> None:
+        self.entries[entry.path] = entry
+        name = entry.path.rsplit("/", 1)[-1]
+        current = self.by_name.get(name)
+        if current is None or entry.path.count("/") < current.path.count("/"):
+            if current is not None:
+                logger.debug("%s and %s have the same name, using %s", current.path, entry.path, entry.path)
+            self.by_name[name] = entry
+
+    def resolve(self, filename: str) -> Optional[MediaIndexEntry]:
+        return self.by_name.get(filename.rsplit("/", 1)[-1])
+
+    def get_hash(self, entry: MediaIndexEntry) -> str:
+        if entry.hash is None:
+            entry.hash = compute_file_hash(self.dir_path / entry.path)
+        return entry.hash
+
+    def load_previous(self) -> Dict[str, MediaIndexEntry]:
+        if self.index_path is None:
+            return {}
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                saved = json.loads(f.read())
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError as e:
+            logger.warning("Invalid JSON in media index %s: %s, rebuilding it", self.index_path, e)
+            return {}
+        if saved.get("version") != MEDIA_INDEX_VERSION:
+            return {}
+        return {
+            path: MediaIndexEntry(path, size, mtime_ns, file_hash)
+            for path, (size, mtime_ns, file_hash) in saved["files"].items()
+        }
+
+    def save(self) -> None:
+        if self.index_path is None:
+            return
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.index_path, "w", encoding="utf-8") as f:
+            f.write(
+                json.dumps(
+                    {
+                        "version": MEDIA_INDEX_VERSION,
+                        "files": {
+                            path: [entry.size, entry.mtime_ns, entry.hash]
+                            for path, entry in self.entries.items()
+                        },
+                    }
+                )
+            )
@@ -1,20 +1,116 @@
-from functools import partial
-from typing import Protocol, List, Any
+import enum
+import time
+from functools import lru_cache, partial
+from typing import Protocol, Callable, Optional, Sequence, Tuple
 
 from notes.transformers.fields import (
+    EmbeddedMedias,
     replace_with_link,
-    format_pictures_to_html_transformer,
-    format_audio_to_html_transformer,
+    format_embeds_and_find_medias,
     to_anki_math_transformer,
     create_code_blocks_transformer,
 )
 from notes.transformers.utils import create_link
+from utils.profiling import get_profiler, transformer_name
+
+
+def apply_transformers(
+    text: str, transformers: Sequence[Callable[[str], str]]
+) -> str:
+    """
+    runs the transformers in order, when profiling, the time of each one is recorded
+    """
+    profiler = get_profiler()
+    if profiler is None:
+        for transformer in transformers:
+            text = transformer(text)
+        return text
+
+    for transformer in transformers:
+        start = time.perf_counter()
+        text = transformer(text)
+        profiler.record_transformer(
+            transformer_name(transformer), time.perf_counter() - start
+        )
+    return text
+
+
+class FieldKind(enum.Enum):
+    FRONT = enum.auto()  # ends with a link to its source file
+    BACK = enum.auto()
+
+
+class FieldPipeline:
+    """
+    the transformers that turn the markdown of a field into the html sent to anki.
+    It only depends on the vault and the kind of field, so it is built once and shared
+    by the fields of every note, the source file is given when a text is rendered
+    """
+
+    __slots__ = ("vault_name", "kind", "transformers")
+
+    vault_name: str
+    kind: FieldKind
+    transformers: Tuple[Callable[[str], str], ...]
+
+    def __init__(self, vault_name: str, kind: FieldKind):
+        self.vault_name = vault_name
+        self.kind = kind
+        # freezes the vault_name parameter so we can satisfy the interface that
+        # the transformers have, which are functions that have the signature
+        # (str) -> (str), we could have created a closure but this is an alternative method
+        links_creator_transformer = partial(replace_with_link, vault_name=vault_name)
+        # the embeds are replaced before these, while their medias are collected
+        self.transformers = (
+            to_anki_math_transformer,
+            create_code_blocks_transformer,
+            links_creator_transformer,
+        )
+
+    def render(
+        self, text: str, source_file_name: Optional[str] = None
+    ) -> Tuple[str, Optional[EmbeddedMedias]]:
+        """
+        returns the html and the medias embedded in the text, see format_embeds_and_find_medias
+        """
+        profiler = get_profiler()
+        start = time.perf_counter()
+        text, medias = format_embeds_and_find_medias(text)
+        if profiler is not None:
+            profiler.record_transformer(
+                transformer_name(format_embeds_and_find_medias),
+                time.perf_counter() - start,
+            )
+        text = apply_transformers(text, self.transformers)
+        if self.kind == FieldKind.FRONT:
+            # puts a line break and the link to the file in the end of the field, the link has no
+            # [[...]] in it so it is the same whether it is appended before or after the links creator
+            text = text + "<br>" + get_file_link(self.vault_name, source_file_name)
+        return text, medias
+
+
+@lru_cache(maxsize=None)
+def get_field_pipeline(vault_name: str, kind: FieldKind) -> FieldPipeline:
+    return FieldPipeline(vault_name, kind)
+
+
+@lru_cache(maxsize=1024)
+def get_file_link(vault_name: str, file_name: str) -> str:
+    """
+    the notes of a file are built one after the other, so the link is only built once per file
+    """
+    return create_link(
+        vault_name=vault_name,
+        file_name=file_name,
+        name_alias="Obsidian",
+    )
 
 
 class NoteField(Protocol):
     field_name: str
     text: str
-    transformers: List[Any]
+    # set by transform, None when the medias have to be searched in the whole note
+    medias: Optional[EmbeddedMedias]
 
     def transform(self):
         pass
@@ -27,7 +123,11 @@ class NoteField(Protocol):
 
 
 class FrontField:
+    __slots__ = ("field_name", "text", "medias", "vault_name", "source_file_name")
+
+    field_name: str
     text: str
+    medias: Optional[EmbeddedMedias]
     vault_name: str
     source_file_name: str
 
@@ -37,32 +137,14 @@ class FrontField:
         else:
             self.field_name = field_name
         self.text = text
-        url_link_to_file = create_link(
-            vault_name=vault_name,
-            file_name=source_file_name,
-            name_alias="Obsidian",
-        )
-        append_url_transformer = (
-            lambda text: text + "<br>" + url_link_to_file
-        )  # puts a line break and the link to the file in the end of the field
-
-        # freezes the vault_name parameter so we can satisfy the interface that
-        # the transform_back and transform_front accepts, which are functions that have the signature
-        # (str) -> (str), we could have created a closure but this is an alternative method
-        links_creator_transformer = partial(replace_with_link, vault_name=vault_name)
-
-        self.transformers = [
-            format_pictures_to_html_transformer,
-            format_audio_to_html_transformer,
-            to_anki_math_transformer,
-            create_code_blocks_transformer,
-            append_url_transformer,
-            links_creator_transformer,
-        ]
+        self.medias = None
+        self.vault_name = vault_name
+        self.source_file_name = source_file_name
 
     def transform(self):
-        for transformer in self.transformers:
-            self.text = transformer(self.text)
+        self.text, self.medias = get_field_pipeline(
+            self.vault_name, FieldKind.FRONT
+        ).render(self.text, self.source_file_name)
         return self
 
     def get_field_name(self):
@@ -73,7 +155,11 @@ class FrontField:
 
 
 class BackField:
+    __slots__ = ("field_name", "text", "medias", "vault_name")
+
+    field_name: str
     text: str
+    medias: Optional[EmbeddedMedias]
     vault_name: str
 
     def __init__(self, text, vault_name, field_name=None):
@@ -82,20 +168,13 @@ class BackField:
         else:
             self.field_name = field_name
         self.text = text
-
-        links_creator_transformer = partial(replace_with_link, vault_name=vault_name)
-
-        self.transformers = [
-            format_pictures_to_html_transformer,
-            format_audio_to_html_transformer,
-            to_anki_math_transformer,
-            create_code_blocks_transformer,
-            links_creator_transformer,
-        ]
+        self.medias = None
+        self.vault_name = vault_name
 
     def transform(self):
-        for transformer in self.transformers:
-            self.text = transformer(self.text)
+        self.text, self.medias = get_field_pipeline(
+            self.vault_name, FieldKind.BACK
+        ).render(self.text)
         return self
 
     def get_field_name(self):
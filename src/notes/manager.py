@@ -1,7 +1,6 @@
-from pathlib import Path
-from typing import List, Set, Dict, Tuple, Any, Union
+from typing import List, Set, Dict, Any, Union
 
-from media import MediaState, Media
+from media import MediaIndex, MediaState, Media
 from notes.note import Note, State
 
 import logging
@@ -30,6 +29,14 @@ class NotesManager:
         self.new_audios: List[Media] = list()
         self.medias: List[Any] = [picture for note in notes for picture in note.medias]
 
+    @classmethod
+    def merge(cls, managers: List["NotesManager"]) -> "NotesManager":
+        """
+        a single manager with the notes of several others, e.g. one per vault,
+        so their anki operations can be sent in the same batches
+        """
+        return cls([note for manager in managers for note in manager.get_all_notes()])
+
     def parse_note_to_add(self, note: Note) -> None:
         self.notes_to_add.append(note)
 
@@ -58,7 +65,9 @@ class NotesManager:
             call create_source_files_add_notes_metadata to mutate the source files
         """
         logger.info(
-            f"Categorizing {len(self.notes)} notes against {len(existent_ids)} existing Anki notes..."
+            "Categorizing %s notes against %s existing Anki notes...",
+            len(self.notes),
+            len(existent_ids),
         )
 
         new_count = 0
@@ -79,7 +88,10 @@ class NotesManager:
                 new_count += 1
 
         logger.info(
-            f"Note categorization complete: {new_count} new, {existing_count} existing, {delete_count} to delete"
+            "Note categorization complete: %s new, %s existing, %s to delete",
+            new_count,
+            existing_count,
+            delete_count,
         )
         self.create_source_files_add_notes_metadata()
 
@@ -102,9 +114,16 @@ class NotesManager:
         audios_in_anki: Union[Dict[str, str], Set[str]],
     ) -> None:
         """
-        analyzes the name of the medias as well as the content of the picture to determine if it is new or not
+        analyzes the name of the medias as well as the content of the picture to determine if it is new or not,
+        the content is compared through the sha256 digests of the local and the anki files
         """
-        logger.info(f"Categorizing {len(self.medias)} media files...")
+        logger.info("Categorizing %s media files...", len(self.medias))
+        medias = [media for media in self.medias if media.state != MediaState.MISSING]
+        if len(medias) != len(self.medias):
+            logger.warning(
+                "⚠️ %s embedded media files were not found and are skipped",
+                len(self.medias) - len(medias),
+            )
 
         # if pictures_in_anki and audios_in_anki are a set, it means that the user has chosen to not compare the content of the media
         if isinstance(pictures_in_anki, set) and isinstance(audios_in_anki, set):
@@ -118,7 +137,7 @@ class NotesManager:
             new_media_count = 0
             existing_media_count = 0
 
-            for media in self.medias:
+            for media in medias:
                 if media.filename in medias_in_anki:
                     media.set_state(MediaState.STORED)
                     existing_media_count += 1
@@ -132,10 +151,10 @@ class NotesManager:
             new_media_count = 0
             existing_media_count = 0
 
-            for media in self.medias:
+            for media in medias:
                 if (
                     media.filename in medias_in_anki
-                    and media.data == medias_in_anki[media.filename]
+                    and media.digest == medias_in_anki[media.filename]
                 ):
                     media.set_state(MediaState.STORED)
                     existing_media_count += 1
@@ -144,14 +163,26 @@ class NotesManager:
                     self.new_medias.append(media)
                     new_media_count += 1
 
+        # a file embedded by several notes is only uploaded once
+        unique_new_medias = {}
+        for media in self.new_medias:
+            unique_new_medias.setdefault(media.filename, media)
+        self.new_medias = list(unique_new_medias.values())
+
         logger.info(
-            f"Media categorization complete: {new_media_count} new, {existing_media_count} existing"
+            "Media categorization complete: %s new, %s existing",
+            new_media_count,
+            existing_media_count,
         )
 
-    def load_media_data(self, path_to_directory: Path) -> None:
+    def load_media_data(self, media_index: MediaIndex, with_digest: bool = False) -> None:
+        """
+        resolves the file of each media in the index, with with_digest the files are hashed,
+        a file is only read again when its size or mtime changed since it was last hashed
+        """
         logger.info("Loading media data...")
         for media in self.medias:
-            media.load_data(Path(path_to_directory))
+            media.load_data(media_index, with_digest=with_digest)
 
     def get_media_to_add(self) -> List[Media]:
         return self.new_medias
@@ -159,9 +190,3 @@ class NotesManager:
     def get_out_of_date_files(self) -> Set["File"]:
         return set([note.source_file for note in self.notes_to_add])
 
-
-def set_new_ids(ids: List[Tuple[Note, int]]) -> None:
-    logger.info("Updating source files with new note IDs...")
-    for note, id in ids:
-        note.note_id = id
-        note.set_state(State.EXISTING)
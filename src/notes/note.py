@@ -32,6 +32,27 @@ class NoteOptions:
 
 
 class Note:
+    """
+    the match is only read while the note is built, the note keeps its spans, fields and medias
+    so the text of the file can be released once it is scanned
+    """
+
+    __slots__ = (
+        "state",
+        "note_type",
+        "note_id",
+        "cards_ids",
+        "source_file",
+        "note_start_span",
+        "note_end_span",
+        "target_deck",
+        "tags",
+        "fields",
+        "medias",
+        "file_note_metadata",
+        "id_location_in_file",
+    )
+
     state: State
     note_type: Any
     note_id: int | None
@@ -39,13 +60,10 @@ class Note:
     source_file: "File"
     note_start_span: int
     note_end_span: int
-    original_note_text: str
     target_deck: str
     tags: List[str]
     fields: List[NoteField]  # implements the interface of NoteField
-    medias: List[Any]
-    to_delete: bool
-    options: NoteOptions
+    medias: List[Media]
     file_note_metadata: "FileNoteMetadata"
     id_location_in_file: int
 
@@ -62,9 +80,7 @@ class Note:
         we should get all the other attributes
         """
         self.note_type = note_type
-        self.note_match = note_match
         self.file_note_metadata = file_note_metadata
-        self.original_note_text = note_match.group(0)
 
         named_captures = note_match.groupdict()
         self.check_state(named_captures)
@@ -72,17 +88,14 @@ class Note:
         self.source_file = source_file
         self.note_start_span = note_match.start()
         self.note_end_span = note_match.end()
-        self.curr_note_text = self.original_note_text
         self.target_deck = target_deck
         self.tags = ["Obsidian"] + self.file_note_metadata.tags
 
         self.medias = list()
-        self.audios = list()
-        self.find_medias()
-        self.create_fields()
-        self.set_id_location_in_file()
+        self.create_fields(note_match)
+        self.find_medias(note_match)
+        self.set_id_location_in_file(note_match)
 
-        self.options = NoteOptions()
         self.cards_ids = None
 
     def check_state(self, named_captures):
@@ -98,26 +111,65 @@ class Note:
             self.state = State.NEW
             self.note_id = None
 
-    def set_id_location_in_file(self):
+    def set_id_location_in_file(self, note_match):
         if self.note_type.note_type == NoteVariant.CLOZE:
-            self.id_location_in_file = self.note_match.end(
+            self.id_location_in_file = note_match.end(
                 1
             )  # because there is no back field
         else:
-            self.id_location_in_file = self.note_match.end(2)
+            self.id_location_in_file = note_match.end(2)
+
+    def find_medias(self, note_match):
+        """
+        the fields collect the medias embedded in them while they are rendered, the whole note
+        is only searched again when that could give a different result: when a field could not
+        collect them, when the text around the fields has an embed or when an embed could
+        continue past the end of a field (fields that end in a line break cannot be crossed)
+        """
+        field_groups = [1] if self.note_type.note_type == NoteVariant.CLOZE else [1, 2]
+        note_text = note_match.group(0)
+        fields_have_all_medias = all(field.medias is not None for field in self.fields)
+        position = 0
+        for group in field_groups:
+            # spans relative to the note text
+            start = note_match.start(group) - note_match.start()
+            end = note_match.end(group) - note_match.start()
+            if "![" in note_text[position:start]:
+                fields_have_all_medias = False
+            if end < len(note_text) and "\n" not in note_text[end - 1 : end + 1]:
+                fields_have_all_medias = False
+            position = max(position, end)
+        if "![" in note_text[position:]:
+            fields_have_all_medias = False
+
+        if not fields_have_all_medias:
+            self.find_medias_in_text(note_text)
+        else:
+            # in the order the patterns are searched in find_medias_in_text
+            for field in self.fields:
+                for file_name in field.medias.wikilink_images:
+                    self.medias.append(Media(filename=file_name))
+            for field in self.fields:
+                for file_name in field.medias.markdown_images:
+                    self.medias.append(Media(filename=file_name))
+            for field in self.fields:
+                for file_name in field.medias.audios:
+                    self.medias.append(Media(filename=file_name))
+        for field in self.fields:
+            field.medias = None
 
-    def find_medias(self):
-        for match in IMAGE_FILE_WIKILINK_REGEX.finditer(self.original_note_text):
+    def find_medias_in_text(self, note_text: str):
+        for match in IMAGE_FILE_WIKILINK_REGEX.finditer(note_text):
             full_file_name = f"{match.group('filename')}.{match.group('extension')}"
             pic = Media(filename=full_file_name)
             self.medias.append(pic)
-        for match in IMAGE_FILE_MARKDOWN_REGEX.finditer(self.original_note_text):
+        for match in IMAGE_FILE_MARKDOWN_REGEX.finditer(note_text):
             full_file_name = unquote(
                 f"{match.group('filename')}.{match.group('extension')}"
             )
             pic = Media(filename=full_file_name)
             self.medias.append(pic)
-        for match in AUDIO_FILE_REGEX.finditer(self.original_note_text):
+        for match in AUDIO_FILE_REGEX.finditer(note_text):
             full_file_name = f"{match.group('filename')}.{match.group('extension')}"
             audio = Media(filename=full_file_name)
             self.medias.append(audio)
@@ -125,7 +177,7 @@ class Note:
     def set_state(self, state):
         self.state = state
 
-    def create_fields(self):
+    def create_fields(self, note_match):
         if (
             self.note_type.note_type == NoteVariant.BASIC
             or self.note_type.note_type == NoteVariant.BASIC_AND_REVERSED_CARD
@@ -134,8 +186,8 @@ class Note:
             vault_name = self.source_file.file_note_metadata.vault_name
             file_name = self.source_file.file_name
             self.fields = [
-                FrontField(self.note_match.group(1), vault_name, file_name),
-                BackField(self.note_match.group(2), vault_name),
+                FrontField(note_match.group(1), vault_name, file_name),
+                BackField(note_match.group(2), vault_name),
             ]
         elif self.note_type.note_type == NoteVariant.CLOZE:
             vault_name = self.source_file.file_note_metadata.vault_name
@@ -143,7 +195,7 @@ class Note:
             # use the FrontField because the transformations will be the same, just change the field name
             self.fields = [
                 FrontField(
-                    self.note_match.group(1), vault_name, file_name, field_name="Text"
+                    note_match.group(1), vault_name, file_name, field_name="Text"
                 )
             ]
 
@@ -1,16 +1,15 @@
 import re
-
-import markdown
-from markdown.extensions.codehilite import CodeHiliteExtension
+import threading
+from typing import List, Optional, Tuple
+from urllib.parse import unquote
 
 from notes.transformers.utils import create_link
 from utils.patterns import (
-    IMAGE_FILE_WIKILINK_REGEX,
-    AUDIO_FILE_REGEX,
+    EMBED_TO_HTML_REGEX,
+    EMBED_TOKEN_REGEX,
     OBSIDIAN_LINKS_REGEX,
     OBS_INLINE_MATH_REGEX,
     OBS_DISPLAY_MATH_REGEX,
-    IMAGE_URL_REGEX,
 )
 
 
@@ -45,41 +44,112 @@ def to_anki_math_transformer(text: str) -> str:
     return text
 
 
+_markdown_renderers = threading.local()
+
+
+def _get_markdown_renderer():
+    """
+    markdown (and pygments through codehilite) are only imported when the first field is rendered,
+    so runs where nothing changed do not pay for them. Building the renderer loads every extension,
+    so it is built once per thread and reset between fields instead of once per field
+    """
+    renderer = getattr(_markdown_renderers, "renderer", None)
+    if renderer is None:
+        import markdown
+        from markdown.extensions.codehilite import CodeHiliteExtension
+
+        # fenced code so we can get the language and hilite to get the highlights with css
+        renderer = markdown.Markdown(
+            extensions=[
+                "fenced_code",
+                CodeHiliteExtension(css_class="highlight"),
+                "footnotes",
+                "md_in_html",
+                "tables",
+                "nl2br",
+                "sane_lists",
+            ],
+        )
+        _markdown_renderers.renderer = renderer
+    return renderer
+
+
 def create_code_blocks_transformer(text: str) -> str:
-    # fenced code so we can get the language and hilite to get the highlights with css
-    text = markdown.markdown(
-        text,
-        extensions=[
-            "fenced_code",
-            CodeHiliteExtension(css_class="highlight"),
-            "footnotes",
-            "md_in_html",
-            "tables",
-            "nl2br",
-            "sane_lists",
-        ],
-    )
-    return text
+    return _get_markdown_renderer().reset().convert(text)
+
+
+def _embed_to_html(match: re.Match) -> str:
+    if match.group("url") is not None:
+        return f'<img src="{match.group("url")}">'
+    filename = match.group("filename")
+    if match.group("image_ext") is not None:
+        return f'<img src="{filename}.{match.group("image_ext")}">'
+    audio_ext = match.group("audio_ext")
+    return f'<audio controls><source src="{filename}.{audio_ext}" type="audio/{audio_ext}"></audio>'
 
 
-def format_pictures_to_html_transformer(text: str) -> str:
+def format_embeds_to_html_transformer(text: str) -> str:
     """
-    gets the 2nd and 3rd group which are the filename and extension
-    replaces the whole match with the img tag html
+    replaces, in a single pass over the text:
+        - the https links of images with the img tag
+        - the wikilinks of images with the img tag, using the filename and extension
+        - the wikilinks of audios with the audio tag, using the filename and extension
     """
-    text = re.sub(
-        IMAGE_URL_REGEX, r'<img src="\1">', text
-    )  # matches https links of images and replaces them with the img tag
-    return re.sub(IMAGE_FILE_WIKILINK_REGEX, r'<img src="\2.\3">', text)
+    return EMBED_TO_HTML_REGEX.sub(_embed_to_html, text)
 
 
-def format_audio_to_html_transformer(text: str) -> str:
+class EmbeddedMedias:
     """
-    gets the 2nd and 3rd group which are the filename and extension
-    replaces the whole match with the img tag html
+    the file names of the medias embedded in a text, grouped by the pattern that finds them
     """
-    return re.sub(
-        AUDIO_FILE_REGEX,
-        r'<audio controls><source src="\2.\3" type="audio/\3"></audio>',
-        text,
-    )
+
+    __slots__ = ("wikilink_images", "markdown_images", "audios")
+
+    wikilink_images: List[str]
+    markdown_images: List[str]
+    audios: List[str]
+
+    def __init__(self):
+        self.wikilink_images = []
+        self.markdown_images = []
+        self.audios = []
+
+
+def format_embeds_and_find_medias(text: str) -> Tuple[str, Optional[EmbeddedMedias]]:
+    """
+    replaces the embeds like format_embeds_to_html_transformer and collects the medias the
+    IMAGE_FILE_WIKILINK, IMAGE_FILE_MARKDOWN and AUDIO_FILE patterns would find, in a single pass.
+    The patterns are run separately, so they only disagree with a single pass when an embed hides
+    the start of another one (e.g. an image url in the alt text of a markdown image), in that case
+    the text is transformed by format_embeds_to_html_transformer and the medias are None
+    """
+    medias = EmbeddedMedias()
+    overlapping = False
+
+    def re_sub_repl_dynamic(match: re.Match) -> str:
+        nonlocal overlapping
+        # the extension (or the url) is the last group of each alternative
+        kind = match.lastgroup
+        if kind == "image_ext":
+            medias.wikilink_images.append(f"{match['filename']}.{match['image_ext']}")
+            return f'<img src="{match["filename"]}.{match["image_ext"]}">'
+        if kind == "audio_ext":
+            audio_ext = match["audio_ext"]
+            medias.audios.append(f"{match['filename']}.{audio_ext}")
+            return f'<audio controls><source src="{match["filename"]}.{audio_ext}" type="audio/{audio_ext}"></audio>'
+        embed = match[0]
+        if kind == "url":
+            if "![" in embed:
+                overlapping = True
+            return f'<img src="{match["url"]}">'
+        if "![" in embed[1:] or "http" in embed:
+            overlapping = True
+        medias.markdown_images.append(
+            unquote(f"{match['md_filename']}.{match['md_extension']}")
+        )
+        return embed  # markdown renders the markdown images itself
+
+    html = EMBED_TOKEN_REGEX.sub(re_sub_repl_dynamic, text)
+    if overlapping:
+        return format_embeds_to_html_transformer(text), None
+    return html, medias
@@ -20,14 +20,18 @@
 # ///
 """Script for adding cards to Anki from Obsidian."""
 
+import cProfile
 import logging
+from functools import partial
 from pathlib import Path
 
 import yaml
 
 from config_parser import NewConfig
-from run import run
-from utils.helpers import setup_cli_parser, setup_root_logger
+from run import apply_plan, gc, run
+from utils.helpers import read_file_list, setup_cli_parser, setup_root_logger
+from utils.metrics import Metrics
+from utils.profiling import Profiler, set_profiler
 
 
 def main():
@@ -36,6 +40,7 @@ def main():
     args = setup_cli_parser()
     setup_root_logger(args.debug)
     logger = logging.getLogger(__name__)
+    metrics = Metrics()
 
     logger.info("")  # Blank line
     logger.info("=" * 60)
@@ -48,16 +53,17 @@ def main():
     )
 
     try:
-        logger.info("📄 Loading configuration file...")
-        with open(
-            Path(args.config_path).expanduser().resolve(), "r", encoding="utf-8"
-        ) as f:
-            config = yaml.safe_load(f)
-        logger.info("✅ Configuration loaded successfully")
+        with metrics.stage("config_load"):
+            logger.info("📄 Loading configuration file...")
+            with open(
+                Path(args.config_path).expanduser().resolve(), "r", encoding="utf-8"
+            ) as f:
+                config = yaml.safe_load(f)
+            logger.info("✅ Configuration loaded successfully")
 
-        logger.info("🧪 Parsing and validating configuration...")
-        new_config = NewConfig(**config)
-        logger.info("✅ Configuration validation completed")
+            logger.info("🧪 Parsing and validating configuration...")
+            new_config = NewConfig(**config)
+            logger.info("✅ Configuration validation completed")
 
     except FileNotFoundError:
         logger.error("❌ Configuration file not found!")
@@ -70,8 +76,47 @@ def main():
         raise
 
     logger.info("🚀 Starting synchronization process...")
+    profiler = None
+    if args.profile or args.profile_out:
+        profiler = Profiler(slow_regex_seconds=args.slow_regex_seconds)
+        set_profiler(profiler)
+    c_profile = cProfile.Profile() if args.profile_out else None
+
+    if args.apply_plan:
+        sync = partial(apply_plan, plan_path=Path(args.apply_plan).expanduser())
+    elif args.gc or args.gc_dry_run:
+        gc_report = Path(args.gc_report).expanduser() if args.gc_report else None
+        sync = partial(
+            gc,
+            dry_run=args.gc_dry_run,
+            report_path=gc_report,
+            batch_size=args.gc_batch_size,
+        )
+    else:
+        plan_only = Path(args.plan_only).expanduser() if args.plan_only else None
+        export_apkg = Path(args.export_apkg).expanduser() if args.export_apkg else None
+        files = None
+        if args.files is not None or args.files_from is not None:
+            files = [Path(file).expanduser() for file in args.files or []]
+            if args.files_from is not None:
+                files += [Path(file).expanduser() for file in read_file_list(args.files_from)]
+        sync = partial(
+            run,
+            plan_only=plan_only,
+            export_apkg=export_apkg,
+            stream=args.stream,
+            stream_batch_size=args.stream_batch_size,
+            refresh_anki_state=args.refresh_anki_state,
+            files=files,
+        )
+
+    success = False
     try:
-        run(new_config)
+        if c_profile is not None:
+            c_profile.runcall(sync, new_config, metrics=metrics)
+        else:
+            sync(new_config, metrics=metrics)
+        success = True
         logger.info("")  # Blank line
         logger.info("=" * 60)
         logger.info("✅ Obsankipy synchronization completed successfully!".center(60))
@@ -83,6 +128,19 @@ def main():
         logger.error(f"❗ Error: {e}")
         logger.error("=" * 60)
         raise
+    finally:
+        if profiler is not None:
+            profiler.log_report()
+            set_profiler(None)
+        if c_profile is not None:
+            logger.info(f"🔬 Writing cProfile stats to {args.profile_out}")
+            c_profile.dump_stats(Path(args.profile_out).expanduser())
+        # the report is also written when the run fails, so failed cron runs show up in the graphs
+        metrics.finish(success)
+        if args.metrics_out:
+            metrics.write_json(Path(args.metrics_out).expanduser())
+        if args.prometheus_out:
+            metrics.write_prometheus(Path(args.prometheus_out).expanduser())
 
 
 if __name__ == "__main__":
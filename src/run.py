@@ -1,145 +1,660 @@
 import logging
-from typing import List
+from pathlib import Path
+from typing import Dict, List, Optional
 
+from anki.collection_reader import AnkiCollectionReader
 from anki.manager import (
     AnkiManager,
 )
-from config_parser import NewConfig
-from notes.manager import set_new_ids
+from anki.media_digests import MEDIA_DIGESTS_FILE_NAME, AnkiMediaDigests
+from anki.state_mirror import ANKI_STATE_FILE_NAME, AnkiStateMirror
+from config_parser import NewConfig, VaultConfig
+from notes.manager import NotesManager
 from notes.note import NoteType
-from utils.helpers import erase_note_ids_in_the_files
-from utils.helpers import open_cache, write_hashes_to_file
-from vault import VaultManager
+from sync.apkg import (
+    APKG_EXPORT_FILE_NAME,
+    ApkgExport,
+    drop_unimported_files,
+    export_plan,
+    find_imported_notes,
+)
+from sync.executor import PlanExecutor
+from sync.gc import collect_garbage, find_garbage, load_inventory
+from sync.journal import JOURNAL_FILE_NAME, SyncJournal
+from sync.plan import SyncPlan
+from sync.planner import build_plan, find_moved_files, find_removed_note_ids
+from utils.metrics import Metrics
+from utils.regex_guard import RegexScanner
+from vault import VaultManager, VaultSync
 
 logger = logging.getLogger(__name__)
 
 
-def run(config: NewConfig):
-    vault_name = config.vault.dir_path.name
-    logger.info(f"📦 Processing vault: {vault_name}")
-    logger.info(f"📁 Vault path: {config.vault.dir_path}")
-    logger.info(f"🖼️  Media path: {config.vault.medias_dir_path}")
-    logger.info(f"🔌 Anki URL: {config.globals.anki.url}")
+def run(
+    config: NewConfig,
+    metrics: Optional[Metrics] = None,
+    plan_only: Optional[Path] = None,
+    stream: bool = False,
+    stream_batch_size: int = 500,
+    refresh_anki_state: bool = False,
+    export_apkg: Optional[Path] = None,
+    files: Optional[List[Path]] = None,
+):
+    """
+    scans the vaults and synchronizes them with anki, with plan_only the plan is
+    written to that path instead of being applied, so it can be reviewed first.
+    With stream the notes are sent to anki in batches while the vaults are walked.
+    With refresh_anki_state the local mirror of the anki state is downloaded again.
+    With export_apkg the new notes and medias are written to that anki package instead
+    of being sent, the next run finishes the synchronization once it is imported.
+    With files only these files are read instead of walking the vaults
+    """
+    if metrics is None:
+        metrics = Metrics()
+
+    vault_configs = config.get_vaults()
+    for vault_config in vault_configs:
+        logger.info("📦 Processing vault: %s", vault_config.name)
+        logger.info("📁 Vault path: %s", vault_config.dir_path)
+        logger.info("🖼️  Media path: %s", vault_config.medias_dir_path)
+    logger.info("🔌 Anki URL: %s", config.globals.anki.url)
+
+    journal = SyncJournal(config.hashes_cache_dir / JOURNAL_FILE_NAME)
+    if journal.exists():
+        if plan_only is not None:
+            logger.warning(
+                "⚠️ A previous synchronization was interrupted, it will be resumed by the next run"
+            )
+        else:
+            resume_interrupted_sync(config, journal, metrics)
 
-    # Initialize cache and note types
-    hashes_path = config.hashes_cache_dir / f".{vault_name}_file_hashes.json"
-    logger.debug(f"📄 Cache file path: {hashes_path}")
-    hashes = open_cache(hashes_path)
-    logger.debug(f"📄 Loaded {len(hashes)} file hashes from cache")
+    apkg_export_path = config.hashes_cache_dir / APKG_EXPORT_FILE_NAME
+    if apkg_export_path.exists():
+        if plan_only is not None:
+            logger.warning(
+                "⚠️ An exported anki package was not imported yet, the next run will look for its notes"
+            )
+        else:
+            finish_apkg_import(config, apkg_export_path, metrics)
 
     note_types: List[NoteType] = config.get_note_types()
-    logger.debug(f"🧠 Configured note types: {[nt.name for nt in note_types]}")
+    logger.debug("🧠 Configured note types: %s", [nt.name for nt in note_types])
+
+    if stream:
+        if plan_only is not None or export_apkg is not None:
+            logger.warning(
+                "⚠️ --stream is ignored with --plan-only and --export-apkg, they need the whole vault"
+            )
+        elif files is not None:
+            logger.warning("⚠️ --stream is ignored with --files, only the given files are read")
+        else:
+            git_vaults = [
+                vault_config.name
+                for vault_config in vault_configs
+                if vault_config.change_detection == "git"
+            ]
+            if git_vaults:
+                logger.warning(
+                    "⚠️ --stream hashes every file, change_detection: git is ignored for %s",
+                    git_vaults,
+                )
+            run_streaming(
+                config, note_types, metrics, journal, stream_batch_size, refresh_anki_state
+            )
+            return
+
+    if files is not None:
+        files_by_vault = group_files_by_vault(files, vault_configs)
+        vault_syncs = [
+            VaultSync(vault_config, note_types)
+            for vault_config in vault_configs
+            if vault_config.name in files_by_vault
+        ]
+        if not vault_syncs:
+            logger.warning("⚠️ None of the given files is in a vault, nothing to synchronize")
+            return
+
+        def find_new_files(vault_sync: VaultSync) -> VaultManager:
+            return vault_sync.find_given_files(files_by_vault[vault_sync.name])
+
+    else:
+        vault_syncs = [VaultSync(vault_config, note_types) for vault_config in vault_configs]
 
-    # Connect to Anki
+        def find_new_files(vault_sync: VaultSync) -> VaultManager:
+            return vault_sync.find_new_files()
+
+    # the vaults are independent until their notes are sent to anki, the anki state is
+    # fetched once and the operations of every vault are batched together
+    with metrics.stage("vault_walk") as stage:
+        vaults = [find_new_files(vault_sync) for vault_sync in vault_syncs]
+        stage.count("vaults", len(vaults))
+        stage.count("files", sum(len(vault.files) for vault in vaults))
+        stage.count("new_files", sum(len(vault.new_files) for vault in vaults))
+
+    with metrics.stage("find_moved_files") as stage:
+        moved_files = find_moved_files(vault_syncs)
+        stage.count("files", len(moved_files))
+    moved_vaults = {move.vault for move in moved_files}
+
+    changed_vault_syncs = [
+        vault_sync
+        for vault_sync in vault_syncs
+        if vault_sync.vault.new_files or vault_sync.name in moved_vaults
+    ]
+    if not changed_vault_syncs:
+        logger.info("✅ Nothing has changed since last run")
+        if plan_only is not None:
+            SyncPlan().save(plan_only)
+            return
+        for vault_sync in vault_syncs:
+            vault_sync.record_git_state({})
+        return
+
+    # a single scanner for every vault, so there is at most one regex worker process
+    with metrics.stage("scan") as stage, RegexScanner(
+        timeout_seconds=config.globals.scan.file_timeout_seconds,
+        engine=config.globals.scan.regex_engine,
+    ) as scanner:
+        notes_managers = [
+            vault_sync.scan(scanner) for vault_sync in changed_vault_syncs
+        ]
+        skipped_files = [
+            file
+            for vault_sync in changed_vault_syncs
+            for file in vault_sync.vault.skipped_files
+        ]
+        stage.count(
+            "files",
+            sum(len(vault_sync.vault.new_files) for vault_sync in changed_vault_syncs),
+        )
+        stage.count("skipped_files", len(skipped_files))
+
+    # Connect to Anki, only once we know there is something to synchronize
     logger.info("🔌 Connecting to Anki...")
-    anki_requester = AnkiManager(config.globals.anki.url)
+    anki_requester = get_anki_manager(config, metrics)
+    media_digests = get_media_digests(config)
+    anki_state = get_anki_state(config)
 
     # Get existing data from Anki
     logger.info("📥 Retrieving existing note IDs from Anki...")
-    ids = anki_requester.get_ids()
-    logger.info(f"📄 Found {len(ids)} existing notes in Anki")
+    with metrics.stage("get_ids") as stage:
+        anki_state.refresh(anki_requester, force_download=refresh_anki_state)
+        ids = anki_state.note_ids
+        stage.count("notes", len(ids))
+    logger.info("📄 Found %s existing notes in Anki", len(ids))
 
     logger.info("🖼️  Retrieving media files from Anki...")
-    medias_in_anki = anki_requester.get_medias(
-        config.globals.anki.fine_grained_image_search
-    )
-    pics_in_anki = medias_in_anki["images"]
-    audios_in_anki = medias_in_anki["audios"]
+    with metrics.stage("get_medias") as stage:
+        medias_in_anki = anki_requester.get_medias(
+            media_digests, media_file_names=anki_state.medias
+        )
+        pics_in_anki = medias_in_anki["images"]
+        audios_in_anki = medias_in_anki["audios"]
+        stage.count("images", len(pics_in_anki))
+        stage.count("audios", len(audios_in_anki))
     logger.info(
-        f"🖼️  Found {len(pics_in_anki)} images and 🎵 {len(audios_in_anki)} audio files in Anki"
+        "🖼️  Found %s images and 🎵 %s audio files in Anki",
+        len(pics_in_anki),
+        len(audios_in_anki),
     )
 
-    # Initialize vault manager
-    logger.info("📂 Scanning vault for files...")
-    vault = VaultManager(
-        config.vault.dir_path,
-        config.vault.exclude_dirs_from_scan,
-        config.vault.exclude_dotted_dirs_from_scan,
-        config.vault.file_patterns_to_exclude,
-        note_types,
-    )
+    # the notes of every vault are handled together from here on
+    notes_manager = NotesManager.merge(notes_managers)
+    total_notes = len(notes_manager.get_all_notes())
+    metrics.count("scan", "notes", total_notes)
 
-    # Process files
-    vault.set_new_files(hashes)
-    logger.info(f"📄 Found {len(vault.new_files)} new or modified files to process")
-    if not vault.new_files:
-        logger.info("✅ Nothing has changed since last run")
-        return
+    with metrics.stage("categorize") as stage:
+        notes_manager.categorize_notes(ids)
+        stage.count("notes", total_notes)
 
-    # Extract and categorize notes
-    notes_manager = vault.get_notes_from_new_files()
-    total_notes = len(notes_manager.get_all_notes())
+    removed_notes = config.globals.anki.removed_notes
+    removed_note_ids = set()
+    if removed_notes != "keep" and files is not None:
+        # a note cut from a given file may have been pasted in a file that was not given
+        logger.info("ℹ️  The notes removed from their files are not looked for with --files")
+    elif removed_notes != "keep":
+        with metrics.stage("find_removed_notes") as stage:
+            removed_note_ids = find_removed_note_ids(notes_manager, changed_vault_syncs) & ids
+            stage.count("notes", len(removed_note_ids))
 
-    notes_manager.categorize_notes(ids)
-    notes_manager.load_media_data(config.vault.medias_dir_path)
-    notes_manager.categorize_medias(pics_in_anki, audios_in_anki)
-    medias = notes_manager.get_media_to_add()
+    with metrics.stage("media_load") as stage:
+        for vault_sync in changed_vault_syncs:
+            vault_sync.load_media_data(media_digests is not None)
+        stage.count("medias", len(notes_manager.medias))
 
-    # Get categorized notes
-    notes_to_edit = notes_manager.get_all_notes_to_edit()
-    notes_to_add = notes_manager.get_all_notes_to_add()
-    notes_to_delete = notes_manager.get_all_notes_to_delete()
-    decks_to_create = notes_manager.get_needed_target_decks()
+    with metrics.stage("categorize_medias") as stage:
+        notes_manager.categorize_medias(pics_in_anki, audios_in_anki)
+        medias = notes_manager.get_media_to_add()
+        stage.count("new_medias", len(medias))
+
+    with metrics.stage("plan") as stage:
+        plan = build_plan(
+            notes_manager, vault_syncs, removed_note_ids, removed_notes, moved_files
+        )
+        # createDeck is idempotent, the decks anki already has are not sent again
+        plan.decks_to_create = [
+            deck for deck in plan.decks_to_create if deck not in anki_state.decks
+        ]
+        plan.compute_estimate()
+        stage.count("notes", total_notes)
 
     summary_lines = [
         "",  # blank line
         "=" * 60,
         "🧾 SYNCHRONIZATION SUMMARY".center(60),
         "=" * 60,
+        f"📦 Vaults with changes:       {len(changed_vault_syncs):>5}",
         f"📄 Total notes detected:      {total_notes:>5}",
-        f"➕ Notes to add:              {len(notes_to_add):>5}",
-        f"📝 Notes to edit:             {len(notes_to_edit):>5}",
-        f"❌ Notes to delete:           {len(notes_to_delete):>5}",
-        f"🖼️  Media files:               {len(medias):>5} ({len(pics_in_anki)} images, {len(audios_in_anki)} audios)",
-        f"📚 Decks to create:           {len(decks_to_create):>5}",
+        f"➕ Notes to add:              {len(plan.notes_to_add):>5}",
+        f"📝 Notes to edit:             {len(plan.edited_note_ids()):>5}",
+        f"❌ Notes to delete:           {len(plan.notes_to_delete):>5}",
+        f"🧹 Notes removed from files:  {len(removed_note_ids):>5} ({removed_notes})",
+        f"🖼️  Media files:               {len(plan.medias_to_store):>5} ({len(pics_in_anki)} images, {len(audios_in_anki)} audios)",
+        f"📚 Decks to create:           {len(plan.decks_to_create):>5}",
+        f"🚚 Files renamed or moved:    {len(moved_files):>5}",
+        f"⏱️  Files skipped (timeout):   {len(skipped_files):>5}",
+        *plan.summary_lines(),
         "=" * 60,
         "",
     ]
+    for file in skipped_files:
+        summary_lines.insert(-2, f"   ⏱️  {file.path}")
 
     for line in summary_lines:
         logger.info(line)
 
-    # Execute operations
-    if decks_to_create:
-        anki_requester.create_decks(decks_to_create)
-
-    if notes_to_delete:
-        logger.info(f"❌ Deleting {len(notes_to_delete)} notes...")
-        anki_requester.delete_notes(notes_to_delete)
-        erase_note_ids_in_the_files([note.source_file.path for note in notes_to_delete])
-
-    if notes_to_add:
-        add_response = anki_requester.adds_new_notes(notes_to_add)
-
-        if add_response:
-            logger.info(f"✅ Successfully added {len(add_response)} notes")
-            set_new_ids(add_response)
-            out_of_date_files = notes_manager.get_out_of_date_files()
-            for file in out_of_date_files:
-                file.write_new_ids_to_file()
-            logger.info(f"✍️ Updated {len(out_of_date_files)} source files with new IDs")
+    if plan_only is not None:
+        plan.save(plan_only)
+        logger.info("📐 Plan only run, nothing was sent to Anki and no file was changed")
+        return
+
+    if export_apkg is not None:
+        if plan.notes_to_add or plan.medias_to_store:
+            export = export_plan(
+                plan, export_apkg, vault_configs, anki_requester, ids, metrics
+            )
+            export.save(apkg_export_path)
+            logger.info(
+                "📦 Import %s in Anki (File > Import), the next run writes the note IDs "
+                "in the files and applies the rest of the plan",
+                export_apkg,
+            )
+            return
+        logger.info("ℹ️  No new notes to export, the plan is applied through AnkiConnect")
+
+    plan_executor = PlanExecutor(
+        plan,
+        vault_configs,
+        anki_requester,
+        metrics,
+        journal=journal,
+        media_digests=media_digests,
+        anki_state=anki_state,
+    )
+    plan_executor.execute()
+    for vault_sync in vault_syncs:
+        vault_sync.record_git_state(plan_executor.new_hashes[vault_sync.name])
+
+
+def run_streaming(
+    config: NewConfig,
+    note_types: List[NoteType],
+    metrics: Metrics,
+    journal: SyncJournal,
+    batch_size: int,
+    refresh_anki_state: bool = False,
+) -> None:
+    """
+    the vaults are walked one after the other, the notes of the changed files are scanned as
+    the files are found and every batch of batch_size notes is planned and applied right away,
+    so only one batch is kept in memory. The anki state is fetched once, before the first batch.
+    Each batch is journaled and writes the cache, so an interrupted run resumes from the last batch.
+    The renamed and moved files are not looked for, their unchanged hash is cached and the note
+    inventory keeps their old path until a run without stream relinks their notes
+    """
+    logger.info("ℹ️  Renamed and moved files are not looked for with --stream, the next run without it handles them")
+    anki_requester = None
+    media_digests = get_media_digests(config)
+    anki_state = get_anki_state(config)
+    ids = set()
+    pics_in_anki = audios_in_anki = None
+    created_decks = set()
+    totals = {"batches": 0, "notes": 0, "added": 0, "edited": 0, "deleted": 0, "medias": 0}
+    # a note can move to a file of a later batch, so the removed notes are only handled at the end
+    removed_notes = config.globals.anki.removed_notes
+    removed_note_ids = set()
+    found_note_ids = set()
+
+    for vault_config in config.get_vaults():
+        vault_sync = VaultSync(vault_config, note_types)
+        batches = vault_sync.stream(config.globals.scan, batch_size)
+        while True:
+            # the walk and the scan happen while the next batch is pulled
+            with metrics.stage("scan") as stage:
+                notes_manager = next(batches, None)
+                if notes_manager is None:
+                    break
+                stage.count("files", len(vault_sync.vault.new_files))
+                stage.count("skipped_files", len(vault_sync.vault.skipped_files))
+
+            if anki_requester is None:
+                logger.info("🔌 Connecting to Anki...")
+                anki_requester = get_anki_manager(config, metrics)
+                with metrics.stage("get_ids") as stage:
+                    anki_state.refresh(anki_requester, force_download=refresh_anki_state)
+                    # the executors add the notes of each batch to the mirror
+                    ids = anki_state.note_ids
+                    created_decks = set(anki_state.decks)
+                    stage.count("notes", len(ids))
+                logger.info("📄 Found %s existing notes in Anki", len(ids))
+                with metrics.stage("get_medias") as stage:
+                    medias_in_anki = anki_requester.get_medias(
+                        media_digests, media_file_names=anki_state.medias
+                    )
+                    pics_in_anki = medias_in_anki["images"]
+                    audios_in_anki = medias_in_anki["audios"]
+                    stage.count("images", len(pics_in_anki))
+                    stage.count("audios", len(audios_in_anki))
+
+            total_notes = len(notes_manager.get_all_notes())
+            metrics.count("scan", "notes", total_notes)
+            with metrics.stage("categorize") as stage:
+                notes_manager.categorize_notes(ids)
+                stage.count("notes", total_notes)
+            if removed_notes != "keep":
+                with metrics.stage("find_removed_notes") as stage:
+                    removed_note_ids |= find_removed_note_ids(notes_manager, [vault_sync])
+                    found_note_ids.update(
+                        note.note_id
+                        for note in notes_manager.get_all_notes()
+                        if note.note_id is not None
+                    )
+            with metrics.stage("media_load") as stage:
+                vault_sync.load_media_data(media_digests is not None)
+                stage.count("medias", len(notes_manager.medias))
+            with metrics.stage("categorize_medias") as stage:
+                notes_manager.categorize_medias(pics_in_anki, audios_in_anki)
+                stage.count("new_medias", len(notes_manager.get_media_to_add()))
+
+            with metrics.stage("plan") as stage:
+                plan = build_plan(notes_manager, [vault_sync])
+                # createDeck is idempotent, but the decks anki has are not sent again
+                plan.decks_to_create = [
+                    deck for deck in plan.decks_to_create if deck not in created_decks
+                ]
+                plan.compute_estimate()
+                stage.count("notes", total_notes)
+
+            executor = PlanExecutor(
+                plan,
+                [vault_config],
+                anki_requester,
+                metrics,
+                journal=journal,
+                media_digests=media_digests,
+                anki_state=anki_state,
+            )
+            executor.execute()
+            vault_sync.vault.finish_batch(executor.new_hashes[vault_sync.name])
+
+            created_decks.update(set(plan.decks_to_create) - executor.failed_decks)
+            # the medias sent in this batch are not sent again by the next ones
+            for media in notes_manager.get_media_to_add():
+                if media.filename in executor.failed_medias:
+                    continue
+                if isinstance(pics_in_anki, set):
+                    pics_in_anki.add(media.filename)
+                else:
+                    pics_in_anki[media.filename] = media.digest
+
+            totals["batches"] += 1
+            totals["notes"] += total_notes
+            totals["added"] += len(plan.notes_to_add)
+            totals["edited"] += len(plan.edited_note_ids())
+            totals["deleted"] += len(plan.notes_to_delete)
+            totals["medias"] += len(plan.medias_to_store)
+
+    if totals["batches"] == 0:
+        logger.info("✅ Nothing has changed since last run")
+        return
+
+    removed_note_ids = (removed_note_ids - found_note_ids) & ids
+    if removed_note_ids:
+        plan = SyncPlan(
+            removed_notes_to_delete=sorted(removed_note_ids) if removed_notes == "delete" else [],
+            removed_notes_to_tag=sorted(removed_note_ids) if removed_notes == "tag" else [],
+        )
+        plan.compute_estimate()
+        PlanExecutor(
+            plan,
+            config.get_vaults(),
+            anki_requester,
+            metrics,
+            journal=journal,
+            anki_state=anki_state,
+        ).execute()
+    logger.info(
+        "🌊 Streamed %s notes in %s batches: %s added, %s edited, %s deleted, "
+        "%s removed from their files (%s), %s media files uploaded",
+        totals["notes"],
+        totals["batches"],
+        totals["added"],
+        totals["edited"],
+        totals["deleted"],
+        len(removed_note_ids),
+        removed_notes,
+        totals["medias"],
+    )
+
+
+def group_files_by_vault(
+    files: List[Path], vault_configs: List[VaultConfig]
+) -> Dict[str, List[str]]:
+    """
+    the paths of the given files relative to the vault they are in, by vault name.
+    A file inside nested vaults belongs to the innermost one
+    """
+    vault_dirs = sorted(
+        ((vault_config.dir_path.resolve(), vault_config.name) for vault_config in vault_configs),
+        key=lambda vault_dir: len(vault_dir[0].parts),
+        reverse=True,
+    )
+    files_by_vault: Dict[str, List[str]] = {}
+    for file in files:
+        path = Path(file).resolve()
+        for vault_dir, vault_name in vault_dirs:
+            if path.is_relative_to(vault_dir):
+                files_by_vault.setdefault(vault_name, []).append(
+                    path.relative_to(vault_dir).as_posix()
+                )
+                break
         else:
-            logger.warning("⚠️ No notes were added (possibly all duplicates)")
-    else:
-        logger.info("ℹ️  No new notes to add")
-
-    if notes_to_edit:
-        note_cards_ids = anki_requester.get_cards_ids_from_note(notes_to_edit)
-        # populates the note with its cards ids so it can be used by the requester
-        for note, cards_ids in note_cards_ids:
-            note.cards_ids = cards_ids
-        anki_requester.updates_existing_notes(notes_to_edit)
-        anki_requester.ensure_correct_deck(notes_to_edit)
-    else:
-        logger.info("ℹ️  No notes to update")
+            logger.warning("⚠️ %s is not in any of the vaults, it is ignored", file)
+    return files_by_vault
+
+
+def get_media_digests(config: NewConfig) -> Optional[AnkiMediaDigests]:
+    """
+    the digests of the anki medias are only used by the fine grained media comparison
+    """
+    if not config.globals.anki.fine_grained_image_search:
+        return None
+    return AnkiMediaDigests(config.hashes_cache_dir / MEDIA_DIGESTS_FILE_NAME)
+
+
+def get_anki_manager(config: NewConfig, metrics: Optional[Metrics]) -> AnkiManager:
+    collection_path = config.globals.anki.collection_path
+    collection_reader = (
+        AnkiCollectionReader(collection_path) if collection_path is not None else None
+    )
+    return AnkiManager(
+        config.globals.anki.url, metrics=metrics, collection_reader=collection_reader
+    )
+
+
+def get_anki_state(config: NewConfig) -> AnkiStateMirror:
+    return AnkiStateMirror(config.hashes_cache_dir / ANKI_STATE_FILE_NAME)
+
+
+def finish_apkg_import(config: NewConfig, export_path: Path, metrics: Metrics) -> None:
+    """
+    finds the notes of an exported package in anki and finishes its plan like an interrupted
+    run: the add_notes and store_medias phases are recorded as completed by the import
+    """
+    export = ApkgExport.load(export_path)
+    logger.info("📦 Looking for the notes of %s in Anki...", export.package)
+    anki_requester = get_anki_manager(config, metrics)
+    anki_state = get_anki_state(config)
+    with metrics.stage("apkg_reconcile") as stage:
+        anki_state.refresh(anki_requester)
+        note_ids = find_imported_notes(
+            export, anki_state.note_ids, anki_requester.get_note_ids_by_guid(export.guids)
+        )
+        imported = sum(note_id is not None for note_id in note_ids)
+        stage.count("notes", len(note_ids))
+        stage.count("imported", imported)
+    if export.note_ids and not imported:
+        raise ValueError(
+            f"⚠️ The notes of {export.package} are not in Anki, import it (File > Import) before "
+            f"synchronizing again, or delete {export_path} to give up on it."
+        )
+    if imported < len(note_ids):
+        dropped_files = drop_unimported_files(export.plan, note_ids)
+        logger.warning(
+            "⚠️ %s notes of %s are not in Anki, their %s files will be scanned again by the next run",
+            len(note_ids) - imported,
+            export.package,
+            dropped_files,
+        )
+    logger.info("✅ Found %s imported notes", imported)
+
+    journal = SyncJournal(config.hashes_cache_dir / JOURNAL_FILE_NAME)
+    journal.start(export.plan)
+    journal.record_phase("add_notes", note_ids=note_ids)
+    journal.record_phase("store_medias")
+    export_path.unlink()
+    resume_interrupted_sync(config, journal, metrics)
+
+
+def resume_interrupted_sync(
+    config: NewConfig, journal: SyncJournal, metrics: Metrics
+) -> None:
+    """
+    finishes the plan of a run that died halfway, so the notes it already added to anki
+    get their IDs written instead of being added again as duplicates
+    """
+    state = journal.load()
+    if state is None:
+        journal.remove()
+        return
+    logger.info(
+        "♻️  Resuming an interrupted synchronization, completed phases: %s",
+        list(state.completed_phases),
+    )
+    anki_requester = get_anki_manager(config, metrics)
+    with metrics.stage("resume") as stage:
+        PlanExecutor(
+            state.plan,
+            config.get_vaults(),
+            anki_requester,
+            metrics,
+            journal=journal,
+            resume=state,
+            media_digests=get_media_digests(config),
+            anki_state=get_anki_state(config),
+        ).execute()
+        stage.count("completed_phases", len(state.completed_phases))
+    logger.info("✅ The interrupted synchronization was completed")
+
+
+def apply_plan(config: NewConfig, plan_path: Path, metrics: Optional[Metrics] = None):
+    """
+    applies a plan written by a --plan-only run, the vaults are resolved with this config
+    """
+    if metrics is None:
+        metrics = Metrics()
+
+    journal = SyncJournal(config.hashes_cache_dir / JOURNAL_FILE_NAME)
+    if journal.exists():
+        resume_interrupted_sync(config, journal, metrics)
+    apkg_export_path = config.hashes_cache_dir / APKG_EXPORT_FILE_NAME
+    if apkg_export_path.exists():
+        finish_apkg_import(config, apkg_export_path, metrics)
+
+    plan = SyncPlan.load(plan_path)
+    for line in plan.summary_lines():
+        logger.info(line)
+    if not plan.has_anki_operations() and not plan.files and not plan.caches:
+        logger.info("✅ The plan is empty, nothing to apply")
+        return
+
+    logger.info("🔌 Connecting to Anki...")
+    anki_requester = get_anki_manager(config, metrics)
+    PlanExecutor(
+        plan,
+        config.get_vaults(),
+        anki_requester,
+        metrics,
+        journal=journal,
+        media_digests=get_media_digests(config),
+        anki_state=get_anki_state(config),
+    ).execute()
 
-    if medias:
-        anki_requester.store_media_files(medias)
-    else:
-        logger.info("ℹ️  No new media files to upload")
 
-    # Update cache
-    logger.info("💾 Updating file hash cache...")
-    curr_hashes = vault.get_curr_file_hashes()
-    write_hashes_to_file(curr_hashes, hashes_path)
-    logger.info(f"💾 Updated cache with {len(curr_hashes)} file hashes")
+def gc(
+    config: NewConfig,
+    metrics: Optional[Metrics] = None,
+    dry_run: bool = False,
+    report_path: Optional[Path] = None,
+    batch_size: int = 100,
+):
+    """
+    deletes from anki the notes and medias that no file of the vaults references anymore,
+    the vaults have to be synchronized first. With dry_run they are only reported
+    """
+    if metrics is None:
+        metrics = Metrics()
+
+    journal = SyncJournal(config.hashes_cache_dir / JOURNAL_FILE_NAME)
+    if journal.exists():
+        raise ValueError(
+            "⚠️ A previous synchronization was interrupted, run a synchronization to resume it "
+            "before collecting the garbage."
+        )
+    if (config.hashes_cache_dir / APKG_EXPORT_FILE_NAME).exists():
+        raise ValueError(
+            "⚠️ An exported anki package was not imported yet, import it and run a synchronization "
+            "before collecting the garbage."
+        )
+
+    note_types: List[NoteType] = config.get_note_types()
+    vault_syncs = [
+        VaultSync(vault_config, note_types) for vault_config in config.get_vaults()
+    ]
+    with metrics.stage("gc_inventory") as stage:
+        inventories = [
+            load_inventory(vault_sync, config.globals.scan) for vault_sync in vault_syncs
+        ]
+        stage.count("files", sum(len(inventory.files) for inventory in inventories))
+
+    logger.info("🔌 Connecting to Anki...")
+    anki_requester = get_anki_manager(config, metrics)
+    with metrics.stage("gc_find") as stage:
+        report = find_garbage(inventories, anki_requester, dry_run)
+        stage.count("notes", len(report.notes))
+        stage.count("medias", len(report.medias))
+
+    for note_id in report.notes:
+        logger.debug("🗑️  Orphaned note: %s", note_id)
+    for media in report.medias:
+        logger.debug("🗑️  Orphaned media file: %s", media)
+    if not dry_run:
+        collect_garbage(report, inventories, anki_requester, metrics, batch_size)
+
+    for line in ["", "=" * 60, "🧹 GARBAGE COLLECTION SUMMARY".center(60), "=" * 60]:
+        logger.info(line)
+    for line in report.summary_lines():
+        logger.info(line)
+    logger.info("=" * 60)
+    if report_path is not None:
+        report.save(report_path)
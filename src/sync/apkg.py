@@ -0,0 +1,364 @@
+"""
+the --export-apkg mode writes the new notes and the medias of a plan into an anki package
+instead of sending them to AnkiConnect, so a big first import is a single native import in anki.
+The notes get their IDs and a stable GUID in the package, the plan is kept in the cache dir
+and the next run finds the imported notes and finishes the plan: it writes the IDs in the files
+and applies the other operations (edits, deletions) like a resumed run
+"""
+
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+from pydantic import BaseModel
+
+from anki.manager import AnkiManager
+from config_parser import VaultConfig
+from sync.plan import PlannedNote, SyncPlan
+from utils.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+APKG_EXPORT_FILE_NAME = ".obsankipy_apkg_export.json"
+CLOZE_MODEL_TYPE = 1
+CLOZE_NUMBER = re.compile(r"\{\{c(\d+)::")
+HTML_TAG = re.compile(r"<[^>]*>")
+
+# the schema of the collection inside a package, the one of anki 2.1 before 2.1.28 which
+# every version of anki still imports
+APKG_SCHEMA = """
+CREATE TABLE col (
+    id integer primary key, crt integer not null, mod integer not null, scm integer not null,
+    ver integer not null, dty integer not null, usn integer not null, ls integer not null,
+    conf text not null, models text not null, decks text not null, dconf text not null,
+    tags text not null
+);
+CREATE TABLE notes (
+    id integer primary key, guid text not null, mid integer not null, mod integer not null,
+    usn integer not null, tags text not null, flds text not null, sfld integer not null,
+    csum integer not null, flags integer not null, data text not null
+);
+CREATE TABLE cards (
+    id integer primary key, nid integer not null, did integer not null, ord integer not null,
+    mod integer not null, usn integer not null, type integer not null, queue integer not null,
+    due integer not null, ivl integer not null, factor integer not null, reps integer not null,
+    lapses integer not null, left integer not null, odue integer not null, odid integer not null,
+    flags integer not null, data text not null
+);
+CREATE TABLE revlog (
+    id integer primary key, cid integer not null, usn integer not null, ease integer not null,
+    ivl integer not null, lastIvl integer not null, factor integer not null, time integer not null,
+    type integer not null
+);
+CREATE TABLE graves (usn integer not null, oid integer not null, type integer not null);
+CREATE INDEX ix_notes_usn on notes (usn);
+CREATE INDEX ix_cards_usn on cards (usn);
+CREATE INDEX ix_revlog_usn on revlog (usn);
+CREATE INDEX ix_cards_nid on cards (nid);
+CREATE INDEX ix_cards_sched on cards (did, queue, due);
+CREATE INDEX ix_revlog_cid on revlog (cid);
+CREATE INDEX ix_notes_csum on notes (csum);
+"""
+
+DEFAULT_DECK_CONFIG = {
+    "id": 1,
+    "name": "Default",
+    "mod": 0,
+    "usn": 0,
+    "maxTaken": 60,
+    "autoplay": True,
+    "timer": 0,
+    "replayq": True,
+    "dyn": False,
+    "new": {
+        "bury": False,
+        "delays": [1, 10],
+        "initialFactor": 2500,
+        "ints": [1, 4, 7],
+        "order": 1,
+        "perDay": 20,
+        "separate": True,
+    },
+    "lapse": {"delays": [10], "leechAction": 0, "leechFails": 8, "minInt": 1, "mult": 0},
+    "rev": {
+        "bury": False,
+        "ease4": 1.3,
+        "fuzz": 0.05,
+        "ivlFct": 1,
+        "maxIvl": 36500,
+        "minSpace": 1,
+        "perDay": 200,
+    },
+}
+
+
+class ApkgExport(BaseModel):
+    """
+    the plan of an --export-apkg run, kept in the cache dir until the package is imported.
+    note_ids and guids are the ones given to the notes_to_add of the plan in the package
+    """
+
+    package: str
+    created_at: float
+    plan: SyncPlan
+    note_ids: List[int]
+    guids: List[str]
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.model_dump_json())
+
+    @classmethod
+    def load(cls, path: Path) -> "ApkgExport":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.model_validate_json(f.read())
+
+
+def note_guid(note: PlannedNote) -> str:
+    """
+    the same note of the same file gets the same GUID in every export, so importing a package
+    twice updates the notes instead of duplicating them
+    """
+    digest = hashlib.sha256(f"{note.vault}\x1f{note.path}\x1f{note.front}".encode("utf-8"))
+    return digest.hexdigest()[:20]
+
+
+def export_plan(
+    plan: SyncPlan,
+    package_path: Path,
+    vault_configs: List[VaultConfig],
+    anki: AnkiManager,
+    used_note_ids: Set[int],
+    metrics: Metrics,
+) -> ApkgExport:
+    """
+    writes the notes to add and the medias to store of the plan in package_path. Anki is only
+    asked for the definition of the note types, the package uses their IDs so the notes are
+    imported in the existing note types instead of copies of them
+    """
+    notes = plan.notes_to_add
+    with metrics.stage("apkg_models") as stage:
+        models = {
+            model["name"]: model for model in anki.get_models({note.model_name for note in notes})
+        }
+        stage.count("models", len(models))
+
+    # the IDs are creation timestamps in milliseconds, like the ones anki gives
+    first_id = max(int(time.time() * 1000), max(used_note_ids, default=0) + 1)
+    note_ids = list(range(first_id, first_id + len(notes)))
+    guids = [note_guid(note) for note in notes]
+
+    media_dirs = {vault_config.name: vault_config.medias_dir_path for vault_config in vault_configs}
+    media_paths = [
+        (media.filename, media_dirs[media.vault] / media.path) for media in plan.medias_to_store
+    ]
+    with metrics.stage("apkg_write") as stage:
+        cards = write_package(
+            package_path, notes, note_ids, guids, models, media_paths, first_id + len(notes)
+        )
+        stage.count("notes", len(notes))
+        stage.count("cards", cards)
+        stage.count("medias", len(media_paths))
+    logger.info(
+        f"📦 Wrote {len(notes)} notes ({cards} cards) and {len(media_paths)} media files to {package_path}"
+    )
+    return ApkgExport(
+        package=str(package_path),
+        created_at=time.time(),
+        plan=plan,
+        note_ids=note_ids,
+        guids=guids,
+    )
+
+
+def write_package(
+    package_path: Path,
+    notes: List[PlannedNote],
+    note_ids: List[int],
+    guids: List[str],
+    models: Dict[str, dict],
+    media_paths: List[tuple],
+    first_card_id: int,
+) -> int:
+    """
+    a package is a zip with the collection (collection.anki2), the media files named 0, 1, ...
+    and a media file mapping these numbers to the real names. Returns the number of cards
+    """
+    now = int(time.time())
+    deck_ids = {"Default": 1}
+    for note in notes:
+        parts = note.deck_name.split("::")
+        for depth in range(1, len(parts) + 1):
+            name = "::".join(parts[:depth])
+            if name not in deck_ids:
+                deck_ids[name] = int(hashlib.sha1(name.encode("utf-8")).hexdigest()[:12], 16)
+    for model in models.values():
+        if model.get("did") is None:
+            model["did"] = 1
+
+    card_id = first_card_id
+    card_rows = []
+    note_rows = []
+    for position, (note, note_id, guid) in enumerate(zip(notes, note_ids, guids), start=1):
+        model = models[note.model_name]
+        fields = [
+            note.fields.get(field["name"], "")
+            for field in sorted(model["flds"], key=lambda field: field["ord"])
+        ]
+        sort_field = _strip_html(fields[model.get("sortf", 0)])
+        note_rows.append(
+            (
+                note_id,
+                guid,
+                model["id"],
+                now,
+                -1,
+                f" {' '.join(note.tags)} " if note.tags else "",
+                "\x1f".join(fields),
+                sort_field,
+                int(hashlib.sha1(_strip_html(fields[0]).encode("utf-8")).hexdigest()[:8], 16),
+                0,
+                "",
+            )
+        )
+        for card_ord in _card_ords(model, fields):
+            # a new card, its due is its position in the new queue
+            card_rows.append(
+                (card_id, note_id, deck_ids[note.deck_name], card_ord, now, -1)
+                + (0, 0, position, 0, 0, 0, 0, 0, 0, 0, 0, "")
+            )
+            card_id += 1
+
+    decks = {
+        str(deck_id): {
+            "id": deck_id,
+            "name": name,
+            "mod": now,
+            "usn": -1,
+            "desc": "",
+            "dyn": 0,
+            "conf": 1,
+            "collapsed": False,
+            "browserCollapsed": False,
+            "extendNew": 0,
+            "extendRev": 0,
+            "lrnToday": [0, 0],
+            "revToday": [0, 0],
+            "newToday": [0, 0],
+            "timeToday": [0, 0],
+        }
+        for name, deck_id in deck_ids.items()
+    }
+    conf = {
+        "activeDecks": [1],
+        "curDeck": 1,
+        "newSpread": 0,
+        "collapseTime": 1200,
+        "timeLim": 0,
+        "estTimes": True,
+        "dueCounts": True,
+        "curModel": None,
+        "nextPos": len(notes) + 1,
+        "sortType": "noteFld",
+        "sortBackwards": False,
+        "addToCur": True,
+    }
+
+    package_path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="obsankipy_apkg_") as tmp_dir:
+        collection_path = Path(tmp_dir) / "collection.anki2"
+        db = sqlite3.connect(collection_path)
+        try:
+            db.executescript(APKG_SCHEMA)
+            db.execute(
+                "INSERT INTO col VALUES (1, ?, ?, ?, 11, 0, 0, 0, ?, ?, ?, ?, '{}')",
+                (
+                    now,
+                    now * 1000,
+                    now * 1000,
+                    json.dumps(conf),
+                    json.dumps({str(model["id"]): model for model in models.values()}),
+                    json.dumps(decks),
+                    json.dumps({"1": DEFAULT_DECK_CONFIG}),
+                ),
+            )
+            db.executemany("INSERT INTO notes VALUES (?,?,?,?,?,?,?,?,?,?,?)", note_rows)
+            db.executemany(
+                "INSERT INTO cards VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", card_rows
+            )
+            db.commit()
+        finally:
+            db.close()
+
+        with zipfile.ZipFile(package_path, "w") as package:
+            package.write(collection_path, "collection.anki2", compress_type=zipfile.ZIP_DEFLATED)
+            # the medias are already compressed, they are stored as they are
+            for index, (_, media_path) in enumerate(media_paths):
+                package.write(media_path, str(index))
+            package.writestr(
+                "media",
+                json.dumps({str(index): filename for index, (filename, _) in enumerate(media_paths)}),
+            )
+    return len(card_rows)
+
+
+def _card_ords(model: dict, fields: List[str]) -> List[int]:
+    """
+    a cloze note has a card per cloze number, the other notes a card per template
+    """
+    if model.get("type") == CLOZE_MODEL_TYPE:
+        numbers = {int(number) for field in fields for number in CLOZE_NUMBER.findall(field)}
+        return sorted(number - 1 for number in numbers if number > 0) or [0]
+    return [template["ord"] for template in model["tmpls"]]
+
+
+def _strip_html(text: str) -> str:
+    return HTML_TAG.sub("", text)
+
+
+def find_imported_notes(
+    export: ApkgExport,
+    anki_note_ids: Set[int],
+    ids_by_guid: Optional[Dict[str, int]] = None,
+) -> List[Optional[int]]:
+    """
+    the IDs the exported notes have in anki, None for the ones that were not imported.
+    anki keeps the IDs of the package unless they are taken, with the collection reader the
+    notes are found by GUID so a note that got another ID is found too
+    """
+    if ids_by_guid is not None:
+        return [ids_by_guid.get(guid) for guid in export.guids]
+    return [note_id if note_id in anki_note_ids else None for note_id in export.note_ids]
+
+
+def drop_unimported_files(plan: SyncPlan, note_ids: Iterable[Optional[int]]) -> int:
+    """
+    leaves the files with notes missing from anki out of the caches, so they are scanned and
+    their missing notes added again by the next run. Returns the number of files left out
+    """
+    unimported = {
+        (note.vault, note.path)
+        for note, note_id in zip(plan.notes_to_add, note_ids)
+        if note_id is None
+    }
+    hashes = {
+        planned_file.hash
+        for planned_file in plan.files
+        if (planned_file.vault, planned_file.path) in unimported
+    }
+    for planned_cache in plan.caches:
+        planned_cache.hashes = [
+            file_hash for file_hash in planned_cache.hashes if file_hash not in hashes
+        ]
+        planned_cache.files = [
+            planned_file for planned_file in planned_cache.files if planned_file.hash not in hashes
+        ]
+    return len(unimported)
@@ -0,0 +1,635 @@
+import logging
+import time
+from collections import defaultdict
+from pathlib import PurePosixPath
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from anki.manager import AnkiManager
+from anki.utils import AnkiMultiRequestError
+from anki.media_digests import AnkiMediaDigests
+from anki.state_mirror import AnkiStateMirror
+from config_parser import VaultConfig
+from files import File
+from notes.fields import get_file_link
+from sync.inventory import InventoryEntry, NoteInventory
+from sync.journal import JournalState, SyncJournal
+from sync.plan import (
+    REMOVED_NOTES_BATCH_SIZE,
+    PlannedCache,
+    PlannedFile,
+    PlannedMedia,
+    PlannedNote,
+    SyncPlan,
+    fields_digest,
+)
+from utils.helpers import write_hashes_to_file
+from utils.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+# the tag given to the notes removed from their files when removed_notes is "tag"
+REMOVED_NOTES_TAG = "Obsidian-removed"
+# the clocks of this machine and of a remote anki may differ, the IDs anki gives are its creation times
+ANKI_CLOCK_MARGIN_MS = 10 * 60 * 1000
+
+
+class PlanExecutor:
+    """
+    applies a SyncPlan: sends its operations to anki, writes the IDs of the added notes
+    and erases the IDs of the deleted ones in the source files, then writes the caches.
+    The vaults of the plan are resolved by name with the given vault configs.
+    With a journal every completed phase is recorded, and a run resumed from the
+    JournalState of an interrupted one skips what was already done
+    """
+
+    plan: SyncPlan
+    vault_configs: Dict[str, VaultConfig]
+    anki: AnkiManager
+    metrics: Metrics
+
+    def __init__(
+        self,
+        plan: SyncPlan,
+        vault_configs: List[VaultConfig],
+        anki: AnkiManager,
+        metrics: Optional[Metrics] = None,
+        journal: Optional[SyncJournal] = None,
+        resume: Optional[JournalState] = None,
+        media_digests: Optional[AnkiMediaDigests] = None,
+        anki_state: Optional[AnkiStateMirror] = None,
+    ):
+        self.plan = plan
+        self.vault_configs = {
+            vault_config.name: vault_config for vault_config in vault_configs
+        }
+        self.anki = anki
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.journal = journal
+        self.resume = resume
+        self.media_digests = media_digests
+        self.anki_state = anki_state
+        # (vault, path) -> notes added to / deleted from that file
+        self.added_notes: Dict[Tuple[str, str], List[PlannedNote]] = defaultdict(list)
+        self.deleted_notes: Dict[Tuple[str, str], List[PlannedNote]] = defaultdict(list)
+        # path -> (hash before, hash after) of the files edited, per vault, like the journal.
+        # None after for the files left out of the cache, they are scanned again in the next run
+        self.new_hashes: Dict[str, Dict[str, Tuple[str, Optional[str]]]] = defaultdict(dict)
+        # note ID -> digest of the fields of the notes whose link was replaced by relink_notes
+        self.relinked_digests: Dict[int, str] = {}
+        # the actions anki could not apply, the files they come from are left out of the
+        # cache so the next run synchronizes them again, see send_isolated
+        self.failures: List[str] = []
+        self.failed_files: Set[Tuple[str, str]] = set()
+        self.failed_decks: Set[str] = set()
+        self.failed_medias: Set[str] = set()
+
+        missing = {
+            item.vault
+            for item in [*plan.files, *plan.medias_to_store, *plan.caches]
+            if item.vault not in self.vault_configs
+        }
+        if missing:
+            raise ValueError(
+                f"⚠️ The plan references vaults that are not in the config: {sorted(missing)}"
+            )
+
+    def execute(self) -> None:
+        if self.journal is not None and self.resume is None:
+            self.journal.start(self.plan)
+        completed_phases = self.resume.completed_phases if self.resume else {}
+
+        phases = [
+            ("create_decks", self.create_decks),
+            ("delete_notes", self.delete_notes),
+            ("remove_notes", self.remove_notes),
+            ("add_notes", self.add_notes),
+            ("edit_notes", self.edit_notes),
+            ("relink_notes", self.relink_notes),
+            ("store_medias", self.store_medias),
+            ("edit_files", self.edit_files),
+            ("write_caches", self.write_caches),
+        ]
+        for name, phase in phases:
+            if name in completed_phases:
+                logger.info("⏭️  Skipping %s, it was completed by the interrupted run", name)
+                self.restore_phase(name, completed_phases[name])
+                continue
+            data = phase() or {}
+            if self.failures:
+                data.update(self.failures_data())
+            if self.journal is not None:
+                self.journal.record_phase(name, **data)
+
+        if self.anki_state is not None and self.plan.has_anki_operations():
+            self.update_anki_state()
+        if self.journal is not None:
+            self.journal.remove()
+        if self.failures:
+            self.report_failures()
+
+    def send_isolated(
+        self,
+        send: Callable[[], Any],
+        items: list,
+        files_of: Callable[[Any], Iterable[Tuple[str, str]]],
+        describe: Callable[[Any], str],
+    ) -> Tuple[Optional[list], list]:
+        """
+        sends a multi request made of an action per item. Anki applies each action on its own,
+        so a failed one does not stop the run: it is reported, and the files its item comes from
+        are left out of the cache. The next run scans them again and only redoes their actions.
+        Returns the result of send, None for the results of a multi request that partly
+        failed, and the failed items
+        """
+        try:
+            return send(), []
+        except AnkiMultiRequestError as e:
+            failed = []
+            for index, error in e.errors.items():
+                item = items[index]
+                failed.append(item)
+                self.failures.append(f"{describe(item)}: {error}")
+                self.failed_files.update(files_of(item))
+            logger.warning("⚠️ %s of %s actions failed in Anki", len(e.errors), len(items))
+            return e.results, failed
+
+    def note_files(self, note_ids: Iterable[int]) -> List[Tuple[str, str]]:
+        """the files the edited notes come from"""
+        files = {}
+        for note in (
+            self.plan.notes_to_edit
+            + self.plan.notes_to_update_fields
+            + self.plan.notes_to_change_deck
+        ):
+            files[note.note_id] = (note.vault, note.path)
+        for move in self.plan.moved_files:
+            for note_id in move.note_ids:
+                files[note_id] = (move.vault, move.new_path)
+        return [files[note_id] for note_id in note_ids if note_id in files]
+
+    def failures_data(self) -> dict:
+        # journaled with the phases, so a resumed run still leaves the files out of the cache
+        return {
+            "failures": self.failures,
+            "failed_files": sorted(self.failed_files),
+            "failed_decks": sorted(self.failed_decks),
+            "failed_medias": sorted(self.failed_medias),
+        }
+
+    def report_failures(self) -> None:
+        self.metrics.count("anki_failures", "actions", len(self.failures))
+        logger.warning(
+            "⚠️ Anki could not apply %s actions, the rest of the plan was applied. "
+            "The %s files concerned will be synchronized again by the next run:",
+            len(self.failures),
+            len(self.failed_files),
+        )
+        for failure in self.failures:
+            logger.warning("   ❗ %s", failure)
+        for vault, path in sorted(self.failed_files):
+            logger.warning("   📄 %s: %s", vault, path)
+
+    def update_anki_state(self) -> None:
+        self.anki_state.record_changes(
+            added_note_ids=[
+                note.note_id for notes in self.added_notes.values() for note in notes
+            ],
+            deleted_note_ids=[note.note_id for note in self.plan.notes_to_delete]
+            + self.plan.removed_notes_to_delete,
+            decks=[deck for deck in self.plan.decks_to_create if deck not in self.failed_decks],
+            medias=[
+                media.filename
+                for media in self.plan.medias_to_store
+                if media.filename not in self.failed_medias
+            ],
+        )
+        self.anki_state.check(self.anki)
+
+    def restore_phase(self, name: str, data: dict) -> None:
+        """
+        rebuilds the state a skipped phase would have left for the next ones
+        """
+        if name == "delete_notes":
+            self.index_deleted_notes()
+        elif name == "add_notes":
+            self.set_added_notes_ids(data.get("note_ids", []))
+        elif name == "relink_notes":
+            self.relinked_digests = {
+                int(note_id): digest
+                for note_id, digest in data.get("fields_digests", {}).items()
+            }
+        if "failures" in data:
+            self.failures = data["failures"]
+            self.failed_files = {(vault, path) for vault, path in data["failed_files"]}
+            self.failed_decks = set(data["failed_decks"])
+            self.failed_medias = set(data["failed_medias"])
+
+    def create_decks(self) -> None:
+        decks = self.plan.decks_to_create
+        if not decks:
+            return
+        with self.metrics.stage("anki_create_decks") as stage:
+            try:
+                _, failed = self.send_isolated(
+                    lambda: self.anki.create_decks(decks),
+                    decks,
+                    self.deck_files,
+                    lambda deck: f"creating deck {deck}",
+                )
+            except Exception:
+                # some of the decks may not exist after all
+                if self.anki_state is not None:
+                    self.anki_state.invalidate_decks()
+                raise
+            if failed:
+                self.failed_decks.update(failed)
+                if self.anki_state is not None:
+                    self.anki_state.invalidate_decks()
+            stage.count("decks", len(decks))
+
+    def deck_files(self, deck: str) -> List[Tuple[str, str]]:
+        """the files of the notes going to a deck"""
+        return [
+            (note.vault, note.path)
+            for note in self.plan.notes_to_add
+            + self.plan.notes_to_edit
+            + self.plan.notes_to_change_deck
+            if note.deck_name == deck
+        ]
+
+    def delete_notes(self) -> None:
+        notes = self.plan.notes_to_delete
+        if not notes:
+            return
+        logger.info("❌ Deleting %s notes...", len(notes))
+        with self.metrics.stage("anki_delete_notes") as stage:
+            self.anki.delete_notes(notes)
+            stage.count("notes", len(notes))
+        self.index_deleted_notes()
+
+    def index_deleted_notes(self) -> None:
+        for note in self.plan.notes_to_delete:
+            self.deleted_notes[(note.vault, note.path)].append(note)
+
+    def remove_notes(self) -> None:
+        """
+        the notes whose ID disappeared from their file are deleted or tagged in batches
+        """
+        to_delete = self.plan.removed_notes_to_delete
+        to_tag = self.plan.removed_notes_to_tag
+        if not to_delete and not to_tag:
+            return
+        with self.metrics.stage("anki_remove_notes") as stage:
+            if to_delete:
+                logger.info("❌ Deleting %s notes removed from their files...", len(to_delete))
+            for start in range(0, len(to_delete), REMOVED_NOTES_BATCH_SIZE):
+                self.anki.delete_notes_by_ids(to_delete[start : start + REMOVED_NOTES_BATCH_SIZE])
+            if to_tag:
+                logger.info(
+                    "🏷️  Tagging %s notes removed from their files with %s...",
+                    len(to_tag),
+                    REMOVED_NOTES_TAG,
+                )
+            for start in range(0, len(to_tag), REMOVED_NOTES_BATCH_SIZE):
+                self.anki.add_tags(
+                    to_tag[start : start + REMOVED_NOTES_BATCH_SIZE], [REMOVED_NOTES_TAG]
+                )
+            stage.count("deleted", len(to_delete))
+            stage.count("tagged", len(to_tag))
+
+    def add_notes(self) -> Optional[dict]:
+        notes = self.plan.notes_to_add
+        if not notes:
+            logger.info("ℹ️  No new notes to add")
+            return
+        started = self.resume.started_phases.get("add_notes") if self.resume else None
+        if self.journal is not None:
+            # anki may add the notes and the run die before their IDs are journaled
+            self.journal.record_phase_start("add_notes", since_ms=int(time.time() * 1000))
+        # in the order of the plan, None for the notes anki does not have
+        note_ids: List[Optional[int]] = [None] * len(notes)
+        if started is not None:
+            note_ids = self.find_added_notes(notes, started["since_ms"])
+        to_add = [note for note, note_id in zip(notes, note_ids) if note_id is None]
+
+        add_response = []
+        if to_add:
+            with self.metrics.stage("anki_add_notes") as stage:
+                add_response = self.anki.adds_new_notes(to_add) or []
+                stage.count("notes", len(to_add))
+                stage.count("added", len(add_response))
+            if add_response:
+                logger.info("✅ Successfully added %s notes", len(add_response))
+            else:
+                logger.warning("⚠️ No notes were added (possibly all duplicates)")
+        added_ids = {id(note): note_id for note, note_id in add_response}
+        # the duplicates anki refused stay None
+        note_ids = [
+            note_id if note_id is not None else added_ids.get(id(note))
+            for note, note_id in zip(notes, note_ids)
+        ]
+        if not any(note_id is not None for note_id in note_ids):
+            return
+        self.set_added_notes_ids(note_ids)
+        return {"note_ids": note_ids}
+
+    def find_added_notes(self, notes: List[PlannedNote], since_ms: int) -> List[Optional[int]]:
+        """
+        the interrupted run may have lost the response of addNotes, the notes anki added
+        then are adopted instead of being refused as duplicates and left without their IDs in the files
+        """
+        with self.metrics.stage("anki_find_added_notes") as stage:
+            note_ids = self.anki.find_added_notes(notes, since_ms - ANKI_CLOCK_MARGIN_MS)
+            found = sum(note_id is not None for note_id in note_ids)
+            stage.count("notes", found)
+        if found:
+            logger.info("🔗 %s notes were already added by the interrupted run", found)
+        return note_ids
+
+    def set_added_notes_ids(self, note_ids: List[Optional[int]]) -> None:
+        for note, note_id in zip(self.plan.notes_to_add, note_ids):
+            if note_id is None:
+                continue
+            note.note_id = note_id
+            self.added_notes[(note.vault, note.path)].append(note)
+
+    def edit_notes(self) -> None:
+        notes = self.plan.notes_to_edit
+        notes_to_move = notes + self.plan.notes_to_change_deck
+        if not (
+            notes_to_move
+            or self.plan.notes_to_update_fields
+            or self.plan.tags_to_add
+            or self.plan.tags_to_remove
+        ):
+            logger.info("ℹ️  No notes to update")
+            return
+
+        def source_file(note: PlannedNote) -> List[Tuple[str, str]]:
+            return [(note.vault, note.path)]
+
+        if notes_to_move:
+            with self.metrics.stage("anki_get_cards") as stage:
+                cards_ids, failed = self.send_isolated(
+                    lambda: [
+                        cards_ids
+                        for _, cards_ids in self.anki.get_cards_ids_from_note(notes_to_move)
+                    ],
+                    notes_to_move,
+                    source_file,
+                    lambda note: f"finding the cards of note {note.note_id}",
+                )
+                # populates the note with its cards ids so it can be used by the requester
+                for note, note_cards_ids in zip(notes_to_move, cards_ids):
+                    note.cards_ids = note_cards_ids
+                stage.count("notes", len(notes_to_move))
+            # the deck of a note whose cards are unknown cannot be changed
+            notes_to_move = [note for note in notes_to_move if note.cards_ids is not None]
+        if notes:
+            with self.metrics.stage("anki_update_notes") as stage:
+                self.send_isolated(
+                    lambda: self.anki.updates_existing_notes(notes),
+                    notes,
+                    source_file,
+                    lambda note: f"updating note {note.note_id} of {note.path}",
+                )
+                stage.count("notes", len(notes))
+        if self.plan.notes_to_update_fields:
+            fields = {note.note_id: note.fields for note in self.plan.notes_to_update_fields}
+            with self.metrics.stage("anki_update_fields") as stage:
+                self.send_isolated(
+                    lambda: self.anki.update_notes_fields(fields),
+                    list(fields),
+                    lambda note_id: self.note_files([note_id]),
+                    lambda note_id: f"updating the fields of note {note_id}",
+                )
+                stage.count("notes", len(fields))
+        if notes_to_move:
+            with self.metrics.stage("anki_change_deck") as stage:
+                self.send_isolated(
+                    lambda: self.anki.ensure_correct_deck(notes_to_move),
+                    notes_to_move,
+                    source_file,
+                    lambda note: f"moving note {note.note_id} to deck {note.deck_name}",
+                )
+                stage.count("notes", len(notes_to_move))
+        if self.plan.tags_to_add or self.plan.tags_to_remove:
+            # in the order update_tags sends them
+            tag_changes = [
+                ("removing", tag, note_ids) for tag, note_ids in self.plan.tags_to_remove.items()
+            ]
+            tag_changes += [
+                ("adding", tag, note_ids) for tag, note_ids in self.plan.tags_to_add.items()
+            ]
+            with self.metrics.stage("anki_update_tags") as stage:
+                self.send_isolated(
+                    lambda: self.anki.update_tags(
+                        self.plan.tags_to_add, self.plan.tags_to_remove
+                    ),
+                    tag_changes,
+                    lambda tag_change: self.note_files(tag_change[2]),
+                    lambda tag_change: (
+                        f"{tag_change[0]} tag {tag_change[1]} on {len(tag_change[2])} notes"
+                    ),
+                )
+                stage.count("tags", len(tag_changes))
+
+    def relink_notes(self) -> Optional[dict]:
+        """
+        replaces the link to the old name of the renamed files at the end of the front of their
+        notes, the notes are neither rendered nor sent again. The notes anki still had as they
+        were last sent get the digest of their relinked fields, so the next edit of the file
+        only sends what changed
+        """
+        links = {}
+        states = {}
+        for move in self.plan.moved_files:
+            if not move.renamed:
+                continue
+            old_link = get_file_link(move.vault, PurePosixPath(move.old_path).name)
+            new_link = get_file_link(move.vault, PurePosixPath(move.new_path).name)
+            for note_id in move.note_ids:
+                links[note_id] = (old_link, new_link)
+            states.update(move.notes)
+        if not links:
+            return
+        with self.metrics.stage("anki_relink_notes") as stage:
+            updates = {}
+            digests = {}
+            for note_id, fields in self.anki.get_notes_fields(list(links)).items():
+                old_link, new_link = links[note_id]
+                changed_fields = {
+                    name: value.replace(old_link, new_link)
+                    for name, value in fields.items()
+                    if old_link in value
+                }
+                if not changed_fields:
+                    continue
+                updates[note_id] = changed_fields
+                state = states.get(note_id)
+                if state is not None and state.fields_digest == fields_digest(fields):
+                    digests[note_id] = fields_digest({**fields, **changed_fields})
+            _, failed = self.send_isolated(
+                lambda: self.anki.update_notes_fields(updates),
+                list(updates),
+                lambda note_id: self.note_files([note_id]),
+                lambda note_id: f"relinking note {note_id}",
+            )
+            for note_id in failed:
+                digests.pop(note_id, None)
+            self.relinked_digests = digests
+            stage.count("notes", len(links))
+            stage.count("relinked", len(updates))
+        logger.info("🔗 Updated the link to their renamed file in %s notes", len(updates))
+        return {"fields_digests": digests}
+
+    def store_medias(self) -> None:
+        medias = self.plan.medias_to_store
+        if not medias:
+            logger.info("ℹ️  No new media files to upload")
+            return
+        for media in medias:
+            media.absolute_path = str(
+                self.vault_configs[media.vault].medias_dir_path / media.path
+            )
+        with self.metrics.stage("anki_store_media") as stage:
+            _, failed = self.send_isolated(
+                lambda: self.anki.store_media_files(medias),
+                medias,
+                self.media_files,
+                lambda media: f"storing media {media.filename}",
+            )
+            self.failed_medias.update(media.filename for media in failed)
+            stage.count("medias", len(medias))
+        if self.media_digests is not None:
+            # the next runs compare with what was uploaded instead of downloading it back
+            for media in medias:
+                if media.hash is not None and media.filename not in self.failed_medias:
+                    self.media_digests.record(media.filename, media.hash)
+            self.media_digests.save()
+
+    def media_files(self, media: PlannedMedia) -> List[Tuple[str, str]]:
+        """the scanned files embedding a media"""
+        return [
+            (planned_cache.vault, planned_file.path)
+            for planned_cache in self.plan.caches
+            if planned_cache.vault == media.vault
+            for planned_file in planned_cache.files
+            if media.filename in planned_file.medias
+        ]
+
+    def edit_files(self) -> None:
+        files = [
+            planned_file
+            for planned_file in self.plan.files
+            if (planned_file.vault, planned_file.path) in self.added_notes
+            or (planned_file.vault, planned_file.path) in self.deleted_notes
+        ]
+        if not files:
+            return
+        edited_files = self.resume.edited_files if self.resume else {}
+        with self.metrics.stage("write_back") as stage:
+            for planned_file in files:
+                key = (planned_file.vault, planned_file.path)
+                if key in edited_files:
+                    self.new_hashes[planned_file.vault][planned_file.path] = edited_files[key]
+                    continue
+                vault_config = self.vault_configs[planned_file.vault]
+                file = File(vault_config.dir_path / planned_file.path, planned_file.vault)
+                if file.original_hash != planned_file.hash:
+                    # the IDs positions were computed on the planned content, writing them now could corrupt the file
+                    logger.warning(
+                        "⚠️ %s changed since the plan was made, its note IDs were not written, "
+                        "it will be scanned again in the next run",
+                        file.path,
+                    )
+                    self.record_file_edit(planned_file.vault, planned_file, None)
+                    continue
+                for note in self.added_notes.get(key, []):
+                    file.append_to_add_notes(note)
+                file.overwrite_content_with_new_ids(
+                    file.get_id_file_location_from_added_notes()
+                )
+                if key in self.deleted_notes:
+                    file.erase_ids_marked_for_deletion()
+                file.write_new_content()
+                file.recompute_hash()
+                self.record_file_edit(planned_file.vault, planned_file, file.curr_hash)
+            stage.count("files", len(files))
+        logger.info("✍️ Updated %s source files with note IDs", len(files))
+
+    def record_file_edit(
+        self, vault: str, planned_file: PlannedFile, new_hash: Optional[str]
+    ) -> None:
+        self.new_hashes[vault][planned_file.path] = (planned_file.hash, new_hash)
+        if self.journal is not None:
+            self.journal.record_file(vault, planned_file.path, planned_file.hash, new_hash)
+
+    def write_caches(self) -> None:
+        logger.info("💾 Updating file hash cache...")
+        with self.metrics.stage("cache_write") as stage:
+            for planned_cache in self.plan.caches:
+                vault_config = self.vault_configs[planned_cache.vault]
+                new_hashes = self.new_hashes[planned_cache.vault]
+                for planned_file in planned_cache.files:
+                    if (planned_cache.vault, planned_file.path) in self.failed_files:
+                        # left out of the cache, it is scanned again in the next run
+                        new_hashes[planned_file.path] = (planned_file.hash, None)
+                curr_hashes = replace_hashes(planned_cache.hashes, new_hashes.values())
+                vault_config.hashes_path.parent.mkdir(parents=True, exist_ok=True)
+                write_hashes_to_file(curr_hashes, vault_config.hashes_path)
+                self.update_inventory(planned_cache, curr_hashes)
+                stage.count("hashes", len(curr_hashes))
+                logger.info(
+                    "💾 Updated cache of vault %s with %s file hashes",
+                    planned_cache.vault,
+                    len(curr_hashes),
+                )
+
+    def update_inventory(self, planned_cache: PlannedCache, curr_hashes: List[str]) -> None:
+        vault = planned_cache.vault
+        inventory = NoteInventory.load(self.vault_configs[vault].note_inventory_path)
+        new_hashes = self.new_hashes[vault]
+        for planned_file in planned_cache.files:
+            _, file_hash = new_hashes.get(planned_file.path, (None, planned_file.hash))
+            if not file_hash:  # left out of the cache, it is scanned again in the next run
+                continue
+            added_notes = self.added_notes.get((vault, planned_file.path), [])
+            notes = {
+                note_id: state.model_dump() for note_id, state in planned_file.notes.items()
+            }
+            for note_id in notes.keys() & self.relinked_digests.keys():
+                notes[note_id]["fields_digest"] = self.relinked_digests[note_id]
+            notes.update(
+                (note.note_id, note.synced_state().model_dump()) for note in added_notes
+            )
+            inventory.set_file(
+                file_hash,
+                InventoryEntry(
+                    planned_file.path,
+                    planned_file.note_ids + [note.note_id for note in added_notes],
+                    planned_file.medias,
+                    notes,
+                ),
+            )
+        inventory.keep_only(curr_hashes)
+        inventory.save()
+
+
+def replace_hashes(
+    hashes: List[str], new_hashes: Iterable[Tuple[str, Optional[str]]]
+) -> List[str]:
+    """
+    the hashes of a cache with each (hash before, hash after) of an edited file applied, files
+    with the same content share their hash so it is replaced once per edited file, not everywhere
+    """
+    replacements: Dict[str, List[Optional[str]]] = defaultdict(list)
+    for old_hash, new_hash in new_hashes:
+        replacements[old_hash].append(new_hash)
+    curr_hashes = []
+    for file_hash in hashes:
+        if replacements.get(file_hash):
+            file_hash = replacements[file_hash].pop()
+        if file_hash:
+            curr_hashes.append(file_hash)
+    return curr_hashes
@@ -0,0 +1,190 @@
+"""
+the garbage collection finds the anki notes and medias that no file of the vaults references
+anymore: the notes removed from a file without #DELETE, the notes of deleted files and the
+medias of deleted notes. It reads the note inventory of each vault instead of scanning it,
+only the files the inventory does not know yet are scanned
+"""
+
+import logging
+from pathlib import Path
+from typing import List, Set
+
+from pydantic import BaseModel, Field
+
+from anki.manager import AnkiManager
+from config_parser import ScanConfig
+from media import MediaState
+from notes.manager import NotesManager
+from notes.note import State
+from sync.inventory import InventoryEntry, NoteInventory
+from utils.metrics import Metrics
+from utils.regex_guard import RegexScanner
+from vault import VaultSync
+
+logger = logging.getLogger(__name__)
+
+# every note sent by obsankipy has this tag
+OBSIDIAN_NOTES_QUERY = "tag:Obsidian"
+
+
+class GarbageReport(BaseModel):
+    """
+    the orphaned notes and medias found by a garbage collection, and how many were deleted
+    """
+
+    dry_run: bool
+    notes: List[int] = Field(default_factory=list)
+    medias: List[str] = Field(default_factory=list)
+    deleted_notes: int = 0
+    deleted_medias: int = 0
+
+    def summary_lines(self) -> List[str]:
+        lines = [
+            f"🗑️  Orphaned notes:            {len(self.notes):>5}",
+            f"🗑️  Orphaned media files:      {len(self.medias):>5}",
+        ]
+        if self.dry_run:
+            lines.append("🧪 Dry run, nothing was deleted from Anki")
+        else:
+            lines.append(f"❌ Notes deleted:             {self.deleted_notes:>5}")
+            lines.append(f"❌ Media files deleted:       {self.deleted_medias:>5}")
+        return lines
+
+    def save(self, path: Path) -> None:
+        logger.info(f"💾 Writing garbage collection report to {path}")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.model_dump_json(indent=1))
+
+
+def load_inventory(vault_sync: VaultSync, scan_config: ScanConfig) -> NoteInventory:
+    """
+    the inventory of a vault, with an entry for each of its files. It is only trusted when every
+    file is already synchronized, the files the inventory does not know yet (e.g. synchronized
+    before the inventory existed) are scanned to fill it in
+    """
+    # every file is needed, the ones git does not list included
+    vault = vault_sync.find_new_files(full_walk=True)
+    if vault.new_files:
+        raise ValueError(
+            f"⚠️ {len(vault.new_files)} files of vault {vault_sync.name} changed since the last "
+            f"synchronization, synchronize the vault before collecting its garbage."
+        )
+
+    inventory = NoteInventory.load(vault_sync.config.note_inventory_path)
+    inventory.keep_only(file.original_hash for file in vault.files)
+    unknown_files = [file for file in vault.files if file.original_hash not in inventory.files]
+    if unknown_files:
+        logger.info(
+            f"📄 Scanning {len(unknown_files)} files of vault {vault_sync.name} missing from its note inventory..."
+        )
+    notes = []
+    with RegexScanner(
+        timeout_seconds=scan_config.file_timeout_seconds,
+        engine=scan_config.regex_engine,
+    ) as scanner:
+        for file in unknown_files:
+            file.read_file()
+            notes.extend(vault.scan_file(file, scanner))
+    if vault.skipped_files:
+        raise ValueError(
+            f"⚠️ {len(vault.skipped_files)} files of vault {vault_sync.name} timed out while they "
+            f"were scanned, their notes would be collected."
+        )
+
+    # the medias are resolved so the ones missing from the vault are left out, like in a sync
+    vault_sync.notes_manager = NotesManager(notes)
+    vault_sync.load_media_data()
+    for file in unknown_files:
+        inventory.set_file(
+            file.original_hash,
+            InventoryEntry(
+                Path(file.path).relative_to(vault_sync.config.dir_path).as_posix(),
+                [
+                    note.note_id
+                    for note in file.found_notes
+                    if note.state == State.UNKNOWN  # it has an ID, it is not marked for deletion
+                ],
+                sorted(
+                    {
+                        media.filename
+                        for note in file.found_notes
+                        if note.state != State.MARKED_FOR_DELETION
+                        for media in note.medias
+                        if media.state != MediaState.MISSING
+                    }
+                ),
+            ),
+        )
+    inventory.save()
+    return inventory
+
+
+def find_garbage(
+    inventories: List[NoteInventory],
+    anki_requester: AnkiManager,
+    dry_run: bool,
+) -> GarbageReport:
+    """
+    a note is an orphan when it has the Obsidian tag, a vault had its ID once and no file of any
+    vault has it anymore, the notes of the vaults synchronized with other configs are left alone.
+    A media is an orphan when no file of any vault embeds it, only the medias a vault synchronized
+    once are considered: a media of the media dir may be an anki media with the same name
+    """
+    referenced_note_ids: Set[int] = set()
+    referenced_medias: Set[str] = set()
+    synced_note_ids: Set[int] = set()
+    synced_medias: Set[str] = set()
+    for inventory in inventories:
+        referenced_note_ids |= inventory.referenced_note_ids()
+        synced_note_ids |= inventory.synced_note_ids
+        referenced_medias |= inventory.referenced_medias()
+        synced_medias |= inventory.synced_medias
+
+    obsidian_note_ids = anki_requester.get_ids(OBSIDIAN_NOTES_QUERY)
+    logger.info(f"📄 Found {len(obsidian_note_ids)} notes with the Obsidian tag in Anki")
+    medias_in_anki = anki_requester.get_medias()
+    anki_medias = set(medias_in_anki["images"]) | set(medias_in_anki["audios"])
+
+    return GarbageReport(
+        dry_run=dry_run,
+        notes=sorted((obsidian_note_ids & synced_note_ids) - referenced_note_ids),
+        medias=sorted((anki_medias & synced_medias) - referenced_medias),
+    )
+
+
+def collect_garbage(
+    report: GarbageReport,
+    inventories: List[NoteInventory],
+    anki_requester: AnkiManager,
+    metrics: Metrics,
+    batch_size: int,
+) -> None:
+    """
+    deletes the orphans of the report from anki, batch_size of them per request, so a
+    collection that accumulated for a long time does not block anki in a single request
+    """
+    with metrics.stage("gc_delete_notes") as stage:
+        for start in range(0, len(report.notes), batch_size):
+            note_ids = report.notes[start : start + batch_size]
+            anki_requester.delete_notes_by_ids(note_ids)
+            report.deleted_notes += len(note_ids)
+            for inventory in inventories:
+                inventory.forget_note_ids(note_ids)
+            logger.info(f"❌ Deleted {report.deleted_notes}/{len(report.notes)} orphaned notes")
+        stage.count("notes", report.deleted_notes)
+
+    with metrics.stage("gc_delete_medias") as stage:
+        for start in range(0, len(report.medias), batch_size):
+            medias = report.medias[start : start + batch_size]
+            anki_requester.delete_media_files(medias)
+            report.deleted_medias += len(medias)
+            # the inventories add them back if a file embeds them again
+            for inventory in inventories:
+                inventory.forget_medias(medias)
+            logger.info(
+                f"❌ Deleted {report.deleted_medias}/{len(report.medias)} orphaned media files"
+            )
+        stage.count("medias", report.deleted_medias)
+
+    for inventory in inventories:
+        inventory.save()
@@ -0,0 +1,144 @@
+import json
+import logging
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+INVENTORY_VERSION = 1
+
+
+class InventoryEntry:
+    """
+    what the last synchronization found in a file: the IDs of its notes and the medias they embed
+    """
+
+    __slots__ = ("path", "note_ids", "medias", "notes")
+
+    path: str  # relative to the vault, where the file was when it was last scanned
+    note_ids: List[int]
+    medias: List[str]
+    # note ID -> what was last sent to anki for it (see PlannedNoteState), the notes
+    # synchronized before the states were kept have none and are sent whole
+    notes: Dict[int, dict]
+
+    def __init__(
+        self,
+        path: str,
+        note_ids: List[int],
+        medias: List[str],
+        notes: Optional[Dict[int, dict]] = None,
+    ):
+        self.path = path
+        self.note_ids = note_ids
+        self.medias = medias
+        self.notes = notes if notes is not None else {}
+
+
+class NoteInventory:
+    """
+    the notes and medias of every file of a vault, saved next to its hash cache.
+    The entries are keyed by the hash of the file, like the cache, so an unchanged file keeps
+    its entry without being scanned again, even when it is moved. It is updated with the
+    scanned files once their notes are synchronized, and the entries of the files that are
+    no longer in the cache are dropped.
+    It also remembers every note ID and media name the vault ever had, so the garbage collection
+    never touches the anki notes and medias that do not come from the vaults of the config
+    """
+
+    path: Path
+    files: Dict[str, InventoryEntry]  # file hash -> entry
+    synced_note_ids: Set[int]
+    synced_medias: Set[str]
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.files = {}
+        self.synced_note_ids = set()
+        self.synced_medias = set()
+
+    @classmethod
+    def load(cls, path: Path) -> "NoteInventory":
+        inventory = cls(path)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                saved = json.loads(f.read())
+        except FileNotFoundError:
+            return inventory
+        except json.JSONDecodeError as e:
+            logger.warning(f"Invalid JSON in note inventory {path}: {e}, starting a new one")
+            return inventory
+        if saved.get("version") != INVENTORY_VERSION:
+            return inventory
+        inventory.files = {
+            file_hash: InventoryEntry(
+                entry["path"],
+                entry["note_ids"],
+                entry["medias"],
+                {int(note_id): state for note_id, state in entry.get("notes", {}).items()},
+            )
+            for file_hash, entry in saved["files"].items()
+        }
+        # the inventories saved before the note IDs were kept only know their current notes
+        inventory.synced_note_ids = set(
+            saved.get("synced_note_ids", inventory.referenced_note_ids())
+        )
+        inventory.synced_medias = set(saved["synced_medias"])
+        return inventory
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(
+                json.dumps(
+                    {
+                        "version": INVENTORY_VERSION,
+                        "files": {
+                            file_hash: {
+                                "path": entry.path,
+                                "note_ids": entry.note_ids,
+                                "medias": entry.medias,
+                                "notes": entry.notes,
+                            }
+                            for file_hash, entry in self.files.items()
+                        },
+                        "synced_note_ids": sorted(self.synced_note_ids),
+                        "synced_medias": sorted(self.synced_medias),
+                    }
+                )
+            )
+
+    def set_file(self, file_hash: str, entry: InventoryEntry) -> None:
+        self.files[file_hash] = entry
+        self.synced_note_ids.update(entry.note_ids)
+        self.synced_medias.update(entry.medias)
+
+    def keep_only(self, file_hashes: Iterable[str]) -> None:
+        file_hashes = set(file_hashes)
+        self.files = {
+            file_hash: entry
+            for file_hash, entry in self.files.items()
+            if file_hash in file_hashes
+        }
+
+    def forget_note_ids(self, note_ids: Iterable[int]) -> None:
+        self.synced_note_ids.difference_update(note_ids)
+
+    def forget_medias(self, medias: Iterable[str]) -> None:
+        self.synced_medias.difference_update(medias)
+
+    def missing_hashes(self, file_hashes: Iterable[str]) -> List[str]:
+        return [file_hash for file_hash in file_hashes if file_hash not in self.files]
+
+    def referenced_note_ids(self) -> Set[int]:
+        return {note_id for entry in self.files.values() for note_id in entry.note_ids}
+
+    def note_states(self) -> Dict[int, dict]:
+        return {
+            note_id: state
+            for entry in self.files.values()
+            for note_id, state in entry.notes.items()
+        }
+
+    def referenced_medias(self) -> Set[str]:
+        return {media for entry in self.files.values() for media in entry.medias}
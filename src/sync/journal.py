@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from sync.plan import SyncPlan
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_FILE_NAME = ".obsankipy_journal.jsonl"
+
+
+class JournalState:
+    """
+    what an interrupted run had already done, read back from its journal
+    """
+
+    plan: SyncPlan
+    # phase name -> data recorded when it completed
+    completed_phases: Dict[str, dict]
+    # phase name -> data recorded before it sent anything, for the phases that cannot simply be redone
+    started_phases: Dict[str, dict]
+    # (vault, path) -> (hash before, hash after) of the source files already edited
+    edited_files: Dict[Tuple[str, str], Tuple[str, Optional[str]]]
+
+    def __init__(self, plan: SyncPlan):
+        self.plan = plan
+        self.completed_phases = {}
+        self.started_phases = {}
+        self.edited_files = {}
+
+
+class SyncJournal:
+    """
+    write-ahead journal of a plan being applied, one json object per line:
+        - the plan, written before anything is sent to anki
+        - an entry before add_notes sends the notes, in case anki adds them but the response is lost
+        - an entry per completed phase, the add_notes one has the IDs anki returned
+        - an entry per source file edited, with its hash before and after the edit
+    every entry is flushed to disk before moving on, so a run that dies halfway can be
+    resumed from the journal, it is removed once the caches are written
+    """
+
+    path: Path
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def start(self, plan: SyncPlan) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"plan": plan.model_dump(mode="json")}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _append(self, entry: dict) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def record_phase(self, name: str, **data) -> None:
+        self._append({"phase": name, **data})
+
+    def record_phase_start(self, name: str, **data) -> None:
+        self._append({"started": name, **data})
+
+    def record_file(
+        self, vault: str, path: str, old_hash: str, new_hash: Optional[str]
+    ) -> None:
+        self._append(
+            {"file": path, "vault": vault, "old_hash": old_hash, "new_hash": new_hash}
+        )
+
+    def load(self) -> Optional[JournalState]:
+        """
+        None when the run died before the plan was fully written, nothing was sent to anki then
+        """
+        with open(self.path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        try:
+            state = JournalState(SyncPlan.model_validate(json.loads(lines[0])["plan"]))
+        except (IndexError, KeyError, ValueError):
+            logger.warning(f"⚠️ The journal {self.path} has no complete plan, ignoring it")
+            return None
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # the run died while writing this entry, so the step it records is not done
+                logger.warning(f"⚠️ Ignoring a truncated entry of the journal {self.path}")
+                break
+            if "phase" in entry:
+                state.completed_phases[entry.pop("phase")] = entry
+            elif "started" in entry:
+                # the first start is kept, a resumed run that dies again records another one
+                state.started_phases.setdefault(entry.pop("started"), entry)
+            else:
+                state.edited_files[(entry["vault"], entry["file"])] = (
+                    entry["old_hash"],
+                    entry["new_hash"],
+                )
+        return state
+
+    def remove(self) -> None:
+        if self.path.exists():
+            self.path.unlink()
+
@@ -0,0 +1,349 @@
+# the plan is the serializable list of everything a synchronization will do:
+# the anki operations and the edits of the source files (writing the IDs of the new notes
+# and erasing the IDs of the deleted ones). It can be saved with --plan-only and applied
+# later, possibly on another machine, with --apply-plan.
+# paths are stored relative to the vault (and to the media dir for the medias), the vaults
+# are referenced by name and resolved with the config of the machine applying the plan.
+
+import json
+import logging
+import math
+import time
+from pathlib import Path, PurePosixPath
+from typing import Dict, List, Optional, Set
+
+from pydantic import BaseModel, Field
+
+from utils.helpers import compute_hash, file_encode
+
+logger = logging.getLogger(__name__)
+
+PLAN_VERSION = 1
+# the notes removed from their files are deleted or tagged this many at a time
+REMOVED_NOTES_BATCH_SIZE = 100
+
+
+def fields_digest(fields: Dict[str, str]) -> str:
+    return compute_hash(json.dumps(fields, sort_keys=True).encode("utf-8"))
+
+
+class PlannedNoteState(BaseModel):
+    """
+    what was sent to anki for a note, kept in the note inventory so the next edits of its file
+    only send what changed. The fields are only kept as a digest
+    """
+
+    fields_digest: str
+    deck: str
+    tags: List[str]
+
+
+class PlannedNote(BaseModel):
+    note_id: Optional[int] = None
+    model_name: str
+    deck_name: str
+    tags: List[str]
+    fields: Dict[str, str]
+    vault: str
+    path: str
+    # where the ID of a new note has to be written in its source file
+    id_location_in_file: Optional[int] = None
+    cards_ids: Optional[List[int]] = None
+
+    @property
+    def target_deck(self) -> str:
+        return self.deck_name
+
+    @property
+    def front(self) -> str:
+        return next(iter(self.fields.values()), "")
+
+    def synced_state(self) -> PlannedNoteState:
+        return PlannedNoteState(
+            fields_digest=fields_digest(self.fields),
+            deck=self.deck_name,
+            tags=sorted(set(self.tags)),
+        )
+
+    def to_anki_dict(self) -> dict:
+        anki_dict = {
+            "modelName": self.model_name,
+            "deckName": self.deck_name,
+            "tags": self.tags,
+            "fields": self.fields,
+        }
+        if self.note_id is not None:  # to be used with updateNote in anki
+            anki_dict = {"id": self.note_id, **anki_dict}
+        return anki_dict
+
+
+class PlannedMedia(BaseModel):
+    filename: str
+    vault: str
+    path: str  # relative to the media dir of the vault
+    size: int
+    # sha256 of the content when it was planned, kept as the digest of the file stored in anki
+    hash: Optional[str] = None
+    # set by the executor once the vault is resolved, the data is only read when it is sent
+    absolute_path: Optional[str] = Field(default=None, exclude=True)
+
+    @property
+    def data(self) -> str:
+        return file_encode(self.absolute_path)
+
+    def to_anki_dict(self) -> dict:
+        return {"filename": self.filename, "data": self.data}
+
+
+class PlannedFile(BaseModel):
+    """
+    a source file the plan may edit, the edits are only applied if it still has this hash
+    """
+
+    vault: str
+    path: str
+    hash: str
+
+
+class PlannedMove(BaseModel):
+    """
+    an unchanged file found at another path than in the note inventory. It is not scanned
+    again, but when its name changed the link to it at the end of the front of its notes is
+    replaced in anki
+    """
+
+    vault: str
+    hash: str
+    old_path: str
+    new_path: str
+    note_ids: List[int]
+    medias: List[str]
+    notes: Dict[int, PlannedNoteState] = Field(default_factory=dict)
+
+    @property
+    def renamed(self) -> bool:
+        # the link only has the name of the file, moving it to another folder does not change it
+        return PurePosixPath(self.old_path).name != PurePosixPath(self.new_path).name
+
+
+class PlannedInventoryFile(BaseModel):
+    """
+    a scanned file as it goes in the note inventory, the IDs of its new notes are added
+    by the executor once anki returns them
+    """
+
+    path: str
+    hash: str
+    note_ids: List[int]  # the notes that already exist in anki
+    medias: List[str]
+    notes: Dict[int, PlannedNoteState] = Field(default_factory=dict)  # of the note_ids
+
+
+class PlannedCache(BaseModel):
+    """
+    the hashes to write to the cache of a vault once the plan is applied, the hashes of
+    the files edited by the executor are replaced by their new hash.
+    The scanned files update the note inventory of the vault
+    """
+
+    vault: str
+    hashes: List[str]
+    files: List[PlannedInventoryFile] = Field(default_factory=list)
+
+
+class OperationEstimate(BaseModel):
+    requests: int = 0
+    actions: int = 0
+    payload_bytes: int = 0
+
+
+class SyncPlan(BaseModel):
+    version: int = PLAN_VERSION
+    created_at: float = Field(default_factory=time.time)
+    decks_to_create: List[str] = Field(default_factory=list)
+    notes_to_delete: List[PlannedNote] = Field(default_factory=list)
+    # the notes removed from their file without #DELETE, deleted or tagged depending on the config
+    removed_notes_to_delete: List[int] = Field(default_factory=list)
+    removed_notes_to_tag: List[int] = Field(default_factory=list)
+    notes_to_add: List[PlannedNote] = Field(default_factory=list)
+    # the notes the inventory has no state for, they are sent whole
+    notes_to_edit: List[PlannedNote] = Field(default_factory=list)
+    # the other edited notes only send what changed since their last synchronization:
+    # their fields, their deck, and their tags one tag at a time, tag -> note IDs
+    notes_to_update_fields: List[PlannedNote] = Field(default_factory=list)
+    notes_to_change_deck: List[PlannedNote] = Field(default_factory=list)
+    tags_to_add: Dict[str, List[int]] = Field(default_factory=dict)
+    tags_to_remove: Dict[str, List[int]] = Field(default_factory=dict)
+    medias_to_store: List[PlannedMedia] = Field(default_factory=list)
+    moved_files: List[PlannedMove] = Field(default_factory=list)
+    files: List[PlannedFile] = Field(default_factory=list)
+    caches: List[PlannedCache] = Field(default_factory=list)
+    skipped_files: List[str] = Field(default_factory=list)
+    estimate: Dict[str, OperationEstimate] = Field(default_factory=dict)
+
+    def has_anki_operations(self) -> bool:
+        return bool(
+            self.decks_to_create
+            or self.notes_to_delete
+            or self.removed_notes_to_delete
+            or self.removed_notes_to_tag
+            or self.notes_to_add
+            or self.notes_to_edit
+            or self.notes_to_update_fields
+            or self.notes_to_change_deck
+            or self.tags_to_add
+            or self.tags_to_remove
+            or self.medias_to_store
+            or bool(self.notes_to_relink())
+        )
+
+    def edited_note_ids(self) -> Set[int]:
+        return (
+            {note.note_id for note in self.notes_to_edit}
+            | {note.note_id for note in self.notes_to_update_fields}
+            | {note.note_id for note in self.notes_to_change_deck}
+            | {note_id for note_ids in self.tags_to_add.values() for note_id in note_ids}
+            | {note_id for note_ids in self.tags_to_remove.values() for note_id in note_ids}
+        )
+
+    def notes_to_relink(self) -> List[int]:
+        """
+        the notes whose link to their source file has to be replaced because it was renamed
+        """
+        return [note_id for move in self.moved_files if move.renamed for note_id in move.note_ids]
+
+    def compute_estimate(self) -> Dict[str, OperationEstimate]:
+        """
+        number of requests, actions and bytes the executor will send, the payloads are
+        serialized like the AnkiManager does, the medias are estimated from their size
+        """
+
+        def payload_size(items: list) -> int:
+            return len(json.dumps(items).encode("utf-8"))
+
+        estimate = {}
+        if self.decks_to_create:
+            estimate["create_decks"] = OperationEstimate(
+                requests=1,
+                actions=len(self.decks_to_create),
+                payload_bytes=payload_size(self.decks_to_create),
+            )
+        if self.notes_to_delete:
+            estimate["delete_notes"] = OperationEstimate(
+                requests=1,
+                actions=1,
+                payload_bytes=payload_size([n.note_id for n in self.notes_to_delete]),
+            )
+        removed_notes = self.removed_notes_to_delete + self.removed_notes_to_tag
+        if removed_notes:
+            estimate["remove_notes"] = OperationEstimate(
+                requests=math.ceil(len(removed_notes) / REMOVED_NOTES_BATCH_SIZE),
+                actions=math.ceil(len(removed_notes) / REMOVED_NOTES_BATCH_SIZE),
+                payload_bytes=payload_size(removed_notes),
+            )
+        if self.notes_to_add:
+            estimate["add_notes"] = OperationEstimate(
+                requests=1,
+                actions=1,
+                payload_bytes=payload_size(
+                    [n.to_anki_dict() for n in self.notes_to_add]
+                ),
+            )
+        if self.notes_to_edit:
+            edited = len(self.notes_to_edit)
+            # findCards, updateNote and changeDeck, each one a multi with an action per note
+            estimate["edit_notes"] = OperationEstimate(
+                requests=3,
+                actions=3 * edited,
+                payload_bytes=payload_size(
+                    [n.to_anki_dict() for n in self.notes_to_edit]
+                )
+                + 150 * edited,
+            )
+        if (
+            self.notes_to_update_fields
+            or self.notes_to_change_deck
+            or self.tags_to_add
+            or self.tags_to_remove
+        ):
+            # a multi with an updateNoteFields per note, findCards and changeDeck like above,
+            # and a multi with a removeTags or addTags per tag
+            tag_changes = len(self.tags_to_add) + len(self.tags_to_remove)
+            moved = len(self.notes_to_change_deck)
+            estimate["update_notes"] = OperationEstimate(
+                requests=bool(self.notes_to_update_fields) + 2 * bool(moved) + bool(tag_changes),
+                actions=len(self.notes_to_update_fields) + 2 * moved + tag_changes,
+                payload_bytes=payload_size(
+                    [
+                        {"id": n.note_id, "fields": n.fields}
+                        for n in self.notes_to_update_fields
+                    ]
+                )
+                + 150 * moved
+                + payload_size(self.tags_to_add)
+                + payload_size(self.tags_to_remove),
+            )
+        notes_to_relink = self.notes_to_relink()
+        if notes_to_relink:
+            # notesInfo for all the notes, then a multi with an updateNoteFields per note
+            estimate["relink_notes"] = OperationEstimate(
+                requests=2,
+                actions=1 + len(notes_to_relink),
+                payload_bytes=payload_size(notes_to_relink) + 250 * len(notes_to_relink),
+            )
+        if self.medias_to_store:
+            estimate["store_medias"] = OperationEstimate(
+                requests=1,
+                actions=len(self.medias_to_store),
+                # base64 grows the data by 4/3
+                payload_bytes=sum(
+                    4 * math.ceil(media.size / 3) + len(media.filename) + 100
+                    for media in self.medias_to_store
+                ),
+            )
+        self.estimate = estimate
+        return estimate
+
+    def summary_lines(self) -> List[str]:
+        total = OperationEstimate()
+        for operation in self.estimate.values():
+            total.requests += operation.requests
+            total.actions += operation.actions
+            total.payload_bytes += operation.payload_bytes
+        lines = [
+            f"📐 Estimated AnkiConnect requests: {total.requests} ({total.actions} actions), "
+            f"~{_format_bytes(total.payload_bytes)} sent"
+        ]
+        for name, operation in self.estimate.items():
+            lines.append(
+                f"   {name:<14} {operation.requests:>3} requests {operation.actions:>7} actions "
+                f"~{_format_bytes(operation.payload_bytes):>10}"
+            )
+        files_to_edit = {(note.vault, note.path) for note in self.notes_to_add}
+        files_to_edit |= {(note.vault, note.path) for note in self.notes_to_delete}
+        lines.append(f"✍️  Source files that will be edited: {len(files_to_edit)}")
+        return lines
+
+    def save(self, path: Path) -> None:
+        logger.info(f"💾 Writing synchronization plan to {path}")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.model_dump_json(indent=1))
+
+    @classmethod
+    def load(cls, path: Path) -> "SyncPlan":
+        logger.info(f"📄 Loading synchronization plan from {path}")
+        with open(path, "r", encoding="utf-8") as f:
+            plan = cls.model_validate_json(f.read())
+        if plan.version != PLAN_VERSION:
+            raise ValueError(
+                f"⚠️ The plan was made with version {plan.version} of the plan format, "
+                f"but this version of obsankipy only applies version {PLAN_VERSION}."
+            )
+        return plan
+
+
+def _format_bytes(size: float) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{int(size)} B"
+        size /= 1024
@@ -0,0 +1,291 @@
+import logging
+import os
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Literal, Set
+
+from files import File
+from media import Media, MediaState
+from notes.manager import NotesManager
+from notes.note import Note, State
+from sync.inventory import NoteInventory
+from sync.plan import (
+    PlannedCache,
+    PlannedFile,
+    PlannedInventoryFile,
+    PlannedMedia,
+    PlannedMove,
+    PlannedNote,
+    PlannedNoteState,
+    SyncPlan,
+)
+from vault import VaultSync
+
+logger = logging.getLogger(__name__)
+
+
+def find_removed_note_ids(
+    notes_manager: NotesManager, vault_syncs: List[VaultSync]
+) -> Set[int]:
+    """
+    the IDs the note inventory had for the scanned files that none of the scanned notes has anymore,
+    their notes were removed from the files without #DELETE. Only the inventory entries of the
+    scanned files are compared, a note moved to another changed file keeps its ID.
+    The files skipped by the scan keep their notes, and so do the deleted files, the garbage
+    collection takes care of those
+    """
+    previous_ids = set()
+    for vault_sync in vault_syncs:
+        vault = vault_sync.vault
+        if vault is None or not vault.new_files:
+            continue
+        scanned_paths = {
+            Path(file.path).relative_to(vault_sync.config.dir_path).as_posix()
+            for file in vault.new_files
+            if file not in vault.skipped_files
+        }
+        inventory = NoteInventory.load(vault_sync.config.note_inventory_path)
+        for entry in inventory.files.values():
+            if entry.path in scanned_paths:
+                previous_ids.update(entry.note_ids)
+
+    found_ids = {
+        note.note_id for note in notes_manager.get_all_notes() if note.note_id is not None
+    }
+    return previous_ids - found_ids
+
+
+def find_moved_files(vault_syncs: List[VaultSync]) -> List[PlannedMove]:
+    """
+    the unchanged files found at another path than the one the note inventory has for their hash,
+    they were renamed or moved since the last synchronization. The files sharing their hash with
+    another file of the vault (e.g. empty files) cannot be told apart, they are left alone
+    """
+    moves = []
+    for vault_sync in vault_syncs:
+        vault = vault_sync.vault
+        if vault is None:
+            continue
+        inventory = NoteInventory.load(vault_sync.config.note_inventory_path)
+        if not inventory.files:
+            continue
+        new_files = {id(file) for file in vault.new_files}
+        hash_counts = Counter(file.original_hash for file in vault.files)
+        for file in vault.files:
+            if id(file) in new_files or hash_counts[file.original_hash] > 1:
+                continue
+            entry = inventory.files.get(file.original_hash)
+            if entry is None:
+                continue
+            path = Path(file.path).relative_to(vault_sync.config.dir_path).as_posix()
+            if path != entry.path:
+                moves.append(
+                    PlannedMove(
+                        vault=vault_sync.name,
+                        hash=file.original_hash,
+                        old_path=entry.path,
+                        new_path=path,
+                        note_ids=entry.note_ids,
+                        medias=entry.medias,
+                        notes=entry.notes,
+                    )
+                )
+    if moves:
+        logger.info(f"🚚 Found {len(moves)} files renamed or moved since the last run")
+    return moves
+
+
+def build_plan(
+    notes_manager: NotesManager,
+    vault_syncs: List[VaultSync],
+    removed_note_ids: Iterable[int] = (),
+    removed_notes: Literal["delete", "tag", "keep"] = "keep",
+    moved_files: Iterable[PlannedMove] = (),
+) -> SyncPlan:
+    """
+    turns the categorized notes and medias into a SyncPlan, nothing is sent to anki
+    and no file is touched here, the notes_manager has to be categorized already.
+    The removed_note_ids (see find_removed_note_ids) are deleted or tagged depending on removed_notes.
+    The moved_files (see find_moved_files) get their notes relinked and their new path in the inventory
+    """
+    vault_dirs: Dict[str, Path] = {
+        vault_sync.name: vault_sync.config.dir_path for vault_sync in vault_syncs
+    }
+
+    # the medias do not know their vault, but each vault loaded the medias of its own notes
+    media_vaults: Dict[int, VaultSync] = {}
+    for vault_sync in vault_syncs:
+        if vault_sync.notes_manager is None:
+            continue
+        for media in vault_sync.notes_manager.medias:
+            media_vaults[id(media)] = vault_sync
+
+    def relative_path(file: File) -> str:
+        return Path(file.path).relative_to(vault_dirs[file.vault_name]).as_posix()
+
+    def planned_note(note: Note, with_id: bool = True) -> PlannedNote:
+        return PlannedNote(
+            note_id=note.note_id if with_id else None,
+            model_name=note.note_type.to_anki_dict(),
+            deck_name=note.target_deck,
+            tags=note.tags,
+            fields={
+                field.get_field_name(): field.get_field_value()
+                for field in note.fields
+            },
+            vault=note.source_file.vault_name,
+            path=relative_path(note.source_file),
+            id_location_in_file=note.id_location_in_file,
+        )
+
+    def planned_media(media: Media) -> PlannedMedia:
+        vault_sync = media_vaults[id(media)]
+        return PlannedMedia(
+            filename=media.filename,
+            vault=vault_sync.name,
+            path=Path(
+                os.path.relpath(media.path, vault_sync.config.medias_dir_path)
+            ).as_posix(),
+            size=os.path.getsize(media.path),
+            hash=media.digest,
+        )
+
+    moved_files = list(moved_files)
+
+    def planned_inventory_files(vault_sync: VaultSync) -> List[PlannedInventoryFile]:
+        # the notes marked for deletion are no longer part of their file, and a media missing
+        # from the vault was never sent to anki by it
+        moved = [
+            PlannedInventoryFile(
+                path=move.new_path,
+                hash=move.hash,
+                note_ids=move.note_ids,
+                medias=move.medias,
+                notes=move.notes,
+            )
+            for move in moved_files
+            if move.vault == vault_sync.name
+        ]
+        return moved + [
+            PlannedInventoryFile(
+                path=relative_path(file),
+                hash=file.original_hash,
+                note_ids=[
+                    note.note_id
+                    for note in file.found_notes
+                    if note.state == State.EXISTING
+                ],
+                notes={
+                    note.note_id: edited_notes[id(note)].synced_state()
+                    for note in file.found_notes
+                    if note.state == State.EXISTING
+                },
+                medias=sorted(
+                    {
+                        media.filename
+                        for note in file.found_notes
+                        if note.state != State.MARKED_FOR_DELETION
+                        for media in note.medias
+                        if media.state != MediaState.MISSING
+                    }
+                ),
+            )
+            for file in vault_sync.vault.new_files
+            if file not in vault_sync.vault.skipped_files
+        ]
+
+    edited_notes = {
+        id(note): planned_note(note) for note in notes_manager.get_all_notes_to_edit()
+    }
+    note_states = {}
+    for vault_sync in vault_syncs:
+        if vault_sync.vault is not None and vault_sync.vault.new_files:
+            inventory = NoteInventory.load(vault_sync.config.note_inventory_path)
+            note_states.update(inventory.note_states())
+
+    notes_to_add = notes_manager.get_all_notes_to_add()
+    notes_to_delete = notes_manager.get_all_notes_to_delete()
+
+    # only the files of the new and deleted notes are edited, with their IDs
+    edited_files = {}
+    for note in notes_to_add + notes_to_delete:
+        edited_files[id(note.source_file)] = note.source_file
+
+    removed_note_ids = sorted(removed_note_ids)
+    plan = SyncPlan(
+        decks_to_create=sorted(notes_manager.get_needed_target_decks()),
+        notes_to_delete=[planned_note(note) for note in notes_to_delete],
+        removed_notes_to_delete=removed_note_ids if removed_notes == "delete" else [],
+        removed_notes_to_tag=removed_note_ids if removed_notes == "tag" else [],
+        # a new note may still carry the ID of a note that no longer exists in anki
+        notes_to_add=[planned_note(note, with_id=False) for note in notes_to_add],
+        medias_to_store=[
+            planned_media(media) for media in notes_manager.get_media_to_add()
+        ],
+        moved_files=moved_files,
+        files=[
+            PlannedFile(
+                vault=file.vault_name,
+                path=relative_path(file),
+                hash=file.original_hash,
+            )
+            for file in edited_files.values()
+        ],
+        caches=[
+            PlannedCache(
+                vault=vault_sync.name,
+                hashes=vault_sync.vault.get_curr_file_hashes(),
+                files=planned_inventory_files(vault_sync),
+            )
+            for vault_sync in vault_syncs
+            if vault_sync.vault is not None
+        ],
+        skipped_files=[
+            str(file.path)
+            for vault_sync in vault_syncs
+            if vault_sync.vault is not None
+            for file in vault_sync.vault.skipped_files
+        ],
+    )
+    plan_note_edits(plan, edited_notes.values(), note_states)
+    plan.compute_estimate()
+    return plan
+
+
+def plan_note_edits(
+    plan: SyncPlan, notes: Iterable[PlannedNote], note_states: Dict[int, dict]
+) -> None:
+    """
+    compares the edited notes with what was last sent to anki for them (see PlannedNoteState):
+    only their changed fields, deck and tags are planned. The tags are grouped by tag, so
+    changing a tag in the frontmatter of a file is a single request whatever its number of notes.
+    The notes without a state are sent whole
+    """
+    tags_to_add = defaultdict(list)
+    tags_to_remove = defaultdict(list)
+    known_notes = 0
+    for note in notes:
+        previous_state = note_states.get(note.note_id)
+        if previous_state is None:
+            plan.notes_to_edit.append(note)
+            continue
+        known_notes += 1
+        previous_state = PlannedNoteState(**previous_state)
+        state = note.synced_state()
+        if state.fields_digest != previous_state.fields_digest:
+            plan.notes_to_update_fields.append(note)
+        if state.deck != previous_state.deck:
+            plan.notes_to_change_deck.append(note)
+        for tag in set(state.tags) - set(previous_state.tags):
+            tags_to_add[tag].append(note.note_id)
+        for tag in set(previous_state.tags) - set(state.tags):
+            tags_to_remove[tag].append(note.note_id)
+    plan.tags_to_add = dict(sorted(tags_to_add.items()))
+    plan.tags_to_remove = dict(sorted(tags_to_remove.items()))
+    if known_notes:
+        changed_notes = plan.edited_note_ids() - {note.note_id for note in plan.notes_to_edit}
+        logger.info(
+            f"📝 {len(changed_notes)} of the {known_notes} synchronized notes of the scanned files "
+            f"changed: {len(plan.notes_to_update_fields)} fields, {len(plan.notes_to_change_deck)} "
+            f"decks, {len(plan.tags_to_add) + len(plan.tags_to_remove)} tags"
+        )
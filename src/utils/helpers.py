@@ -5,14 +5,13 @@ import hashlib
 import json
 import logging
 import os
-import re
 import shutil
+import sys
 import tempfile
 from pathlib import Path
-from typing import List
+from typing import Iterator, List
 
 from utils.constants import SUPPORTED_TEXT_EXTS
-from utils.patterns import ID_DELETE_REGEX
 
 logger = logging.getLogger(__name__)
 
@@ -62,7 +61,20 @@ def get_files_paths(
     dir_path, exclude_dirs=None, exclude_dotted_dirs=True, patterns_to_exclude=None
 ) -> List[Path]:
     """Get all files in this directory recursively."""
-    all_files = []
+    return list(
+        iter_files_paths(
+            dir_path,
+            exclude_dirs=exclude_dirs,
+            exclude_dotted_dirs=exclude_dotted_dirs,
+            patterns_to_exclude=patterns_to_exclude,
+        )
+    )
+
+
+def iter_files_paths(
+    dir_path, exclude_dirs=None, exclude_dotted_dirs=True, patterns_to_exclude=None
+) -> Iterator[Path]:
+    """Yield the files in this directory recursively, while the directory is walked."""
     if exclude_dirs is None:
         exclude_dirs = []
     if patterns_to_exclude is None:
@@ -84,42 +96,25 @@ def get_files_paths(
         for file in files:
             for extension in SUPPORTED_TEXT_EXTS:
                 if file.endswith(extension):
-                    all_files.append(Path(root) / file)
-    return all_files
-
-
-def erase_note_ids_in_the_files(file_paths: List[Path]):
-    """Erase the note IDs from the files."""
-    if not file_paths:
-        logger.info("No files to erase note IDs from")
-        return
-
-    logger.info(f"Erasing note IDs from {len(file_paths)} files...")
-    for file_path in file_paths:
-        erase_note_id_in_the_file(file_path)
-    logger.info("Successfully erased note IDs from all files")
+                    yield Path(root) / file
 
 
-def erase_note_id_in_the_file(file_path: Path):
-    """Erase note IDs from a single file."""
-    logger.debug(f"Erasing note IDs from file: {file_path}")
-    try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            file_content = f.read()
-
-        original_length = len(file_content)
-        file_content = re.sub(ID_DELETE_REGEX, "", file_content)
-        new_length = len(file_content)
-
-        if original_length != new_length:
-            logger.debug(
-                f"Removed {original_length - new_length} characters (note IDs) from {file_path}"
-            )
-
-        overwrite_file_safely(file_path, file_content)
-    except Exception as e:
-        logger.error(f"Failed to erase note IDs from {file_path}: {e}")
-        raise
+def is_vault_file(
+    relative_path: str, exclude_dirs=None, exclude_dotted_dirs=True, patterns_to_exclude=None
+) -> bool:
+    """
+    whether iter_files_paths would yield this path (relative to the vault, with / separators)
+    """
+    *dirs, filename = relative_path.split("/")
+    if exclude_dirs and any(d in exclude_dirs for d in dirs):
+        return False
+    if exclude_dotted_dirs and any(d.startswith(".") for d in dirs):
+        return False
+    if patterns_to_exclude and any(
+        fnmatch.fnmatch(filename, pattern) for pattern in patterns_to_exclude
+    ):
+        return False
+    return filename.endswith(tuple(SUPPORTED_TEXT_EXTS))
 
 
 def file_encode(filepath):
@@ -132,6 +127,15 @@ def compute_hash(file_content: bytes) -> str:
     return hashlib.sha256(file_content).hexdigest()
 
 
+def compute_file_hash(filepath, chunk_size: int = 1024 * 1024) -> str:
+    """Hash a file while it is read, so it never has to fit in memory."""
+    file_hash = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
 def clear_file_hashes(hashes_cache_dir):
     try:
         logger.info("Clearing file hashes")
@@ -181,10 +185,122 @@ def setup_cli_parser():
         action="store_true",
         help="activates the debug log file",
     )
+    parser.add_argument(
+        "--metrics-out",
+        type=str,
+        default=None,
+        help="writes a json report with the time spent and items handled in each stage of the run",
+    )
+    parser.add_argument(
+        "--prometheus-out",
+        type=str,
+        default=None,
+        help="writes the same metrics in the prometheus text format (e.g. for the node_exporter textfile collector)",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="reports the time spent in each transformer, each note regex and the slowest files and notes",
+    )
+    parser.add_argument(
+        "--profile-out",
+        type=str,
+        default=None,
+        help="also runs the synchronization under cProfile and dumps the pstats to this file",
+    )
+    parser.add_argument(
+        "--slow-regex-seconds",
+        type=float,
+        default=1.0,
+        help="when profiling, warns about any note regex that takes longer than this on a single file",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="walks, scans and sends the notes to anki in batches as the vault is walked, "
+        "so memory stays bounded and the first cards land in anki early on big imports",
+    )
+    parser.add_argument(
+        "--stream-batch-size",
+        type=int,
+        default=500,
+        help="with --stream, number of notes (or changed files) sent to anki in each batch",
+    )
+    parser.add_argument(
+        "--refresh-anki-state",
+        action="store_true",
+        help="downloads the note IDs, decks and media names from anki again instead of "
+        "updating the local mirror of them",
+    )
+    parser.add_argument(
+        "--files",
+        nargs="+",
+        default=None,
+        help="only synchronizes these files instead of walking the vaults, e.g. from an editor or pre-commit hook",
+    )
+    parser.add_argument(
+        "--files-from",
+        type=str,
+        default=None,
+        help="like --files, with the files read from this file, one per line, or from stdin with -",
+    )
+    plan_group = parser.add_mutually_exclusive_group()
+    plan_group.add_argument(
+        "--plan-only",
+        type=str,
+        default=None,
+        help="writes the synchronization plan to this file instead of applying it, nothing is sent to anki",
+    )
+    plan_group.add_argument(
+        "--apply-plan",
+        type=str,
+        default=None,
+        help="applies a plan written by --plan-only instead of scanning the vaults",
+    )
+    plan_group.add_argument(
+        "--export-apkg",
+        type=str,
+        default=None,
+        help="writes the new notes and media files to this anki package (.apkg) instead of sending them, "
+        "for big first imports. The next run writes the note IDs once the package is imported in anki",
+    )
+    plan_group.add_argument(
+        "--gc",
+        action="store_true",
+        help="deletes from anki the obsidian notes and the media files no file of the vaults references anymore, "
+        "instead of synchronizing",
+    )
+    plan_group.add_argument(
+        "--gc-dry-run",
+        action="store_true",
+        help="like --gc, but only reports the orphaned notes and media files",
+    )
+    parser.add_argument(
+        "--gc-report",
+        type=str,
+        default=None,
+        help="with --gc or --gc-dry-run, writes the orphaned notes and media files to this json file",
+    )
+    parser.add_argument(
+        "--gc-batch-size",
+        type=int,
+        default=100,
+        help="with --gc, number of notes (or media files) deleted in each request to anki",
+    )
     args = parser.parse_args()
     return args
 
 
+def read_file_list(source: str) -> List[str]:
+    """the paths listed one per line in source, or in stdin when source is -"""
+    if source == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(Path(source).expanduser(), "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    return [line.strip() for line in lines if line.strip()]
+
+
 def write_hashes_to_file(curr_hashes, hashes_path: Path):
     """Write current file hashes to cache file."""
     logger.debug(f"Writing {len(curr_hashes)} file hashes to cache at {hashes_path}")
@@ -199,7 +315,8 @@ def write_hashes_to_file(curr_hashes, hashes_path: Path):
 
 def setup_root_logger(debug=False):
     root_logger = logging.getLogger("")
-    root_logger.setLevel(logging.DEBUG)  # Capture all logs, handlers will filter
+    # without --debug the debug records are dropped before their message is built
+    root_logger.setLevel(logging.DEBUG if debug else logging.INFO)
 
     # Remove existing handlers to prevent duplication
     for handler in root_logger.handlers[:]:
@@ -0,0 +1,263 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StageMetrics:
+    """
+    wall time, cpu time and item counts of one phase of the synchronization
+    a stage entered more than once accumulates its times and counts, under a lock
+    """
+
+    name: str
+    calls: int
+    wall_seconds: float
+    cpu_seconds: float
+    counts: Dict[str, int]
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def count(self, item: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counts[item] = self.counts.get(item, 0) + amount
+
+    def add_call(self, wall_seconds: float, cpu_seconds: float) -> None:
+        with self._lock:
+            self.calls += 1
+            self.wall_seconds += wall_seconds
+            self.cpu_seconds += cpu_seconds
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "wall_seconds": round(self.wall_seconds, 6),
+            "cpu_seconds": round(self.cpu_seconds, 6),
+            "counts": dict(self.counts),
+        }
+
+
+class AnkiActionMetrics:
+    """
+    number of requests, time and bytes exchanged with AnkiConnect for one action
+    """
+
+    action: str
+    requests: int
+    wall_seconds: float
+    bytes_sent: int
+    bytes_received: int
+
+    def __init__(self, action: str):
+        self.action = action
+        self.requests = 0
+        self.wall_seconds = 0.0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "requests": self.requests,
+            "wall_seconds": round(self.wall_seconds, 6),
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+        }
+
+
+class Metrics:
+    """
+    collects the timings and counters of a run so they can be exported as a json report
+    or as prometheus text (e.g. for the node_exporter textfile collector)
+    """
+
+    stages: Dict[str, StageMetrics]
+    anki_actions: Dict[str, AnkiActionMetrics]
+    started_at: float
+    finished_at: Optional[float]
+    success: Optional[bool]
+
+    def __init__(self):
+        self.stages = {}
+        self.anki_actions = {}
+        self.started_at = time.time()
+        self._started_perf = time.perf_counter()
+        self._started_cpu = time.process_time()
+        self.finished_at = None
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.success = None
+        # the stages and anki actions may be recorded from several threads
+        self._lock = threading.Lock()
+
+    def get_stage(self, name: str) -> StageMetrics:
+        with self._lock:
+            if name not in self.stages:
+                self.stages[name] = StageMetrics(name)
+            return self.stages[name]
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageMetrics]:
+        """
+        times the body of the with block, the yielded stage can be used to add counts:
+
+        with metrics.stage("scan") as stage:
+            stage.count("files", len(files))
+        """
+        stage = self.get_stage(name)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield stage
+        finally:
+            stage.add_call(
+                time.perf_counter() - wall_start, time.process_time() - cpu_start
+            )
+
+    def count(self, stage_name: str, item: str, amount: int = 1) -> None:
+        self.get_stage(stage_name).count(item, amount)
+
+    def record_anki_request(
+        self, action: str, bytes_sent: int, bytes_received: int, wall_seconds: float
+    ) -> None:
+        with self._lock:
+            if action not in self.anki_actions:
+                self.anki_actions[action] = AnkiActionMetrics(action)
+            action_metrics = self.anki_actions[action]
+            action_metrics.requests += 1
+            action_metrics.bytes_sent += bytes_sent
+            action_metrics.bytes_received += bytes_received
+            action_metrics.wall_seconds += wall_seconds
+
+    def finish(self, success: bool) -> None:
+        self.success = success
+        self.finished_at = time.time()
+        self.wall_seconds = time.perf_counter() - self._started_perf
+        self.cpu_seconds = time.process_time() - self._started_cpu
+
+    def to_dict(self) -> dict:
+        return {
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "success": self.success,
+            "wall_seconds": round(self.wall_seconds, 6),
+            "cpu_seconds": round(self.cpu_seconds, 6),
+            "stages": {name: stage.to_dict() for name, stage in self.stages.items()},
+            "anki_actions": {
+                action: action_metrics.to_dict()
+                for action, action_metrics in self.anki_actions.items()
+            },
+        }
+
+    def to_prometheus(self, prefix: str = "obsankipy") -> str:
+        lines = []
+
+        def add_metric(name, help_text, metric_type, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {metric_type}")
+            for labels, value in samples:
+                label_text = ",".join(
+                    f'{key}="{_escape_label(val)}"' for key, val in labels.items()
+                )
+                label_text = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{prefix}_{name}{label_text} {value}")
+
+        add_metric(
+            "run_success",
+            "1 if the last run finished successfully, 0 otherwise.",
+            "gauge",
+            [({}, int(bool(self.success)))],
+        )
+        add_metric(
+            "run_timestamp_seconds",
+            "Unix time at which the last run finished.",
+            "gauge",
+            [({}, self.finished_at or self.started_at)],
+        )
+        add_metric(
+            "run_wall_seconds",
+            "Wall time of the whole run.",
+            "gauge",
+            [({}, round(self.wall_seconds, 6))],
+        )
+        add_metric(
+            "run_cpu_seconds",
+            "CPU time of the whole run.",
+            "gauge",
+            [({}, round(self.cpu_seconds, 6))],
+        )
+        add_metric(
+            "stage_wall_seconds",
+            "Wall time spent in each synchronization stage.",
+            "gauge",
+            [({"stage": s.name}, round(s.wall_seconds, 6)) for s in self.stages.values()],
+        )
+        add_metric(
+            "stage_cpu_seconds",
+            "CPU time spent in each synchronization stage.",
+            "gauge",
+            [({"stage": s.name}, round(s.cpu_seconds, 6)) for s in self.stages.values()],
+        )
+        add_metric(
+            "stage_items",
+            "Number of items handled by each synchronization stage.",
+            "gauge",
+            [
+                ({"stage": s.name, "item": item}, amount)
+                for s in self.stages.values()
+                for item, amount in s.counts.items()
+            ],
+        )
+        actions = self.anki_actions.values()
+        add_metric(
+            "anki_requests",
+            "Number of AnkiConnect requests per action.",
+            "gauge",
+            [({"action": a.action}, a.requests) for a in actions],
+        )
+        add_metric(
+            "anki_request_seconds",
+            "Wall time spent waiting on AnkiConnect per action.",
+            "gauge",
+            [({"action": a.action}, round(a.wall_seconds, 6)) for a in actions],
+        )
+        add_metric(
+            "anki_bytes_sent",
+            "Bytes sent to AnkiConnect per action.",
+            "gauge",
+            [({"action": a.action}, a.bytes_sent) for a in actions],
+        )
+        add_metric(
+            "anki_bytes_received",
+            "Bytes received from AnkiConnect per action.",
+            "gauge",
+            [({"action": a.action}, a.bytes_received) for a in actions],
+        )
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path: Path) -> None:
+        logger.info(f"📊 Writing metrics report to {path}")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def write_prometheus(self, path: Path) -> None:
+        logger.info(f"📊 Writing prometheus metrics to {path}")
+        # write to a sibling file and rename it, so a scraper never reads a half written file
+        tmp_path = Path(f"{path}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        tmp_path.replace(path)
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -4,13 +4,16 @@ from .constants import SUPPORTED_AUDIO_EXTS, SUPPORTED_IMAGE_EXTS
 SUPPORTED_IMAGE_EXTS = "|".join(SUPPORTED_IMAGE_EXTS)
 SUPPORTED_AUDIO_EXTS = "|".join(SUPPORTED_AUDIO_EXTS)
 
-IMAGE_FILE_WIKILINK_PATTERN = rf"!\[\[(?P<path>[.|/\\]?.*[/|\\])?(?P<filename>/?.*?)\.(?P<extension>({SUPPORTED_IMAGE_EXTS}))]]"
+# the path is matched one folder at a time and neither the path nor the filename can cross
+# a "[", "]" or a line break (obsidian does not allow brackets in file names), otherwise a long
+# line with several embeds makes the nested quantifiers backtrack over the whole line for every "![["
+IMAGE_FILE_WIKILINK_PATTERN = rf"!\[\[(?P<path>[.|/\\]?(?:[^\[\]\n/|\\]*[/|\\])+)?(?P<filename>/?[^\[\]\n/|\\]*?)\.(?P<extension>({SUPPORTED_IMAGE_EXTS}))]]"
 IMAGE_FILE_WIKILINK_REGEX = re.compile(
     IMAGE_FILE_WIKILINK_PATTERN,
     re.IGNORECASE,
 )
 
-IMAGE_FILE_MARKDOWN_PATTERN = rf"!\[.*\]\((?!http[s]?)(?P<path>[.|/\\]?.*[/|\\])?(?P<filename>/?.*?)\.(?P<extension>({SUPPORTED_IMAGE_EXTS}))\)"
+IMAGE_FILE_MARKDOWN_PATTERN = rf"!\[[^\[\]\n]*\]\((?!http[s]?)(?P<path>[.|/\\]?(?:[^()\n/|\\]*[/|\\])+)?(?P<filename>/?[^/|\\\n]*?)\.(?P<extension>({SUPPORTED_IMAGE_EXTS}))\)"
 IMAGE_FILE_MARKDOWN_REGEX = re.compile(
     IMAGE_FILE_MARKDOWN_PATTERN,
     re.IGNORECASE,
@@ -19,12 +22,22 @@ IMAGE_FILE_MARKDOWN_REGEX = re.compile(
 IMAGE_URL_PATTERN = rf"\s(http[s]?:\/\/\S+\.(?:{SUPPORTED_IMAGE_EXTS}))\s"
 IMAGE_URL_REGEX = re.compile(IMAGE_URL_PATTERN, re.IGNORECASE)
 
-AUDIO_FILE_PATTERN = rf"!\[\[(?P<path>[.|/\\]?.*[/|\\])?(?P<filename>/?.*?)\.(?P<extension>({SUPPORTED_AUDIO_EXTS}))]]"
+AUDIO_FILE_PATTERN = rf"!\[\[(?P<path>[.|/\\]?(?:[^\[\]\n/|\\]*[/|\\])+)?(?P<filename>/?[^\[\]\n/|\\]*?)\.(?P<extension>({SUPPORTED_AUDIO_EXTS}))]]"
 AUDIO_FILE_REGEX = re.compile(
     AUDIO_FILE_PATTERN,
     re.IGNORECASE,
 )
 
+# the image urls, the image wikilinks and the audio wikilinks turned into html in a single pass,
+# the extension tells an image from an audio, the groups are the ones of the patterns above
+EMBED_TO_HTML_PATTERN = rf"\s(?P<url>http[s]?:\/\/\S+\.(?:{SUPPORTED_IMAGE_EXTS}))\s|!\[\[(?P<path>[.|/\\]?(?:[^\[\]\n/|\\]*[/|\\])+)?(?P<filename>/?[^\[\]\n/|\\]*?)\.(?:(?P<image_ext>{SUPPORTED_IMAGE_EXTS})|(?P<audio_ext>{SUPPORTED_AUDIO_EXTS}))]]"
+EMBED_TO_HTML_REGEX = re.compile(EMBED_TO_HTML_PATTERN, re.IGNORECASE)
+
+# every embed a field can have, found in a single pass: the alternatives of EMBED_TO_HTML_PATTERN
+# and the markdown images, which are left to markdown but are medias too
+EMBED_TOKEN_PATTERN = rf"{EMBED_TO_HTML_PATTERN}|!\[[^\[\]\n]*\]\((?!http[s]?)(?P<md_path>[.|/\\]?(?:[^()\n/|\\]*[/|\\])+)?(?P<md_filename>/?[^/|\\\n]*?)\.(?P<md_extension>{SUPPORTED_IMAGE_EXTS})\)"
+EMBED_TOKEN_REGEX = re.compile(EMBED_TOKEN_PATTERN, re.IGNORECASE)
+
 OBSIDIAN_LINKS_REGEX = r"(?<!!)\[\[([^\n]*?)\]\]"  # this should handle getting the file names for links, excluding aliases
 OBSIDIAN_LINKS_REGEX = re.compile(OBSIDIAN_LINKS_REGEX)
 
@@ -0,0 +1,206 @@
+import heapq
+import logging
+import threading
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# the profiler is only set when running with --profile, the hooks in the scanning and
+# transforming code check it once per call so they cost nothing when it is not active
+_active_profiler: Optional["Profiler"] = None
+
+
+def get_profiler() -> Optional["Profiler"]:
+    return _active_profiler
+
+
+def set_profiler(profiler: Optional["Profiler"]) -> None:
+    global _active_profiler
+    _active_profiler = profiler
+
+
+def transformer_name(transformer: Callable) -> str:
+    """
+    partials are reported with the name of the function they wrap
+    """
+    if isinstance(transformer, partial):
+        return transformer_name(transformer.func)
+    return getattr(transformer, "__name__", repr(transformer))
+
+
+class TimingStat:
+    calls: int
+    total_seconds: float
+    max_seconds: float
+    items: int
+
+    def __init__(self):
+        self.calls = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.items = 0
+
+    def add(self, seconds: float, items: int = 0) -> None:
+        self.calls += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.items += items
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "total_seconds": round(self.total_seconds, 6),
+            "max_seconds": round(self.max_seconds, 6),
+            "items": self.items,
+        }
+
+
+class Profiler:
+    """
+    attributes the scanning time to each transformer, each configured note regex,
+    each file and each note, so a slow sync can be traced back to its cause.
+    The records are made under a lock, any thread may record
+    """
+
+    transformers: Dict[str, TimingStat]
+    regexes: Dict[Tuple[str, str], TimingStat]
+    slow_regexes: List[Tuple[float, str, str, str]]
+    slow_regex_seconds: float
+    top: int
+
+    def __init__(self, slow_regex_seconds: float = 1.0, top: int = 10):
+        self.transformers = {}
+        self.regexes = {}
+        self.slow_regexes = []
+        self.slow_regex_seconds = slow_regex_seconds
+        self.top = top
+        # min heaps keeping only the slowest entries
+        self._slowest_files: List[Tuple[float, str]] = []
+        self._slowest_notes: List[Tuple[float, int, str, str]] = []
+        self._notes_seen = 0
+        self._lock = threading.Lock()
+
+    def record_transformer(self, name: str, seconds: float) -> None:
+        with self._lock:
+            if name not in self.transformers:
+                self.transformers[name] = TimingStat()
+            self.transformers[name].add(seconds)
+
+    def record_regex(
+        self,
+        note_type_name: str,
+        regex: str,
+        file_path: str,
+        seconds: float,
+        matches: int,
+    ) -> None:
+        key = (note_type_name, regex)
+        with self._lock:
+            if key not in self.regexes:
+                self.regexes[key] = TimingStat()
+            self.regexes[key].add(seconds, items=matches)
+        if seconds >= self.slow_regex_seconds:
+            # most likely catastrophic backtracking, tell the user right away which file triggered it
+            logger.warning(
+                f"🐢 The {note_type_name} regex {regex!r} took {seconds:.2f}s on file {file_path}, "
+                f"it is probably backtracking catastrophically on this file"
+            )
+            with self._lock:
+                self.slow_regexes.append((seconds, note_type_name, regex, str(file_path)))
+
+    def record_file(self, file_path: str, seconds: float) -> None:
+        with self._lock:
+            self._push(self._slowest_files, (seconds, str(file_path)))
+
+    def record_note(self, file_path: str, note_text: str, seconds: float) -> None:
+        snippet = " ".join(note_text.split())[:60]
+        with self._lock:
+            self._notes_seen += 1
+            # the counter breaks ties so the heap never has to compare the strings
+            self._push(
+                self._slowest_notes, (seconds, self._notes_seen, str(file_path), snippet)
+            )
+
+    def _push(self, heap: list, item: tuple) -> None:
+        if len(heap) < self.top:
+            heapq.heappush(heap, item)
+        else:
+            heapq.heappushpop(heap, item)
+
+    def slowest_files(self) -> List[Tuple[float, str]]:
+        return sorted(self._slowest_files, reverse=True)
+
+    def slowest_notes(self) -> List[Tuple[float, str, str]]:
+        return [
+            (seconds, file_path, snippet)
+            for seconds, _, file_path, snippet in sorted(
+                self._slowest_notes, reverse=True
+            )
+        ]
+
+    def to_dict(self) -> dict:
+        return {
+            "transformers": {
+                name: stat.to_dict() for name, stat in self.transformers.items()
+            },
+            "regexes": [
+                {"note_type": note_type, "regex": regex, **stat.to_dict()}
+                for (note_type, regex), stat in self.regexes.items()
+            ],
+            "slow_regexes": [
+                {
+                    "seconds": round(seconds, 6),
+                    "note_type": note_type,
+                    "regex": regex,
+                    "file": file_path,
+                }
+                for seconds, note_type, regex, file_path in self.slow_regexes
+            ],
+            "slowest_files": [
+                {"seconds": round(seconds, 6), "file": file_path}
+                for seconds, file_path in self.slowest_files()
+            ],
+            "slowest_notes": [
+                {"seconds": round(seconds, 6), "file": file_path, "note": snippet}
+                for seconds, file_path, snippet in self.slowest_notes()
+            ],
+        }
+
+    def log_report(self) -> None:
+        lines = [
+            "",
+            "=" * 60,
+            "🔬 PROFILE REPORT".center(60),
+            "=" * 60,
+            "Transformers (total / calls / max):",
+        ]
+        for name, stat in sorted(
+            self.transformers.items(), key=lambda item: -item[1].total_seconds
+        ):
+            lines.append(
+                f"  {name:<40} {stat.total_seconds:>8.3f}s {stat.calls:>7} {stat.max_seconds:>8.4f}s"
+            )
+        lines.append("Note regexes (total / files / matches):")
+        for (note_type, regex), stat in sorted(
+            self.regexes.items(), key=lambda item: -item[1].total_seconds
+        ):
+            lines.append(
+                f"  [{note_type}] {regex[:50]!r:<54} {stat.total_seconds:>8.3f}s {stat.calls:>5} {stat.items:>6}"
+            )
+        lines.append(f"Slowest files (top {self.top}):")
+        for seconds, file_path in self.slowest_files():
+            lines.append(f"  {seconds:>8.3f}s  {file_path}")
+        lines.append(f"Slowest notes (top {self.top}):")
+        for seconds, file_path, snippet in self.slowest_notes():
+            lines.append(f"  {seconds:>8.3f}s  {file_path}: {snippet}")
+        if self.slow_regexes:
+            lines.append("Regexes that were slower than the threshold:")
+            for seconds, note_type, regex, file_path in sorted(
+                self.slow_regexes, reverse=True
+            ):
+                lines.append(f"  {seconds:>8.3f}s  [{note_type}] {regex!r} on {file_path}")
+        lines.extend(["=" * 60, ""])
+
+        for line in lines:
+            logger.info(line)
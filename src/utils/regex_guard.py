@@ -0,0 +1,190 @@
+import logging
+import multiprocessing
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:  # optional linear time engine, pip install google-re2
+    import re2
+except ImportError:
+    re2 = None
+
+
+class RegexTimeoutError(Exception):
+    """
+    raised when the note regexes of a file did not finish inside the time budget
+    """
+
+    def __init__(self, file_path, timeout_seconds: float):
+        self.file_path = file_path
+        self.timeout_seconds = timeout_seconds
+        super().__init__(
+            f"note regexes did not finish in {timeout_seconds}s on file {file_path}"
+        )
+
+
+class MatchSnapshot:
+    """
+    picklable copy of the parts of a re.Match used by the Note, so matches found in a
+    worker process can be sent back to the main one
+    """
+
+    __slots__ = ("_spans", "_groups", "_group_index")
+
+    def __init__(self, match: re.Match):
+        group_count = match.re.groups
+        self._spans = [match.span(i) for i in range(group_count + 1)]
+        self._groups = [match.group(0), *match.groups()]
+        self._group_index = dict(match.re.groupindex)
+
+    def _index(self, group) -> int:
+        if isinstance(group, str):
+            return self._group_index[group]
+        return group
+
+    def group(self, group=0) -> Optional[str]:
+        return self._groups[self._index(group)]
+
+    def groupdict(self) -> Dict[str, Optional[str]]:
+        return {name: self._groups[index] for name, index in self._group_index.items()}
+
+    def span(self, group=0) -> Tuple[int, int]:
+        return self._spans[self._index(group)]
+
+    def start(self, group=0) -> int:
+        return self.span(group)[0]
+
+    def end(self, group=0) -> int:
+        return self.span(group)[1]
+
+
+def find_all_matches(
+    text: str, patterns: List[str]
+) -> List[Tuple[List[MatchSnapshot], float]]:
+    """
+    runs inside the worker process, returns the matches of every pattern and the time it took
+    """
+    results = []
+    for pattern in patterns:
+        start = time.perf_counter()
+        matches = [
+            MatchSnapshot(match)
+            for match in re.compile(pattern, re.MULTILINE).finditer(text)
+        ]
+        results.append((matches, time.perf_counter() - start))
+    return results
+
+
+def _worker_context():
+    """
+    the worker is started by a forkserver (spawn where there is none) rather than forked,
+    a fork copies the locks other threads of the run may hold at that moment
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+class RegexScanner:
+    """
+    runs the note regexes over the content of a file, it can:
+        - run them in process with re, unbounded (the default)
+        - run the patterns that re2 supports with re2, which runs in linear time
+        - run the remaining patterns in a worker process that is killed when the file
+          exceeds its time budget, in that case a RegexTimeoutError is raised
+    a run creates one scanner in its main thread and scans every vault with it
+    """
+
+    timeout_seconds: Optional[float]
+    engine: str
+
+    def __init__(self, timeout_seconds: Optional[float] = None, engine: str = "re"):
+        self.timeout_seconds = timeout_seconds
+        self.engine = engine
+        if engine == "re2" and re2 is None:
+            logger.warning(
+                "⚠️  regex_engine is set to re2 but the google-re2 package is not installed, "
+                "falling back to re"
+            )
+            self.engine = "re"
+        self._re2_cache: Dict[str, Any] = {}
+        self._pool = None
+
+    def _compile_re2(self, pattern: str):
+        """
+        returns None when re2 does not support the pattern (lookarounds, backreferences...)
+        """
+        if pattern not in self._re2_cache:
+            options = re2.Options()
+            options.log_errors = False  # unsupported patterns are expected, they fall back to re
+            try:
+                self._re2_cache[pattern] = re2.compile("(?m)" + pattern, options)
+            except re2.error:
+                logger.debug("re2 does not support the regex %r, using re instead", pattern)
+                self._re2_cache[pattern] = None
+        return self._re2_cache[pattern]
+
+    def find_matches(
+        self, text: str, patterns: List[str], file_path=None
+    ) -> List[Tuple[List[Any], float]]:
+        """
+        returns, for each pattern, the list of its matches and the seconds it took
+        """
+        results: List[Optional[Tuple[List[Any], float]]] = [None] * len(patterns)
+        remaining = []
+        for position, pattern in enumerate(patterns):
+            compiled = self._compile_re2(pattern) if self.engine == "re2" else None
+            if compiled is not None:
+                start = time.perf_counter()
+                matches = list(compiled.finditer(text))
+                results[position] = (matches, time.perf_counter() - start)
+            else:
+                remaining.append(position)
+
+        if remaining:
+            remaining_patterns = [patterns[position] for position in remaining]
+            if self.timeout_seconds is None:
+                remaining_results = [
+                    self._find_in_process(text, pattern)
+                    for pattern in remaining_patterns
+                ]
+            else:
+                remaining_results = self._find_in_worker(
+                    text, remaining_patterns, file_path
+                )
+            for position, result in zip(remaining, remaining_results):
+                results[position] = result
+        return results
+
+    @staticmethod
+    def _find_in_process(text: str, pattern: str) -> Tuple[List[re.Match], float]:
+        start = time.perf_counter()
+        matches = list(re.compile(pattern, re.MULTILINE).finditer(text))
+        return matches, time.perf_counter() - start
+
+    def _find_in_worker(self, text: str, patterns: List[str], file_path):
+        if self._pool is None:
+            self._pool = _worker_context().Pool(processes=1)
+        async_result = self._pool.apply_async(find_all_matches, (text, patterns))
+        try:
+            return async_result.get(timeout=self.timeout_seconds)
+        except multiprocessing.TimeoutError:
+            # the worker is stuck backtracking, the only way to stop it is to kill it
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+            raise RegexTimeoutError(file_path, self.timeout_seconds)
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self) -> "RegexScanner":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
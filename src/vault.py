@@ -1,10 +1,25 @@
 import os
+import time
+from collections import Counter
 from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
+from config_parser import ScanConfig, VaultConfig
 from files import File
-from notes.note import NoteType
+from git_changes import GitChanges, GitState, find_git_changes, get_head
+from media import MediaIndex
+from notes.note import Note, NoteType
 from notes.manager import NotesManager
-from utils.helpers import get_files_paths
+from sync.inventory import NoteInventory
+from utils.helpers import (
+    get_files_paths,
+    is_vault_file,
+    iter_files_paths,
+    open_cache,
+    write_hashes_to_file,
+)
+from utils.profiling import get_profiler
+from utils.regex_guard import RegexScanner, RegexTimeoutError
 
 import logging
 
@@ -21,9 +36,15 @@ class VaultManager:
     file_paths: list[Path]
     files: list[File]
     new_files: list[File]
+    skipped_files: list[File]
     exclude_dirs: list[str]
     exclude_dotted_dirs: bool
+    patterns_to_exclude: list[str]
     note_types: list[NoteType]
+    # when streaming, the hashes of the files already handled by previous batches
+    synced_hashes: list[str]
+    previous_hashes: set[str]
+    walk_complete: bool
 
     def __init__(
         self,
@@ -32,63 +53,439 @@ class VaultManager:
         exclude_dotted_dirs=True,
         patterns_to_exclude=None,
         note_types=None,
+        stream=False,
+        file_paths: Optional[List[Path]] = None,
     ):
+        """
+        with stream the vault is not walked here, the files are read while stream_notes walks it.
+        With file_paths the vault is not walked either, only these files are read
+        """
         self.dir = vault_path
         self.vault_name = os.path.basename(self.dir)
-        logger.debug(f"Initializing VaultManager for vault: {self.vault_name}")
-        logger.debug(f"Vault directory: {self.dir}")
+        logger.debug("Initializing VaultManager for vault: %s", self.vault_name)
+        logger.debug("Vault directory: %s", self.dir)
 
         # Log exclusion settings
         if exclude_dirs:
-            logger.info(f"Excluding directories: {exclude_dirs}")
+            logger.info("Excluding directories: %s", exclude_dirs)
         if exclude_dotted_dirs:
             logger.info("Excluding dotted directories (starting with '.')")
         if patterns_to_exclude:
-            logger.info(f"Excluding file patterns: {patterns_to_exclude}")
+            logger.info("Excluding file patterns: %s", patterns_to_exclude)
 
-        self.file_paths = get_files_paths(
-            self.dir,
-            exclude_dirs=exclude_dirs,
-            exclude_dotted_dirs=exclude_dotted_dirs,
-            patterns_to_exclude=patterns_to_exclude,
-        )
-        logger.info(f"Found {len(self.file_paths)} files in vault")
-        logger.debug(
-            f"File paths: {[str(p) for p in self.file_paths[:10]]}{'...' if len(self.file_paths) > 10 else ''}"
-        )
+        self.exclude_dirs = exclude_dirs
+        self.exclude_dotted_dirs = exclude_dotted_dirs
+        self.patterns_to_exclude = patterns_to_exclude
+        self.note_types = note_types
+        self.skipped_files = []
+        self.synced_hashes = []
+        self.previous_hashes = set()
+        self.walk_complete = True
+        if stream:
+            self.file_paths = []
+            self.files = []
+            self.new_files = []
+            return
+
+        if file_paths is not None:
+            self.file_paths = file_paths
+        else:
+            self.file_paths = get_files_paths(
+                self.dir,
+                exclude_dirs=exclude_dirs,
+                exclude_dotted_dirs=exclude_dotted_dirs,
+                patterns_to_exclude=patterns_to_exclude,
+            )
+        logger.info("Found %s files in vault", len(self.file_paths))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "File paths: %s%s",
+                [str(p) for p in self.file_paths[:10]],
+                "..." if len(self.file_paths) > 10 else "",
+            )
 
         self.set_files()
-        self.note_types = note_types
 
     def set_new_files(self, file_hashes: list[str]):
-        self.new_files = [
-            file for file in self.files if file.original_hash not in file_hashes
-        ]
+        file_hashes = set(file_hashes)
+        self.new_files = []
+        for file in self.files:
+            if file.original_hash in file_hashes:
+                # unchanged files are never scanned, only their hash is kept
+                file.release_content()
+            else:
+                self.new_files.append(file)
 
     def set_files(self):
         self.files = [
             File(file, vault_name=self.vault_name) for file in self.file_paths
         ]
 
-    def get_notes_from_new_files(self) -> NotesManager:
-        """Scan all the new files found in vault."""
-        logger.info(f"Scanning {len(self.new_files)} new/modified files for notes...")
+    def get_notes_from_new_files(self, scanner: RegexScanner = None) -> NotesManager:
+        """
+        Scan all the new files found in vault.
+        Files whose regexes time out are skipped and kept in self.skipped_files
+        """
+        logger.info("Scanning %s new/modified files for notes...", len(self.new_files))
 
         notes = []
         files_with_notes = 0
 
         for file in self.new_files:
-            logger.debug(f"Scanning file: {file.file_name}")
-            curr_notes = file.scan_file(note_types=self.note_types)
+            curr_notes = self.scan_file(file, scanner)
             if curr_notes:
                 files_with_notes += 1
-                logger.debug(f"Found {len(curr_notes)} notes in {file.file_name}")
             notes.extend(curr_notes)
 
         logger.debug(
-            f"Scan complete: found {len(notes)} total notes in {files_with_notes} files"
+            "Scan complete: found %s total notes in %s files",
+            len(notes),
+            files_with_notes,
         )
         return NotesManager(notes)
 
+    def scan_file(self, file: File, scanner: RegexScanner = None) -> List[Note]:
+        """
+        scans a single file, a file whose regexes time out is added to self.skipped_files
+        and has no notes. The content of the file is released afterwards
+        """
+        logger.debug("Scanning file: %s", file.file_name)
+        profiler = get_profiler()
+        file_start = time.perf_counter()
+        try:
+            curr_notes = file.scan_file(note_types=self.note_types, scanner=scanner)
+        except RegexTimeoutError as e:
+            logger.warning("⏱️  Skipping file %s: %s", file.path, e)
+            self.skipped_files.append(file)
+            return []
+        finally:
+            file.release_content()
+        if profiler is not None:
+            profiler.record_file(file.path, time.perf_counter() - file_start)
+        if curr_notes:
+            logger.debug("Found %s notes in %s", len(curr_notes), file.file_name)
+        return curr_notes
+
+    def stream_notes(
+        self, file_hashes: list[str], scanner: RegexScanner, batch_size: int
+    ) -> Iterator[NotesManager]:
+        """
+        walks the vault and scans the new or modified files as they are found, a NotesManager is
+        yielded every time batch_size notes (or changed files) have been collected.
+        While a batch is handled, self.files and self.new_files only hold its files, the caller
+        has to call finish_batch before asking for the next one.
+        The last batch is yielded even without notes, so the cache gets its final hashes
+        """
+        self.previous_hashes = set(file_hashes)
+        self.walk_complete = False
+        notes = []
+        batches = 0
+        for path in iter_files_paths(
+            self.dir,
+            exclude_dirs=self.exclude_dirs,
+            exclude_dotted_dirs=self.exclude_dotted_dirs,
+            patterns_to_exclude=self.patterns_to_exclude,
+        ):
+            file = File(path, vault_name=self.vault_name)
+            if file.original_hash in self.previous_hashes:
+                # unchanged files are never scanned, only their hash is kept
+                self.synced_hashes.append(file.original_hash)
+                continue
+            self.files.append(file)
+            self.new_files.append(file)
+            notes.extend(self.scan_file(file, scanner))
+            if len(notes) >= batch_size or len(self.new_files) >= batch_size:
+                batches += 1
+                logger.info(
+                    "📦 Batch %s of vault %s: %s notes from %s files",
+                    batches,
+                    self.vault_name,
+                    len(notes),
+                    len(self.new_files),
+                )
+                yield NotesManager(notes)
+                notes = []
+
+        self.walk_complete = True
+        if self.new_files or batches:
+            logger.info(
+                "📦 Last batch of vault %s: %s notes from %s files",
+                self.vault_name,
+                len(notes),
+                len(self.new_files),
+            )
+            yield NotesManager(notes)
+
+    def finish_batch(self, new_hashes: Dict[str, Tuple[str, Optional[str]]]) -> None:
+        """
+        keeps the hashes of the files of the handled batch, with the new hash of the files
+        edited by the executor (see PlanExecutor.new_hashes), and forgets the files themselves
+        """
+        for file in self.files:
+            if file in self.skipped_files:
+                # left out of the cache so it is scanned again in the next run
+                continue
+            path = Path(file.path).relative_to(self.dir).as_posix()
+            _, new_hash = new_hashes.get(path, (None, file.curr_hash))
+            if new_hash:
+                self.synced_hashes.append(new_hash)
+        self.files = []
+        self.new_files = []
+        self.skipped_files = []
+
+    def get_batch_file_hashes(self) -> list[str]:
+        # skipped files are left out of the cache so they are scanned again in the next run
+        return [file.curr_hash for file in self.files if file not in self.skipped_files]
+
     def get_curr_file_hashes(self):
-        return [file.curr_hash for file in self.files]
+        curr_hashes = self.synced_hashes + self.get_batch_file_hashes()
+        if not self.walk_complete:
+            # the walk of a streamed run is not over, the unchanged files not reached yet
+            # keep their cached hash so an interrupted run does not scan them again
+            known_hashes = set(curr_hashes)
+            curr_hashes += [
+                file_hash
+                for file_hash in self.previous_hashes
+                if file_hash not in known_hashes
+            ]
+        return curr_hashes
+
+
+class VaultSync:
+    """
+    what a run needs to know about one of the configured vaults:
+    its config, its hash cache, the files found in it and the notes scanned from them
+    """
+
+    config: VaultConfig
+    name: str
+    vault: Optional[VaultManager]
+    notes_manager: Optional[NotesManager]
+    media_index: Optional[MediaIndex]
+    # with change_detection: git
+    git_state: Optional[GitState]
+    git_head: Optional[str]
+    git_changes: Optional[GitChanges]  # None when the whole vault was hashed
+
+    def __init__(self, config: VaultConfig, note_types: List[NoteType]):
+        self.config = config
+        self.name = config.name
+        self.note_types = note_types
+        self.vault = None
+        self.notes_manager = None
+        self.media_index = None
+        self.git_state = None
+        self.git_head = None
+        self.git_changes = None
+
+    def find_new_files(self, full_walk: bool = False) -> VaultManager:
+        """
+        with full_walk every file of the vault is hashed, even when git could list the changed ones
+        """
+        logger.info("📂 Scanning vault %s for files...", self.name)
+        logger.debug("📄 Cache file path: %s", self.config.hashes_path)
+        hashes = open_cache(self.config.hashes_path)
+        logger.debug("📄 Loaded %s file hashes from cache", len(hashes))
+
+        if self.config.change_detection == "git" and not full_walk:
+            self.git_state = GitState.load(self.config.git_state_path)
+            self.git_head = get_head(self.config.dir_path)
+            if self.git_head is None:
+                logger.warning(
+                    "⚠️ Vault %s is not in a git repository, hashing all its files", self.name
+                )
+            elif self.git_state.commit is not None:
+                changes = find_git_changes(
+                    self.config.dir_path, self.git_state.commit, self.git_head
+                )
+                if changes is not None:
+                    return self.find_new_files_with_git(hashes, changes)
+
+        self.vault = VaultManager(
+            self.config.dir_path,
+            self.config.exclude_dirs_from_scan,
+            self.config.exclude_dotted_dirs_from_scan,
+            self.config.file_patterns_to_exclude,
+            self.note_types,
+        )
+        self.vault.set_new_files(hashes)
+        logger.info(
+            "📄 Found %s new or modified files to process in vault %s",
+            len(self.vault.new_files),
+            self.name,
+        )
+        return self.vault
+
+    def find_new_files_with_git(self, hashes: List[str], changes: GitChanges) -> VaultManager:
+        """
+        only reads the files git lists as changed since the last synchronized commit, and the
+        ones the previous run asked to read again. The other files keep their cached hash
+        """
+        paths = changes.changed | set(self.git_state.pending)
+        logger.info(
+            "🌿 git lists %s changed and %s deleted files in vault %s since commit %s",
+            len(changes.changed),
+            len(changes.deleted),
+            self.name,
+            self.git_state.commit[:10],
+        )
+        # git also lists the files whose note IDs were written but not committed yet,
+        # they keep their cached hash and are not scanned again
+        stale_hashes = Counter(
+            self.git_state.hashes[path]
+            for path in paths | changes.deleted
+            if path in self.git_state.hashes
+        )
+        self.git_changes = changes
+        return self.find_new_files_among(hashes, paths, stale_hashes)
+
+    def find_given_files(self, paths: Iterable[str]) -> VaultManager:
+        """
+        only reads the given files, relative to the vault, e.g. the ones an editor hook knows it
+        changed. The other files keep their cached hash
+        """
+        logger.info("📂 Reading the given files of vault %s...", self.name)
+        hashes = open_cache(self.config.hashes_path)
+        paths = set(paths)
+        inventory = NoteInventory.load(self.config.note_inventory_path)
+        # the hashes the files had when they were last synchronized
+        stale_hashes = Counter(
+            file_hash for file_hash, entry in inventory.files.items() if entry.path in paths
+        )
+        return self.find_new_files_among(hashes, paths, stale_hashes)
+
+    def find_new_files_among(
+        self, hashes: List[str], paths: Iterable[str], stale_hashes: Counter
+    ) -> VaultManager:
+        """
+        reads the vault files among paths, relative to the vault, without walking the vault.
+        The cached hashes count in stale_hashes are dropped from the cache, they were the hashes
+        of these files and the files get their new hash. The hashes are dropped one by one since
+        files with the same content share a hash
+        """
+        file_paths = [
+            self.config.dir_path / path
+            for path in sorted(paths)
+            if is_vault_file(
+                path,
+                self.config.exclude_dirs_from_scan,
+                self.config.exclude_dotted_dirs_from_scan,
+                self.config.file_patterns_to_exclude,
+            )
+            and (self.config.dir_path / path).is_file()
+        ]
+        self.vault = VaultManager(
+            self.config.dir_path,
+            self.config.exclude_dirs_from_scan,
+            self.config.exclude_dotted_dirs_from_scan,
+            self.config.file_patterns_to_exclude,
+            self.note_types,
+            file_paths=file_paths,
+        )
+        self.vault.set_new_files(hashes)
+        stale_hashes = stale_hashes.copy()
+        self.vault.synced_hashes = []
+        for file_hash in hashes:
+            if stale_hashes[file_hash] > 0:
+                stale_hashes[file_hash] -= 1
+            else:
+                self.vault.synced_hashes.append(file_hash)
+        logger.info(
+            "📄 Found %s new or modified files to process in vault %s",
+            len(self.vault.new_files),
+            self.name,
+        )
+        return self.vault
+
+    def record_git_state(self, new_hashes: Dict[str, Tuple[str, Optional[str]]]) -> None:
+        """
+        once the vault is synchronized, remembers the commit it was synchronized at and the hash
+        of its files. new_hashes maps the paths of the files edited by the run to their hash before
+        and after, None after for the files that could not be edited (see PlanExecutor.new_hashes).
+        The files that differ from the commit are read again by the next run even if git does not
+        list them anymore, their changes may be reverted without a commit
+        """
+        if self.config.change_detection != "git" or self.git_head is None:
+            return
+        if self.git_changes is None:
+            # the whole vault was hashed
+            self.git_state.hashes = {}
+        else:
+            for path in (
+                self.git_changes.changed | self.git_changes.deleted | set(self.git_state.pending)
+            ):
+                self.git_state.hashes.pop(path, None)
+
+        pending = set()
+        skipped = {id(file) for file in self.vault.skipped_files}
+        for file in self.vault.files:
+            path = Path(file.path).relative_to(self.config.dir_path).as_posix()
+            _, file_hash = new_hashes.get(path, (None, file.original_hash))
+            if id(file) in skipped or file_hash is None:
+                pending.add(path)
+            else:
+                self.git_state.hashes[path] = file_hash
+
+        # the note IDs written by this run are part of the changes that are not committed yet
+        dirty = find_git_changes(self.config.dir_path, self.git_head, self.git_head)
+        if dirty is None:
+            # the next run hashes the whole vault
+            self.git_state.commit = None
+        else:
+            self.git_state.commit = self.git_head
+            pending.update(
+                path
+                for path in dirty.changed | dirty.deleted
+                if is_vault_file(
+                    path,
+                    self.config.exclude_dirs_from_scan,
+                    self.config.exclude_dotted_dirs_from_scan,
+                    self.config.file_patterns_to_exclude,
+                )
+            )
+        self.git_state.pending = sorted(pending)
+        self.git_state.save()
+
+    def scan(self, scanner: RegexScanner) -> NotesManager:
+        self.notes_manager = self.vault.get_notes_from_new_files(scanner)
+        return self.notes_manager
+
+    def stream(self, scan_config: ScanConfig, batch_size: int) -> Iterator[NotesManager]:
+        """
+        yields the notes of the vault in batches while it is walked, see VaultManager.stream_notes
+        """
+        logger.info("📂 Streaming vault %s...", self.name)
+        hashes = open_cache(self.config.hashes_path)
+        logger.debug("📄 Loaded %s file hashes from cache", len(hashes))
+
+        self.vault = VaultManager(
+            self.config.dir_path,
+            self.config.exclude_dirs_from_scan,
+            self.config.exclude_dotted_dirs_from_scan,
+            self.config.file_patterns_to_exclude,
+            self.note_types,
+            stream=True,
+        )
+        with RegexScanner(
+            timeout_seconds=scan_config.file_timeout_seconds,
+            engine=scan_config.regex_engine,
+        ) as scanner:
+            for notes_manager in self.vault.stream_notes(hashes, scanner, batch_size):
+                self.notes_manager = notes_manager
+                yield notes_manager
+
+    def load_media_data(self, with_digest: bool = False) -> None:
+        if self.media_index is None:
+            # built once per run, a streamed run loads the medias of each batch with it
+            self.media_index = MediaIndex.build(
+                self.config.medias_dir_path, self.config.media_index_path
+            )
+        self.notes_manager.load_media_data(self.media_index, with_digest=with_digest)
+        # saved after the medias are loaded, so it keeps the hashes computed for them
+        self.media_index.save()
+
+    def write_cache(self) -> List[str]:
+        curr_hashes = self.vault.get_curr_file_hashes()
+        self.config.hashes_path.parent.mkdir(parents=True, exist_ok=True)
+        write_hashes_to_file(curr_hashes, self.config.hashes_path)
+        return curr_hashes
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the modules of src are imported the way obsankipy.py imports them, from the src dir
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
@@ -0,0 +1,147 @@
+"""
+the collection reader against collection.anki2 files generated with the tables it reads,
+in the current schema (decks table) and the one of anki before 2.1.28 (decks in col as JSON)
+"""
+
+import json
+import sqlite3
+import time
+
+import pytest
+
+from anki.collection_reader import AnkiCollectionReader
+
+DAY_MS = 86_400_000
+
+
+def create_collection(path, legacy_decks=False):
+    """
+    a collection with 4 notes of 2 cards each, returns the connection and the note IDs
+    """
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=wal")
+    db.execute(
+        "CREATE TABLE notes (id integer primary key, guid text, mid integer, mod integer, usn integer,"
+        " tags text, flds text, sfld integer, csum integer, flags integer, data text)"
+    )
+    db.execute("CREATE TABLE cards (id integer primary key, nid integer, did integer, ord integer)")
+    db.execute("CREATE INDEX ix_cards_nid ON cards (nid)")
+    db.execute("CREATE TABLE col (id integer primary key, decks text)")
+    now = int(time.time() * 1000)
+    notes = [
+        (now - 40 * DAY_MS, " Obsidian "),
+        (now - 2000, " Obsidian::sub other "),
+        (now - 1000, " Obsidian-removed "),
+        (now, ""),
+    ]
+    for index, (note_id, tags) in enumerate(notes):
+        db.execute("INSERT INTO notes (id, guid, tags) VALUES (?, ?, ?)", (note_id, f"g{index}", tags))
+        db.execute("INSERT INTO cards VALUES (?, ?, ?, 0)", (note_id + 1, note_id, 1 + index % 2))
+        db.execute("INSERT INTO cards VALUES (?, ?, 2, 1)", (note_id + 2, note_id))
+    decks = {1: "Default", 2: "Parent::Child", 3: "Empty"}
+    if legacy_decks:
+        db.execute(
+            "INSERT INTO col VALUES (1, ?)",
+            (json.dumps({str(deck_id): {"id": deck_id, "name": name} for deck_id, name in decks.items()}),),
+        )
+    else:
+        db.execute("CREATE TABLE decks (id integer primary key, name text)")
+        db.executemany(
+            "INSERT INTO decks VALUES (?, ?)",
+            [(deck_id, name.replace("::", "\x1f")) for deck_id, name in decks.items()],
+        )
+        db.execute("INSERT INTO col VALUES (1, '')")
+    db.commit()
+    return db, [note_id for note_id, _ in notes]
+
+
+@pytest.fixture(params=[False, True], ids=["decks_table", "legacy_col_decks"])
+def collection(request, tmp_path):
+    path = tmp_path / "collection.anki2"
+    db, note_ids = create_collection(path, legacy_decks=request.param)
+    db.close()
+    reader = AnkiCollectionReader(path)
+    yield reader, note_ids
+    reader.close()
+
+
+def test_find_notes(collection):
+    reader, note_ids = collection
+    assert reader.find_notes("") == set(note_ids)
+    # a tag search matches the children tags, not the tags that only start the same way
+    assert reader.find_notes("tag:Obsidian") == {note_ids[0], note_ids[1]}
+    assert reader.find_notes("tag:obsidian::sub") == {note_ids[1]}
+    assert reader.find_notes("tag:Obsidian-removed") == {note_ids[2]}
+    assert reader.find_notes("added:1") == set(note_ids[1:])
+    assert reader.find_notes("deck:Default") is None
+
+
+def test_find_cards(collection):
+    reader, note_ids = collection
+    assert reader.find_cards(f"nid:{note_ids[0]}") == {note_ids[0] + 1, note_ids[0] + 2}
+    assert reader.find_cards(f"nid:{note_ids[0]},{note_ids[1]}") == {
+        note_ids[0] + 1,
+        note_ids[0] + 2,
+        note_ids[1] + 1,
+        note_ids[1] + 2,
+    }
+    assert reader.find_cards("nid:x") is None
+
+
+def test_cards_of_notes_over_the_parameter_limit(collection):
+    reader, note_ids = collection
+    # more IDs than sqlite accepts parameters in a single query
+    missing = list(range(1, 2000))
+    cards = reader.cards_of_notes(missing + note_ids)
+    assert len(cards) == len(missing) + len(note_ids)
+    assert all(cards[note_id] == [] for note_id in missing)
+    assert cards[note_ids[3]] == [note_ids[3] + 1, note_ids[3] + 2]
+
+
+def test_decks(collection):
+    reader, _ = collection
+    assert sorted(reader.deck_names()) == ["Default", "Empty", "Parent::Child"]
+    assert sorted(reader._decks()) == [(1, "Default"), (2, "Parent::Child"), (3, "Empty")]
+    assert reader.count_cards(["Default"]) == 2
+    assert reader.count_cards(["Default", "Parent::Child"]) == 8
+    assert reader.count_cards(["Missing"]) == 0
+
+
+def test_media_names(tmp_path):
+    path = tmp_path / "collection.anki2"
+    create_collection(path)[0].close()
+    reader = AnkiCollectionReader(path)
+    assert reader.media_names() is None
+    (tmp_path / "collection.media").mkdir()
+    (tmp_path / "collection.media" / "a.png").write_bytes(b"png")
+    assert reader.media_names() == ["a.png"]
+    reader.close()
+
+
+def test_locked_collection_is_read_from_a_snapshot(tmp_path):
+    path = tmp_path / "collection.anki2"
+    db, note_ids = create_collection(path)
+    # a running anki holds an exclusive lock on its collection
+    db.execute("PRAGMA locking_mode=exclusive")
+    db.execute("INSERT INTO notes (id, tags) VALUES (7, '')")
+    db.commit()
+    with pytest.raises(sqlite3.OperationalError):
+        uri = f"{path.as_uri()}?mode=ro"
+        sqlite3.connect(uri, uri=True, timeout=0).execute("SELECT count() FROM notes").fetchone()
+
+    reader = AnkiCollectionReader(path)
+    assert reader.find_notes("") == set(note_ids) | {7}
+    assert reader._snapshot_dir is not None
+
+    # the snapshot is taken again once the -wal file changes
+    db.execute("INSERT INTO notes (id, tags) VALUES (8, '')")
+    db.commit()
+    assert 8 in reader.find_notes("")
+    reader.close()
+    db.close()
+
+
+def test_missing_collection(tmp_path):
+    reader = AnkiCollectionReader(tmp_path / "collection.anki2")
+    with pytest.raises(FileNotFoundError):
+        reader.find_notes("")
@@ -0,0 +1,118 @@
+"""
+differential tests of the single pass over the embeds of the fields (format_embeds_and_find_medias)
+against the separate patterns it replaced: every note of the corpus must get the same medias as
+Note.find_medias_in_text over its whole text, and the same html as format_embeds_to_html_transformer
+"""
+
+import random
+import re
+
+import pytest
+
+from files import FileNoteMetadata
+from notes.fields import FieldKind, apply_transformers, get_field_pipeline, get_file_link
+from notes.note import Note, NoteType, NoteVariant
+from notes.transformers.fields import format_embeds_to_html_transformer
+from utils.patterns import ID_REGEX_PATTERN
+
+VAULT_NAME = "vault"
+FILE_NAME = "file.md"
+
+NOTE_REGEXES = [
+    (NoteVariant.BASIC, r"(?<=#spaced)\s*\n([\s\S]*?)\n([\s\S]*?(?=\+\+\+|---|<!--|$(?![\r\n])))"),
+    (NoteVariant.BASIC, r"^Q: ((?:.+\n)*)\n*A: ([\s\S]*?(?=\+\+\+|---|<!--ID: ))"),
+    # the fields of this one do not end at a line break, an embed can continue past them
+    (NoteVariant.BASIC, r"Q:(.*?)\|A:(.*?);"),
+    (NoteVariant.CLOZE, r"((?!.*{{c\d+::[^}]*}[^}]).*{{c\d+::[^}]*}}.*\n)"),
+]
+
+EMBEDS = [
+    "![[image.png]]",
+    "![[folder/sub folder/photo.JPG]]",
+    "![[song.mp3]]",
+    "![[voice memo.ogg]]",
+    "![alt](picture.png)",
+    "![](folder/picture%20two.gif)",
+    " https://example.com/remote.png ",
+    "![https://example.com/hidden.png](local.png)",
+    "![[https://example.com/inside.png]]",
+    "![[not a media.txt]]",
+    "![[unclosed.png",
+    "![alt](http://example.com/remote.jpg)",
+    "![[a.png]]![[b.png]]",
+    "![",
+    "[[plain link]]",
+    "$x^2$",
+    "```python\nprint('![[code.png]]')\n```",
+]
+FILLERS = ["some words ", "\n", " ", "lorem ipsum dolor sit amet ", "; ", "|"]
+
+
+class SourceFile:
+    file_name = FILE_NAME
+    file_note_metadata = FileNoteMetadata("Default", VAULT_NAME, [])
+
+
+def old_render(text: str, kind: FieldKind) -> str:
+    pipeline = get_field_pipeline(VAULT_NAME, kind)
+    text = apply_transformers(format_embeds_to_html_transformer(text), pipeline.transformers)
+    if kind == FieldKind.FRONT:
+        text = text + "<br>" + get_file_link(VAULT_NAME, FILE_NAME)
+    return text
+
+
+def old_medias(note_text: str) -> list:
+    note = Note.__new__(Note)
+    note.medias = []
+    note.find_medias_in_text(note_text)
+    return [media.filename for media in note.medias]
+
+
+def random_text(rng: random.Random) -> str:
+    return "".join(rng.choice(EMBEDS + FILLERS) for _ in range(rng.randint(0, 6)))
+
+
+def corpus():
+    texts = []
+    # every embed in every position of every note regex
+    for embed in EMBEDS:
+        texts.append(
+            f"#spaced\n{embed} front\nback {embed}\n+++\n"
+            f"Q: {embed}\n\nA: {embed}\n<!--ID: 5-->\n"
+            f"Q:{embed}|A:{embed};{embed}\n"
+            f"{embed}{{{{c1::{embed}}}}}{embed}\n"
+        )
+    rng = random.Random(36)
+    for _ in range(300):
+        r = lambda: random_text(rng)
+        texts.append(
+            f"#spaced\n{r()}\n{r()}\n+++\nQ: {r()}\n\nA: {r()}\n<!--ID: 5-->\n"
+            f"Q:{r()}|A:{r()};{r()}\n{r()}{{{{c1::x}}}}{r()}\n"
+        )
+    return texts
+
+
+def notes_of(text: str):
+    for variant, regex in NOTE_REGEXES:
+        note_type = NoteType(variant, [regex])
+        for match in re.compile(regex + ID_REGEX_PATTERN, re.MULTILINE).finditer(text):
+            note = Note(match, SourceFile, "Default", note_type, SourceFile.file_note_metadata)
+            yield match, note
+
+
+@pytest.mark.parametrize("text", corpus())
+def test_single_pass_matches_the_separate_patterns(text):
+    for match, note in notes_of(text):
+        assert [media.filename for media in note.medias] == old_medias(match.group(0))
+        kinds = [FieldKind.FRONT] if len(note.fields) == 1 else [FieldKind.FRONT, FieldKind.BACK]
+        for group, (field, kind) in enumerate(zip(note.fields, kinds), start=1):
+            assert field.text == old_render(match.group(group), kind)
+
+
+def test_the_corpus_covers_the_fallback():
+    # an embed past the end of an inline field, and one hiding the start of another
+    text = "Q:front ![[a.png|A:back;\n#spaced\n![https://example.com/x.png](y.png)\nback\n"
+    notes = list(notes_of(text))
+    assert notes
+    for match, note in notes:
+        assert [media.filename for media in note.medias] == old_medias(match.group(0))
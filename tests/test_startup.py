@@ -0,0 +1,35 @@
+"""
+the startup budget: markdown (with pygments), python-frontmatter and requests are only imported
+once a field is rendered, a file is scanned or anki is contacted, so a run where nothing changed
+does not pay for them
+"""
+
+import subprocess
+import sys
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+LAZY_MODULES = ["markdown", "pygments", "frontmatter", "requests"]
+
+
+def test_heavy_modules_are_not_imported_at_startup():
+    code = (
+        "import sys\n"
+        "import obsankipy\n"
+        f"print(','.join(name for name in {LAZY_MODULES!r} if name in sys.modules))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=SRC_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == ""
+    # -X importtime lists every module imported, not only the ones left in sys.modules
+    imported = {
+        line.split("|")[-1].strip().split(".")[0]
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:")
+    }
+    assert imported.isdisjoint(LAZY_MODULES)